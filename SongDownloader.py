@@ -1,32 +1,82 @@
+import sys
+
+if __name__ == "__main__":
+    import ytdlp_pool
+    if ytdlp_pool.WORKER_FLAG in sys.argv:
+        ytdlp_pool.serve()
+        sys.exit(0)
+
 from talelle_setup import Path, TALELLE_DIR, config_log
 TALELLE_TOOL = Path(__file__).stem
 config_log(TALELLE_TOOL)
 
-import sys
 import os
 import json
-import validators
+import functools
+from threading import Thread, Lock
 
 import logging
-import downloader
 
 from PySide6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
-                               QLineEdit, QFileDialog, QComboBox, QMessageBox, QProgressBar)
-from PySide6.QtCore import Qt, QThread, QSize, Signal
+                               QLineEdit, QFileDialog, QComboBox, QMessageBox, QProgressBar, QCheckBox)
+from PySide6.QtCore import Qt, QThread, QSize, Signal, QTimer
 from PySide6.QtGui import QPixmap
 
+import bandwidth
+import ytdlp_pool
+from job_control import JobCancelled, JobControl
+from progress_bus import ProgressBus, GUI_RATE
+
 logger = logging.getLogger(__name__)
 logger.info(f'{TALELLE_TOOL} started')
 
+ICON_CACHE_DIR = os.path.join(TALELLE_DIR, 'icon_cache')
+
+
+@functools.cache
+def load_language_codes() -> dict:
+    path = 'locales/language_codes.json'
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@functools.cache
+def load_translations(language_code: str) -> dict:
+    path = f'locales/{language_code}.json'
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@functools.cache
+def load_pixmap(path: str) -> QPixmap:
+    return QPixmap(path)
+
+
+def load_scaled_pixmap(path: str, width: int, height: int) -> QPixmap:
+    name, ext = os.path.splitext(os.path.basename(path))
+    cached_path = os.path.join(ICON_CACHE_DIR, f'{name}_{width}x{height}{ext}')
+    try:
+        if os.path.getmtime(cached_path) >= os.path.getmtime(path):
+            return QPixmap(cached_path)
+    except OSError:
+        pass
+    scaled_pixmap = QPixmap(path).scaled(width, height, Qt.AspectRatioMode.KeepAspectRatio,
+                                         Qt.TransformationMode.SmoothTransformation)
+    Path(ICON_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    if not scaled_pixmap.save(cached_path):
+        logger.warning(f'could not cache scaled icon {cached_path}')
+    return scaled_pixmap
+
 
 class DownloaderThread(QThread):
     creationStarted = Signal()
     progressUpdated = Signal(int, str, str)
     creationFinished = Signal()
+    creationCancelled = Signal()
     errorOccurred = Signal(str, tuple)
 
     def __init__(self, url, audio_only, result_file,
-                 max_playlist, abort_on_long_playlist, do_postprocess):
+                 max_playlist, abort_on_long_playlist, do_postprocess, **download_options):
         super().__init__()
         self.url_to_download = url
         self.audio_only = audio_only
@@ -34,22 +84,109 @@ class DownloaderThread(QThread):
         self.max_playlist = max_playlist
         self.abort_on_long_playlist = abort_on_long_playlist
         self.do_postprocess = do_postprocess
+        self.download_options = download_options
+        self.progress_bus = ProgressBus()
+        self.progress_bus.subscribe(self.communicate_callback, GUI_RATE)
+        self.control = JobControl()
+
+    def cancel(self, keep_partial=False):
+        self.control.cancel(keep_partial)
+
+    def pause(self):
+        self.control.pause()
+
+    def resume(self):
+        self.control.resume()
 
     def run(self):
+        import downloader
         self.creationStarted.emit()
+        publisher = self.progress_bus.publisher(self.url_to_download)
         try:
             downloader.download(self.url_to_download, self.audio_only, self.file_to_create,
                                 self.max_playlist, self.abort_on_long_playlist, self.do_postprocess,
-                                self.communicate_callback)
-            self.creationFinished.emit()
+                                publisher, control=self.control, **self.download_options)
+            publisher.complete()
+        except JobCancelled:
+            self.progress_bus.close()
+            self.creationCancelled.emit()
+            return
         except ValueError as e:
+            self.progress_bus.close()
             self.errorOccurred.emit(e.args[0], e.args[1:])
+            return
+        self.progress_bus.close()
+        self.creationFinished.emit()
 
     def communicate_callback(self, value, label=None, count=None):
         self.progressUpdated.emit(value, label, count)
 
 
+class QueueThread(DownloaderThread):
+    profileCalibrated = Signal(dict, list)
+    jobStarted = Signal()
+    calibration = None
+
+    def __init__(self, queue, calibrate=False, **download_options):
+        super().__init__(None, True, None, -1, False, False, **download_options)
+        self.queue = queue
+        self.calibrate = calibrate
+
+    def start_calibration(self):
+        self.calibrate = False
+        if QueueThread.calibration and QueueThread.calibration.is_alive():
+            return
+        QueueThread.calibration = Thread(target=self.calibrate_profile, name='transcode-calibration', daemon=True)
+        QueueThread.calibration.start()
+
+    def calibrate_profile(self):
+        import transcode_profiles
+        try:
+            profile, results = transcode_profiles.calibrate(
+                self.download_options.get('transcode_profile'),
+                concurrent_jobs=self.download_options.get('transcode_workers', 1))
+        except Exception as e:
+            logger.warning('transcode calibration failed: %s', e)
+            return
+        self.download_options['transcode_profile'] = profile
+        self.profileCalibrated.emit(profile, results)
+
+    def run(self):
+        import downloader
+        self.creationStarted.emit()
+        while job := self.queue.claim():
+            logger.info(f'Running job {job.id} (attempt {job.attempts}): {job.url}')
+            if self.calibrate and job.do_postprocess and not job.audio_only:
+                self.start_calibration()
+            publisher = self.progress_bus.publisher(f'job-{job.id}')
+            self.control = JobControl(self.queue.get_archive_path(job.id), job.attempts > 1)
+            self.jobStarted.emit()
+            try:
+                downloader.download(job.url, job.audio_only, job.output_path,
+                                    job.max_playlist, job.abort_on_long_playlist, job.do_postprocess,
+                                    publisher, control=self.control, priority=job.priority, both=job.both,
+                                    sections=downloader.parse_sections(job.sections) or None,
+                                    **self.download_options)
+                self.queue.finish(job.id)
+            except JobCancelled:
+                self.queue.cancel(job.id)
+                self.creationCancelled.emit()
+            except ValueError as e:
+                self.queue.fail(job.id, e.args[0])
+                self.errorOccurred.emit(e.args[0], e.args[1:])
+            except Exception as e:
+                logger.exception(f'Job {job.id} failed')
+                self.queue.fail(job.id, str(e))
+                self.errorOccurred.emit('job_failed', (str(e),))
+            finally:
+                publisher.complete()
+        self.progress_bus.close()
+        self.creationFinished.emit()
+
+
 class SongDownloader(QWidget):
+    settingsSaveFailed = Signal(str)
+
     def __init__(self):
         super().__init__()
         settings = self.load_settings()
@@ -60,6 +197,25 @@ class SongDownloader(QWidget):
         self.audio_only = True
         self.do_postprocess = self.get_postprocess_flag(settings)
         self.max_playlist, self.abort_on_long_playlist = self.get_playlist_settings(settings)
+        self.playlist_workers = self.get_playlist_workers(settings)
+        self.download_engine = self.get_download_engine(settings)
+        self.use_media_cache = self.get_media_cache_flag(settings)
+        self.pipeline_transcode, self.transcode_workers = self.get_pipeline_settings(settings)
+        self.segmented_downloads = self.get_segmented_downloads(settings)
+        self.bandwidth_limit = self.get_bandwidth_limit(settings)
+        self.stream_audio = self.get_stream_audio_flag(settings)
+        self.dedupe_outputs = self.get_dedupe_outputs_flag(settings)
+        self.dedupe_hardlinks = self.get_dedupe_hardlinks_flag(settings)
+        self.dedupe_checked = False
+        self.transcode_profile, self.transcode_benchmark = self.get_transcode_settings(settings)
+
+        self.download_queue = None
+        self.dnwThread = None
+        self.libraryDialog = None
+        self.settings_lock = Lock()
+        self.pending_settings = None
+        self.settings_thread = None
+        self.first_paint_done = False
 
         # declare QComponent groups
         self.locale_subjects = dict()
@@ -70,9 +226,12 @@ class SongDownloader(QWidget):
         self.langComboBox = None
         self.projLineEdit = None
         self.downloadUrlLineEdit = None
+        self.clipLineEdit = None
         self.outputFileLineEdit = None
         self.outputFileHint = None
         self.processButton = None
+        self.pauseButton = None
+        self.cancelButton = None
         self.progressLabel = None
         self.progressStatus = None
         self.countLabel = None
@@ -81,6 +240,33 @@ class SongDownloader(QWidget):
         self.setup_ui()
         self.apply_settings(settings)
         self.change_language(self.current_language)
+        self.settingsSaveFailed.connect(self.warn_settings_not_saved)
+
+        QTimer.singleShot(0, self.resume_queue)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint_done:
+            self.first_paint_done = True
+            logger.info(f'{TALELLE_TOOL} first paint')
+
+    def closeEvent(self, event):
+        if self.settings_thread:
+            self.settings_thread.join()
+        if self.libraryDialog:
+            self.libraryDialog.wait_scan()
+        super().closeEvent(event)
+
+    def get_download_queue(self):
+        if self.download_queue is None:
+            import download_queue
+            self.download_queue = download_queue.DownloadQueue()
+            self.download_queue.recover()
+        return self.download_queue
+
+    def resume_queue(self):
+        if self.get_download_queue().pending_count():
+            self.start_queue()
 
     @staticmethod
     def get_settings_file():
@@ -93,13 +279,39 @@ class SongDownloader(QWidget):
             'projectFolder': self.project_folder,
             'maxPlaylistLength': self.max_playlist,
             'abortOnLongPlaylist': self.abort_on_long_playlist,
+            'playlistWorkers': self.playlist_workers,
+            'downloadEngine': self.download_engine,
+            'useMediaCache': self.use_media_cache,
+            'pipelineTranscode': self.pipeline_transcode,
+            'transcodeWorkers': self.transcode_workers,
+            'segmentedDownloads': self.segmented_downloads,
+            'bandwidthLimit': self.bandwidth_limit,
+            'streamAudio': self.stream_audio,
+            'dedupeOutputs': self.dedupe_outputs,
+            'dedupeHardlinks': self.dedupe_hardlinks,
             'doPostProcess': self.do_postprocess,
+            'transcodeProfile': self.transcode_profile,
+            'transcodeBenchmark': self.transcode_benchmark,
         }
-        try:
-            with open(self.get_settings_file(), 'w') as f:
-                json.dump(settings, f)
-        except Exception as e:
-            QMessageBox.warning(self, self.translate_key('saving_settings_warning'), str(e))
+        self.pending_settings = settings
+        self.settings_thread = Thread(target=self.write_settings, name='save-settings', daemon=True)
+        self.settings_thread.start()
+
+    def write_settings(self):
+        with self.settings_lock:
+            settings, self.pending_settings = self.pending_settings, None
+            if settings is None:
+                return
+            settings_file = self.get_settings_file()
+            try:
+                with open(f'{settings_file}.tmp', 'w') as f:
+                    json.dump(settings, f)
+                os.replace(f'{settings_file}.tmp', settings_file)
+            except Exception as e:
+                self.settingsSaveFailed.emit(str(e))
+
+    def warn_settings_not_saved(self, error):
+        QMessageBox.warning(self, self.translate_key('saving_settings_warning'), error)
 
     def load_settings(self):
         settings = {
@@ -110,6 +322,8 @@ class SongDownloader(QWidget):
                 settings.update(json.load(f))
         except FileNotFoundError:
             pass
+        except ValueError:
+            logger.warning(f'{self.get_settings_file()} is corrupt, using default settings')
         return settings
 
     @staticmethod
@@ -124,10 +338,76 @@ class SongDownloader(QWidget):
             settings.get('maxPlaylistLength', 10), \
             settings.get('abortOnLongPlaylist', True)
 
+    @staticmethod
+    def get_playlist_workers(settings) -> int:
+        return max(1, int(settings.get('playlistWorkers', 1)))
+
+    @staticmethod
+    def get_download_engine(settings) -> str:
+        engine = settings.get('downloadEngine', 'pool')
+        return engine if engine in ytdlp_pool.ENGINES else 'pool'
+
+    @staticmethod
+    def get_media_cache_flag(settings):
+        return settings.get('useMediaCache', False)
+
+    @staticmethod
+    def get_pipeline_settings(settings) -> tuple[bool, int]:
+        return \
+            settings.get('pipelineTranscode', False), \
+            max(1, int(settings.get('transcodeWorkers', 1)))
+
+    @staticmethod
+    def get_segmented_downloads(settings) -> int:
+        return max(0, int(settings.get('segmentedDownloads', 0)))
+
+    @staticmethod
+    def get_bandwidth_limit(settings) -> str:
+        limit = str(settings.get('bandwidthLimit', '0'))
+        try:
+            bandwidth.parse_rate(limit)
+        except ValueError:
+            logger.warning(f'Ignoring invalid bandwidth limit {limit!r}')
+            return '0'
+        return limit
+
+    @staticmethod
+    def get_stream_audio_flag(settings):
+        return settings.get('streamAudio', False)
+
+    @staticmethod
+    def get_dedupe_outputs_flag(settings):
+        return settings.get('dedupeOutputs', False)
+
+    @staticmethod
+    def get_dedupe_hardlinks_flag(settings):
+        return settings.get('dedupeHardlinks', False)
+
+    @staticmethod
+    def get_transcode_settings(settings) -> tuple[dict, list]:
+        return \
+            settings.get('transcodeProfile'), \
+            settings.get('transcodeBenchmark', [])
+
     @staticmethod
     def get_postprocess_flag(settings):
         return settings.get('doPostProcess', False)
 
+    def get_download_options(self) -> dict:
+        return {
+            'workers': self.playlist_workers,
+            'engine': self.download_engine,
+            'cache': self.use_media_cache,
+            'pipeline': self.pipeline_transcode,
+            'transcode_workers': self.transcode_workers,
+            'transcode_profile': self.transcode_profile,
+            'segments': self.segmented_downloads,
+            'streaming': self.stream_audio,
+            'dedupe': self.dedupe_outputs,
+            'dedupe_hardlinks': self.dedupe_hardlinks,
+            'library': True,
+        }
+
     def apply_settings(self, settings):
         self.langComboBox.setCurrentText(self.current_language)
 
@@ -140,9 +420,7 @@ class SongDownloader(QWidget):
 
     @staticmethod
     def load_language_codes():
-        path = 'locales/language_codes.json'
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return load_language_codes()
 
     @classmethod
     def load_language_names(cls):
@@ -153,9 +431,7 @@ class SongDownloader(QWidget):
     def load_translations(cls, language_name):
         language_codes = cls.load_language_codes()
         language_code = language_codes.get(language_name, "en")
-        path = f'locales/{language_code}.json'
-        with open(path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return load_translations(language_code)
 
     def translate_key(self, text_key):
         return self.translations.get(text_key, text_key)
@@ -163,15 +439,16 @@ class SongDownloader(QWidget):
     def audio_video_switch(self):
         self.audio_only = not self.audio_only
         self.outputFileHint.setVisible(not self.audio_only)
+        self.bothCheckBox.setVisible(not self.audio_only)
         self.audioVideoButton.setIcon(self.get_audio_video_pixmap())
         self.set_default_output()
         self.reset_progress()
 
     def get_audio_video_pixmap(self):
         if self.audio_only:
-            return QPixmap('images/note.png')
+            return load_pixmap('images/note.png')
         else:
-            return QPixmap('images/video.png')
+            return load_pixmap('images/video.png')
 
     def get_audio_video_format(self):
         if self.audio_only:
@@ -191,9 +468,7 @@ class SongDownloader(QWidget):
 
         # Update Logo
         logoLabel = QLabel(self)
-        logoPixmap = QPixmap('images/logo.png')
-        scaledLogoPixmap = logoPixmap.scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio,
-                                                  Qt.TransformationMode.SmoothTransformation)
+        scaledLogoPixmap = load_scaled_pixmap('images/logo.png', 100, 100)
         logoLabel.setPixmap(scaledLogoPixmap)
         logoLabel.setFixedSize(scaledLogoPixmap.size())
 
@@ -224,10 +499,13 @@ class SongDownloader(QWidget):
         projLineEdit.textChanged.connect(self.reset_progress)
         projButton = QPushButton()
         projButton.clicked.connect(self.choose_project)
+        libraryButton = QPushButton()
+        libraryButton.clicked.connect(self.show_library)
         projLayout = QHBoxLayout()
         projLayout.addWidget(projLabel)
         projLayout.addWidget(projLineEdit)
         projLayout.addWidget(projButton)
+        projLayout.addWidget(libraryButton)
         layout.addLayout(projLayout)
 
         # Url selection
@@ -240,6 +518,16 @@ class SongDownloader(QWidget):
         downloadUrlLayout.addWidget(downloadUrlLineEdit)
         layout.addLayout(downloadUrlLayout)
 
+        # Clip range selection
+        clipLabel = QLabel()
+        clipLineEdit = QLineEdit()
+        clipLineEdit.setClearButtonEnabled(True)
+        clipLineEdit.textChanged.connect(self.reset_progress)
+        clipLayout = QHBoxLayout()
+        clipLayout.addWidget(clipLabel)
+        clipLayout.addWidget(clipLineEdit)
+        layout.addLayout(clipLayout)
+
         # Output file selection
         outputFileLabel = QLabel()
         outputFileLineEdit = QLineEdit()
@@ -257,10 +545,26 @@ class SongDownloader(QWidget):
         outputFileHint.setVisible(False)
         layout.addWidget(outputFileHint)
 
+        bothCheckBox = QCheckBox()
+        bothCheckBox.setVisible(False)
+        bothCheckBox.toggled.connect(self.reset_progress)
+        layout.addWidget(bothCheckBox)
+
         # Process button
         processButton = QPushButton(self.translate_key('process_button'))
         processButton.clicked.connect(self.download)
-        layout.addWidget(processButton)
+        pauseButton = QPushButton()
+        pauseButton.setCheckable(True)
+        pauseButton.setEnabled(False)
+        pauseButton.toggled.connect(self.pause_download)
+        cancelButton = QPushButton()
+        cancelButton.setEnabled(False)
+        cancelButton.clicked.connect(self.cancel_download)
+        processLayout = QHBoxLayout()
+        processLayout.addWidget(processButton)
+        processLayout.addWidget(pauseButton)
+        processLayout.addWidget(cancelButton)
+        layout.addLayout(processLayout)
 
         # Progress Bar
         progressLabel = QLabel('')
@@ -280,25 +584,36 @@ class SongDownloader(QWidget):
         self.locale_subjects['language_label'] = languageLabel
         self.locale_subjects['project_label'] = projLabel
         self.locale_subjects['choose_project'] = projButton
+        self.locale_subjects['library_button'] = libraryButton
         self.locale_subjects['video_url'] = downloadUrlLabel
+        self.locale_subjects['clip_label'] = clipLabel
         self.locale_subjects['output_label'] = outputFileLabel
         self.locale_subjects['create_button'] = outputFileButton
         self.locale_subjects['default_name_hint'] = outputFileHint
+        self.locale_subjects['both_label'] = bothCheckBox
         self.locale_subjects['process_button'] = processButton
+        self.locale_subjects['pause_button'] = pauseButton
+        self.locale_subjects['cancel_button'] = cancelButton
 
         self.direction_subjects.append(langLayout)
         self.direction_subjects.append(projLayout)
         self.direction_subjects.append(downloadUrlLayout)
+        self.direction_subjects.append(clipLayout)
         self.direction_subjects.append(outputFileLayout)
+        self.direction_subjects.append(processLayout)
         self.direction_subjects.append(progressLayout)
 
         self.audioVideoButton = audioVideoButton
         self.langComboBox = langComboBox
         self.projLineEdit = projLineEdit
         self.downloadUrlLineEdit = downloadUrlLineEdit
+        self.clipLineEdit = clipLineEdit
         self.outputFileLineEdit = outputFileLineEdit
         self.outputFileHint = outputFileHint
+        self.bothCheckBox = bothCheckBox
         self.processButton = processButton
+        self.pauseButton = pauseButton
+        self.cancelButton = cancelButton
         self.progressLabel = progressLabel
         self.progressStatus = progressStatus
         self.countLabel = countLabel
@@ -320,6 +635,13 @@ class SongDownloader(QWidget):
 
             self.set_default_output()
 
+    def show_library(self):
+        if self.libraryDialog is None:
+            import library_browser
+            self.libraryDialog = library_browser.LibraryDialog(self.translate_key, self)
+        self.libraryDialog.retranslate(self.current_language == 'עברית')
+        self.libraryDialog.open_library(os.path.join(self.project_path, self.project_folder))
+
     def set_default_output(self):
         proj_path = self.projLineEdit.text()
         proj_name = os.path.basename(proj_path)
@@ -352,6 +674,7 @@ class SongDownloader(QWidget):
 
         for locale_key in self.locale_subjects:
             self.locale_subjects[locale_key].setText(self.translate_key(locale_key))
+        self.clipLineEdit.setPlaceholderText(self.translate_key('clip_hint'))
 
         # Update layout
         is_rtl = (language == 'עברית')
@@ -359,7 +682,10 @@ class SongDownloader(QWidget):
             direction_subject.setDirection(QHBoxLayout.Direction.RightToLeft if is_rtl else QHBoxLayout.Direction.LeftToRight)
 
     def download(self):
-        if not self.downloadUrlLineEdit.text() or not validators.url(self.downloadUrlLineEdit.text()):
+        import downloader
+        import validators
+        urls = self.downloadUrlLineEdit.text().split()
+        if not urls or not all(validators.url(url) for url in urls):
             QMessageBox.warning(self, self.translate_key('error_title'), self.translate_key('url_not_valid'))
             return
 
@@ -370,27 +696,95 @@ class SongDownloader(QWidget):
             QMessageBox.warning(self, self.translate_key('error_title'), self.translate_key('output_path_not_found'))
             return
 
-        external_url = self.downloadUrlLineEdit.text()
+        sections = self.clipLineEdit.text().strip()
+        try:
+            downloader.parse_sections(sections)
+        except ValueError:
+            QMessageBox.warning(self, self.translate_key('error_title'),
+                                self.translate_key('invalid_sections').format(sections))
+            return
+
         output_path = self.outputFileLineEdit.text()
+        if len(urls) > 1 and not os.path.isdir(output_path):
+            output_path = os.path.dirname(output_path)
+        self.check_dedupe()
 
         try:
-            self.dnwThread = DownloaderThread(
-                external_url, self.audio_only, output_path,
-                self.max_playlist, self.abort_on_long_playlist, self.do_postprocess)
-            self.dnwThread.creationStarted.connect(self.on_download_started)
-            self.dnwThread.progressUpdated.connect(self.update_progress_bar)
-            self.dnwThread.creationFinished.connect(self.on_download_finished)
-            self.dnwThread.errorOccurred.connect(self.raise_an_error)
-            self.dnwThread.start()
+            for external_url in urls:
+                self.get_download_queue().add(external_url, self.audio_only, output_path,
+                                        self.max_playlist, self.abort_on_long_playlist, self.do_postprocess,
+                                        sections=sections, both=not self.audio_only and self.bothCheckBox.isChecked())
+            self.start_queue()
         except Exception as e:
             error_message = f"{self.translate_key('video_creation_failed')} {str(e)}"
             QMessageBox.warning(self, self.translate_key('error_title'), error_message)
 
+    def check_dedupe(self):
+        if not self.dedupe_outputs or self.dedupe_checked:
+            return
+        import media_store
+        self.dedupe_checked = True
+        if media_store.MediaStore(hardlinks=self.dedupe_hardlinks).link_mode == 'inactive':
+            QMessageBox.information(self, self.translate_key('dedupe_title'), self.translate_key('dedupe_inactive'))
+
+    def start_queue(self):
+        if self.dnwThread and self.dnwThread.isRunning():
+            return
+        bandwidth.set_limit(self.bandwidth_limit)
+        if self.download_engine == 'pool' and ytdlp_pool.available():
+            ytdlp_pool.get_pool().prewarm()
+        needs_calibration = bool(self.transcode_profile and self.transcode_profile.get('auto')
+                                 and not self.transcode_benchmark)
+        self.dnwThread = QueueThread(self.get_download_queue(), needs_calibration,
+                                     **self.get_download_options())
+        self.dnwThread.profileCalibrated.connect(self.on_profile_calibrated)
+        self.dnwThread.creationStarted.connect(self.on_download_started)
+        self.dnwThread.jobStarted.connect(self.on_job_started)
+        self.dnwThread.progressUpdated.connect(self.update_progress_bar)
+        self.dnwThread.creationFinished.connect(self.on_download_finished)
+        self.dnwThread.creationCancelled.connect(self.on_download_cancelled)
+        self.dnwThread.errorOccurred.connect(self.raise_an_error)
+        self.dnwThread.start()
+
+
+    def on_profile_calibrated(self, profile, results):
+        self.transcode_profile = profile
+        self.transcode_benchmark = results
+        self.save_settings(self.current_language)
 
     def on_download_started(self):
-        self.processButton.setEnabled(False)
         self.save_settings(self.current_language)
         self.set_progress_status('creation')
+        self.set_job_controls(True)
+
+    def on_job_started(self):
+        self.set_job_controls(True)
+
+    def set_job_controls(self, running):
+        self.pauseButton.blockSignals(True)
+        self.pauseButton.setChecked(False)
+        self.pauseButton.blockSignals(False)
+        self.pauseButton.setText(self.translate_key('pause_button'))
+        self.pauseButton.setEnabled(running)
+        self.cancelButton.setEnabled(running)
+
+    def pause_download(self, paused):
+        if not (self.dnwThread and self.dnwThread.isRunning()):
+            return
+        if paused:
+            self.dnwThread.pause()
+        else:
+            self.dnwThread.resume()
+        self.pauseButton.setText(self.translate_key('resume_button' if paused else 'pause_button'))
+
+    def cancel_download(self):
+        if self.dnwThread and self.dnwThread.isRunning():
+            self.dnwThread.cancel()
+            self.set_job_controls(True)
+
+    def on_download_cancelled(self):
+        self.reset_progress()
+        self.set_progress_status('cancelled')
 
     def set_progress_status(self, status='', count=''):
         self.progressStatus = status
@@ -408,12 +802,21 @@ class SongDownloader(QWidget):
             self.set_progress_status(label, count)
 
     def on_download_finished(self):
+        if self.get_download_queue().pending_count():
+            self.dnwThread.wait()
+            self.start_queue()
+            return
+        self.set_job_controls(False)
+        if self.progressStatus == 'cancelled':
+            self.processButton.setEnabled(True)
+            return
         self.set_progress_status('finished')
         self.processButton.setEnabled(True)
         QMessageBox.information(self, self.translate_key('success_title'), self.translate_key('success_message'),
                                 QMessageBox.StandardButton.Ok)
 
     def raise_an_error(self, err_key, arr_args):
+        self.set_job_controls(False)
         self.reset_progress()
         self.processButton.setEnabled(True)
         QMessageBox.warning(self, self.translate_key('error_title'), self.translate_key(err_key).format(*arr_args))
@@ -0,0 +1,275 @@
+import contextlib
+import logging
+import re
+import time
+from threading import Lock
+from typing import Optional, Callable, Union
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_WEIGHTS = {'background': 1.0, 'normal': 4.0, 'interactive': 16.0}
+REBALANCE_INTERVAL = 2.0
+SAMPLE_INTERVAL = 0.5
+THROUGHPUT_HALF_LIFE = 3.0
+SATISFIED_RATIO = 0.8
+HEADROOM = 1.25
+MIN_RATE = 16 * 1024
+BURST_SECONDS = 1.0
+MIN_PACE = 0.05
+RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+RATE_PATTERN = re.compile('(?P<value>\\d+(\\.\\d+)?)\\s*(?P<unit>[KMG]?)(i?B)?(/s)?', re.IGNORECASE)
+
+
+def parse_rate(value: Union[str, int, float, None]) -> int:
+    if not value:
+        return 0
+    if isinstance(value, (int, float)):
+        return max(0, int(value))
+    if not (match := RATE_PATTERN.fullmatch(value.strip())):
+        raise ValueError('invalid_rate', value)
+    return int(float(match.group('value')) * RATE_UNITS[match.group('unit').upper()])
+
+
+def priority_class(priority: Union[str, int]) -> str:
+    if isinstance(priority, str):
+        if priority not in PRIORITY_WEIGHTS:
+            raise ValueError('unknown_priority', priority)
+        return priority
+    if priority > 0:
+        return 'interactive'
+    return 'background' if priority < 0 else 'normal'
+
+
+class ShareStream:
+    def __init__(self, share: 'JobShare', on_rate: Optional[Callable] = None, pace: Optional[Callable] = None):
+        self.share = share
+        self.on_rate = on_rate
+        self.pace = pace
+        self.lock = Lock()
+        self.opened = time.monotonic()
+        self.tokens = 0.0
+        self.refilled = self.opened
+        self.last_total = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.share.stream_rate()
+
+    def notify(self, rate: float):
+        if self.on_rate:
+            try:
+                self.on_rate(rate)
+            except Exception:
+                logger.exception('applying bandwidth rate failed')
+
+    def transferred(self, count: float):
+        if count <= 0:
+            return
+        self.share.add(count)
+        rate = self.rate
+        with self.lock:
+            now = time.monotonic()
+            if not rate:
+                self.tokens, self.refilled = 0.0, now
+                return
+            self.tokens = min(rate * BURST_SECONDS, self.tokens + (now - self.refilled) * rate) - count
+            self.refilled = now
+            delay = -self.tokens / rate if self.tokens < 0 else 0.0
+        if self.pace and delay >= MIN_PACE:
+            self.pace(delay)
+
+    def update_total(self, done: float):
+        with self.lock:
+            count = done - self.last_total if done >= self.last_total else done
+            self.last_total = done
+        self.transferred(count)
+
+    def close(self):
+        self.share.close_stream(self)
+
+
+class JobShare:
+    def __init__(self, scheduler: 'BandwidthScheduler', job_id: str, priority: str):
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.priority = priority
+        self.weight = PRIORITY_WEIGHTS[priority]
+        self.lock = Lock()
+        self.rate = 0.0
+        self.streams = list()
+        self.bytes = 0
+        self.throughput = 0.0
+        self.started = time.monotonic()
+        self.sampled = self.started
+        self.sample_bytes = 0
+        self.window_started = self.started
+        self.window_bytes = 0
+
+    def stream(self, on_rate: Optional[Callable] = None, pace: Optional[Callable] = None) -> ShareStream:
+        stream = ShareStream(self, on_rate, pace)
+        with self.lock:
+            self.streams.append(stream)
+        self.scheduler.rebalance()
+        return stream
+
+    def close_stream(self, stream: ShareStream):
+        with self.lock:
+            if stream not in self.streams:
+                return
+            self.streams.remove(stream)
+        self.scheduler.rebalance()
+
+    def stream_rate(self) -> float:
+        with self.lock:
+            return self.rate / max(1, len(self.streams))
+
+    def set_rate(self, rate: float):
+        with self.lock:
+            changed = rate != self.rate
+            self.rate = rate
+            streams = list(self.streams)
+            stream_rate = rate / max(1, len(streams))
+        if changed:
+            logger.debug('bandwidth of %s set to %.0f B/s over %d streams', self.job_id, rate, len(streams))
+        for stream in streams:
+            stream.notify(stream_rate)
+
+    def sample(self, now: float):
+        elapsed = now - self.sampled
+        if elapsed < SAMPLE_INTERVAL:
+            return
+        alpha = 1 - 0.5 ** (elapsed / THROUGHPUT_HALF_LIFE)
+        self.throughput += alpha * (self.sample_bytes / elapsed - self.throughput)
+        self.sampled, self.sample_bytes = now, 0
+
+    def add(self, count: float):
+        with self.lock:
+            self.bytes += count
+            self.sample_bytes += count
+            self.window_bytes += count
+            self.sample(time.monotonic())
+        self.scheduler.maybe_rebalance()
+
+    def demand(self) -> Optional[float]:
+        with self.lock:
+            now = time.monotonic()
+            window = now - self.window_started
+            used = self.window_bytes / window if window > 0 else 0.0
+            self.window_started, self.window_bytes = now, 0
+            if not self.streams:
+                return 0.0
+            settled = window >= REBALANCE_INTERVAL and \
+                now - max(stream.opened for stream in self.streams) >= REBALANCE_INTERVAL
+            if self.rate and settled and used < SATISFIED_RATIO * self.rate:
+                return used * HEADROOM
+            return None
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            self.sample(time.monotonic())
+            return {
+                'job_id': self.job_id,
+                'priority': self.priority,
+                'weight': self.weight,
+                'rate': round(self.rate),
+                'throughput': round(self.throughput),
+                'bytes': int(self.bytes),
+                'streams': len(self.streams),
+            }
+
+
+@contextlib.contextmanager
+def open_stream(share: Optional[JobShare], on_rate: Optional[Callable] = None, pace: Optional[Callable] = None):
+    if share is None:
+        yield None
+        return
+    stream = share.stream(on_rate, pace)
+    try:
+        yield stream
+    finally:
+        stream.close()
+
+
+def allocate(limit: float, shares: list[JobShare]) -> dict[JobShare, float]:
+    if not limit:
+        return {share: 0.0 for share in shares}
+    rates = dict()
+    remaining = float(limit)
+    active = {share: share.demand() for share in shares}
+    while active:
+        total_weight = sum(share.weight for share in active)
+        fair = {share: remaining * share.weight / total_weight for share in active}
+        satisfied = [share for share, demand in active.items() if demand is not None and demand < fair[share]]
+        if not satisfied:
+            rates.update(fair)
+            break
+        for share in satisfied:
+            rates[share] = active.pop(share)
+            remaining -= rates[share]
+    return {share: max(MIN_RATE, rate) for share, rate in rates.items()}
+
+
+class BandwidthScheduler:
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.lock = Lock()
+        self.rebalancing = Lock()
+        self.shares = list()
+        self.rebalanced = 0.0
+
+    def set_limit(self, limit: Union[str, int, None]):
+        self.limit = parse_rate(limit)
+        logger.info(f'Bandwidth limit set to {self.limit or "unlimited"} B/s')
+        self.rebalance()
+
+    def register(self, job_id: str, priority: Union[str, int] = 0) -> JobShare:
+        share = JobShare(self, job_id, priority_class(priority))
+        with self.lock:
+            self.shares.append(share)
+        self.rebalance()
+        return share
+
+    def unregister(self, share: JobShare):
+        with self.lock:
+            if share not in self.shares:
+                return
+            self.shares.remove(share)
+        logger.info('Job %s transferred %d bytes at %.0f B/s (%s)', share.job_id, share.bytes,
+                    share.throughput, share.priority)
+        self.rebalance()
+
+    def maybe_rebalance(self):
+        if self.limit and time.monotonic() - self.rebalanced >= REBALANCE_INTERVAL:
+            self.rebalance()
+
+    def rebalance(self):
+        with self.rebalancing:
+            with self.lock:
+                self.rebalanced = time.monotonic()
+                shares = list(self.shares)
+            for share, rate in allocate(self.limit, shares).items():
+                share.set_rate(rate)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            shares = list(self.shares)
+        return {'limit': self.limit, 'jobs': [share.as_dict() for share in shares]}
+
+
+_scheduler = BandwidthScheduler()
+
+
+def set_limit(limit: Union[str, int, None]):
+    _scheduler.set_limit(limit)
+
+
+def register(job_id: str, priority: Union[str, int] = 0) -> JobShare:
+    return _scheduler.register(job_id, priority)
+
+
+def unregister(share: JobShare):
+    _scheduler.unregister(share)
+
+
+def snapshot() -> dict:
+    return _scheduler.snapshot()
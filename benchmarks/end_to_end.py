@@ -0,0 +1,224 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(ROOT_DIR, 'benchmarks')
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, 'baselines')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fake_tools
+
+SCENARIOS = {
+    'single-audio': {'audio_only': True, 'do_postprocess': False, 'playlist': 0},
+    'single-video': {'audio_only': False, 'do_postprocess': True, 'playlist': 0},
+    'playlist-audio': {'audio_only': True, 'do_postprocess': False, 'workers': 1},
+    'playlist-audio-parallel': {'audio_only': True, 'do_postprocess': False, 'workers': 4},
+    'playlist-pipeline': {'audio_only': True, 'do_postprocess': False, 'workers': 2, 'pipeline': True,
+                          'transcode_workers': 2},
+    'playlist-both': {'audio_only': False, 'do_postprocess': True, 'both': True},
+    'playlist-streaming': {'audio_only': True, 'do_postprocess': False, 'workers': 4, 'streaming': True},
+}
+LOWER_IS_BETTER = ('latency', 'overhead', 'peak_threads', 'max_rss', 'peak_heap', 'child_cpu')
+HIGHER_IS_BETTER = ('parse_rate',)
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval: float = 0.005):
+        super().__init__(name='benchmark-sampler', daemon=True)
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.peak_threads = 0
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+
+    def stop(self) -> int:
+        self.stopping.set()
+        self.join()
+        return self.peak_threads
+
+
+def get_max_rss() -> int:
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def get_child_cpu() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def ideal_seconds(scenario: dict, args) -> float:
+    items = max(1, scenario.get('playlist', args.playlist))
+    transfer = args.lines / args.line_rate if args.line_rate else 0.0
+    transcode = args.blocks / args.block_rate if args.block_rate else 0.0
+    if not (scenario['audio_only'] or scenario['do_postprocess'] or scenario.get('pipeline')):
+        transcode = 0.0
+    if scenario.get('both'):
+        transcode *= 2 if scenario['do_postprocess'] else 1
+    if scenario.get('streaming'):
+        return math.ceil(items / scenario.get('workers', 1)) * transfer
+    if scenario.get('pipeline'):
+        return math.ceil(items / scenario['workers']) * transfer + transcode
+    return math.ceil(items / scenario.get('workers', 1)) * (transfer + transcode)
+
+
+def run_scenario(name: str, scenario: dict, args, work_dir: str) -> dict:
+    import downloader
+
+    playlist = scenario.get('playlist', args.playlist)
+    os.environ['TALELLE_FAKE_PLAYLIST'] = str(playlist)
+    output_path = os.path.join(work_dir, name)
+    os.makedirs(output_path, exist_ok=True)
+    events = [0]
+
+    def progress_callback(value: int, label: str = None, count: str = None):
+        events[0] += 1
+
+    options = {key: value for key, value in scenario.items() if key not in ('audio_only', 'do_postprocess', 'playlist')}
+    if args.trace_memory:
+        tracemalloc.start()
+    sampler = Sampler()
+    sampler.start()
+    child_cpu = get_child_cpu()
+    started = time.perf_counter()
+    downloader.download(f'https://fake.invalid/{name}', scenario['audio_only'], output_path,
+                        max_playlist=max(playlist, 1), do_postprocess=scenario['do_postprocess'],
+                        progress_callback=progress_callback, metrics=False, engine='cli', **options)
+    latency = time.perf_counter() - started
+    peak_threads = sampler.stop()
+    peak_heap = 0
+    if args.trace_memory:
+        peak_heap = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    items = max(1, playlist)
+    uses_ffmpeg = scenario['audio_only'] or scenario['do_postprocess']
+    lines = items * (args.lines + len(fake_tools.RECORDED_PREAMBLE) + 1)
+    if uses_ffmpeg:
+        lines += items * args.blocks * fake_tools.BLOCK_LINES * (2 if scenario.get('both') else 1)
+    return {
+        'latency': round(latency, 4),
+        'overhead': round(max(0.0, latency - ideal_seconds(scenario, args)), 4),
+        'parse_rate': round(lines / latency),
+        'events': events[0],
+        'peak_threads': peak_threads,
+        'max_rss': get_max_rss(),
+        'peak_heap': peak_heap,
+        'child_cpu': round(get_child_cpu() - child_cpu, 3),
+    }
+
+
+def median_result(results: list[dict]) -> dict:
+    return {key: sorted(result[key] for result in results)[len(results) // 2] for key in results[0]}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = list()
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        for key, value in result.items():
+            old = baseline[name].get(key)
+            if not old or key not in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+                continue
+            change = (value - old) / old
+            worse = change > threshold if key in LOWER_IS_BETTER else change < -threshold
+            marker = 'REGRESSION' if worse else ''
+            print(f'{name:>24} {key:>12}: {old:>14,} -> {value:>14,} ({change:+7.1%}) {marker}')
+            if worse:
+                regressions.append(f'{name} {key}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end download benchmarks against fake yt-dlp/ffmpeg')
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--playlist', type=int, default=8, help='items per playlist scenario')
+    parser.add_argument('--lines', type=int, default=200, help='yt-dlp progress lines per item')
+    parser.add_argument('--line-rate', type=float, default=0, help='yt-dlp lines per second, 0 for unthrottled')
+    parser.add_argument('--blocks', type=int, default=50, help='ffmpeg -progress blocks per transcode')
+    parser.add_argument('--block-rate', type=float, default=0, help='ffmpeg blocks per second, 0 for unthrottled')
+    parser.add_argument('--recording', help='replay these recorded yt-dlp stdout lines for every item')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--trace-memory', action='store_true', help='also record the peak Python heap')
+    parser.add_argument('--save', metavar='NAME', help='save the results as a named baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative change reported as a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='talelle_e2e_') as work_dir:
+        os.environ['HOME'] = os.environ['USERPROFILE'] = work_dir
+        os.environ['PATH'] = os.pathsep.join((fake_tools.install(os.path.join(work_dir, 'bin')),
+                                              os.environ.get('PATH', '')))
+        os.environ.update({
+            'TALELLE_FAKE_LINES': str(args.lines), 'TALELLE_FAKE_LINE_RATE': str(args.line_rate),
+            'TALELLE_FAKE_BLOCKS': str(args.blocks), 'TALELLE_FAKE_BLOCK_RATE': str(args.block_rate),
+        })
+        if args.recording:
+            os.environ['TALELLE_FAKE_RECORDING'] = os.path.abspath(args.recording)
+            with open(args.recording, 'r') as f:
+                args.lines = sum(1 for _ in f) - len(fake_tools.RECORDED_PREAMBLE)
+        sys.path.insert(0, ROOT_DIR)
+
+        results = dict()
+        for name in args.scenario:
+            runs = [run_scenario(name, SCENARIOS[name], args, os.path.join(work_dir, f'run{i}'))
+                    for i in range(args.repeat)]
+            results[name] = result = median_result(runs)
+            print(f'{name:>24}: {result["latency"] * 1000:8.1f} ms, overhead {result["overhead"] * 1000:8.1f} ms, '
+                  f'{result["parse_rate"]:>10,} lines/s, {result["events"]:>5} events, '
+                  f'{result["peak_threads"]:>3} threads, rss {result["max_rss"] / 1024 ** 2:6.1f} MiB'
+                  + (f', heap {result["peak_heap"] / 1024:8.1f} KiB' if args.trace_memory else ''))
+
+    record = {
+        'revision': get_revision(),
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: getattr(args, key) for key in ('playlist', 'lines', 'line_rate', 'blocks', 'block_rate')},
+        'results': results,
+    }
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f'{args.save}.json'), 'w') as f:
+            json.dump(record, f, indent=2)
+        print(f'baseline saved as {args.save}')
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f'{args.compare}.json'), 'r') as f:
+            baseline = json.load(f)
+        if baseline['config'] != record['config']:
+            print(f'warning: baseline was recorded with {baseline["config"]}')
+        if regressions := compare(results, baseline['results'], args.threshold):
+            print(f'{len(regressions)} regressions against {args.compare} ({baseline["revision"]})')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
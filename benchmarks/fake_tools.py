@@ -0,0 +1,232 @@
+import json
+import os
+import re
+import socket
+import sys
+import time
+from typing import Optional
+
+VERSIONS = {
+    'yt-dlp': '2025.01.15',
+    'ffmpeg': 'ffmpeg version 7.1-fake Copyright (c) 2000-2024 the FFmpeg developers',
+    'ffprobe': 'ffprobe version 7.1-fake Copyright (c) 2007-2024 the FFmpeg developers',
+}
+ENCODERS = (
+    ' V....D libx265              libx265 H.265 / HEVC (codec hevc)',
+    ' A....D aac                  AAC (Advanced Audio Coding)',
+    ' A....D libmp3lame           libmp3lame MP3 (MPEG audio layer 3) (codec mp3)',
+)
+RECORDED_PREAMBLE = (
+    '[youtube] Extracting URL: {url}',
+    '[youtube] {video_id}: Downloading webpage',
+    '[youtube] {video_id}: Downloading ios player API JSON',
+    '[youtube] {video_id}: Downloading m3u8 information',
+    '[info] {video_id}: Downloading 1 format(s): 251',
+    '[download] Destination: {path}',
+)
+RECORDED_PROGRESS = '[download] {percent:5.1f}% of    3.45MiB at    {speed:.2f}MiB/s ETA 00:{eta:02d}'
+FFMPEG_PROGRESS_BLOCK = (
+    'frame={frame}\n'
+    'fps=60.00\n'
+    'bitrate= 256.0kbits/s\n'
+    'total_size={size}\n'
+    'out_time_us={out_time}\n'
+    'out_time_ms={out_time}\n'
+    'out_time=00:00:01.000000\n'
+    'dup_frames=0\n'
+    'drop_frames=0\n'
+    'speed=2.00x\n'
+    'progress={progress}\n'
+)
+BLOCK_LINES = FFMPEG_PROGRESS_BLOCK.count('\n')
+AUTONUMBER_PREFIX = '%(playlist_autonumber|)s%(playlist_autonumber&_|)s'
+TEMPLATE_FIELD = re.compile('%\\((?P<field>[^)]*)\\)[sSdf]')
+
+
+def config(name: str, default: float) -> float:
+    return float(os.environ.get(f'TALELLE_FAKE_{name}', default))
+
+
+PLAYLIST = int(config('PLAYLIST', 0))
+LINES = int(config('LINES', 100))
+LINE_RATE = config('LINE_RATE', 0)
+BLOCKS = int(config('BLOCKS', 20))
+BLOCK_RATE = config('BLOCK_RATE', 0)
+DURATION = config('DURATION', 180)
+SIZE = int(config('SIZE', 64 * 1024))
+RECORDING = os.environ.get('TALELLE_FAKE_RECORDING')
+
+
+def pace(rate: float):
+    if rate:
+        time.sleep(1 / rate)
+
+
+def get_arg(args: list[str], name: str, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def get_items(args: list[str]) -> list[int]:
+    if not PLAYLIST:
+        return [0]
+    selection = get_arg(args, '--playlist-items', '1:-1')
+    start, _, end = selection.partition(':')
+    if not _:
+        return [int(start)] if 1 <= int(start) <= PLAYLIST else []
+    end = int(end) if end else PLAYLIST
+    end = PLAYLIST + end + 1 if end < 0 else min(end, PLAYLIST)
+    return list(range(int(start or 1), end + 1))
+
+
+def get_sections(args: list[str]) -> list[tuple[float, float]]:
+    sections = list()
+    for i, arg in enumerate(args):
+        if arg == '--download-sections':
+            start, _, end = args[i + 1].removeprefix('*').partition('-')
+            sections.append((float(start), min(float(end), DURATION)))
+    return sections
+
+
+def render(template: str, item: int, autonumber: int, ext: str,
+           section: Optional[tuple[float, float]] = None) -> str:
+    template = template.replace(AUTONUMBER_PREFIX, f'{autonumber}_' if item else '')
+    values = {'title': f'Fake Song {item}', 'ext': ext, 'id': f'fake{item:05d}'}
+    if section:
+        values.update(section_start=str(int(section[0])), section_end=str(int(section[1])))
+    return TEMPLATE_FIELD.sub(lambda match: values.get(match.group('field'), ''), template)
+
+
+def write_file(path: str, size: int = SIZE):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+
+def progress_lines(url: str, item: int, path: str) -> list[str]:
+    if RECORDING:
+        with open(RECORDING, 'r') as f:
+            return [line.rstrip('\n') for line in f]
+    preamble = [line.format(url=url, video_id=f'fake{item:05d}', path=path) for line in RECORDED_PREAMBLE]
+    return preamble + [RECORDED_PROGRESS.format(percent=100 * i / LINES, speed=2.31, eta=max(0, LINES - i) % 60)
+                       for i in range(1, LINES + 1)]
+
+
+def ffmpeg_progress(write, duration: float = DURATION):
+    for i in range(1, BLOCKS + 1):
+        write(FFMPEG_PROGRESS_BLOCK.format(frame=i * 30, size=i * 4096, out_time=int(duration * 1e6 * i / BLOCKS),
+                                           progress='end' if i == BLOCKS else 'continue'))
+        pace(BLOCK_RATE)
+
+
+def send_progress(progress_url: str, duration: float = DURATION):
+    host, port = progress_url.removeprefix('http://').rsplit(':', 1)
+    with socket.create_connection((host, int(port))) as connection:
+        ffmpeg_progress(lambda block: connection.sendall(block.encode()), duration)
+
+
+def yt_dlp(args: list[str]):
+    if '--version' in args:
+        print(VERSIONS['yt-dlp'])
+        return 0
+    url = args[-1] if not args[-1].startswith('-') else ''
+    if '--flat-playlist' in args:
+        for item in get_items(args):
+            print(f'{item} {PLAYLIST} Youtube fake{item:05d} {int(DURATION)} Fake Song {item}')
+        return 0
+    prints = [args[i + 1] for i, arg in enumerate(args) if arg == '--print']
+    if any(value.startswith('%(.{') for value in prints):
+        for item in get_items(args):
+            path = render(get_arg(args, '-o'), item, item, 'webm')
+            print(json.dumps({'url': f'fake://{item}', 'http_headers': {}, 'protocol': 'fake', 'filename': path}))
+        return 0
+
+    output = get_arg(args, '-o')
+    streaming = output == '-'
+    screen = sys.stderr if streaming else sys.stdout
+    extract_audio = '-x' in args
+    audio_only = extract_audio or get_arg(args, '--format') == 'bestaudio/best'
+    postprocessor_args = [args[i + 1] for i, arg in enumerate(args) if arg == '--postprocessor-args']
+    progress_url = next((value.split('-progress ', 1)[1] for value in postprocessor_args
+                         if value.startswith('ffmpeg:-progress ')), None)
+    items = get_items(args)
+    sections = get_sections(args)
+    for autonumber, item, section in ((autonumber, item, section)
+                                      for autonumber, item in enumerate(items, start=1)
+                                      for section in sections or [None]):
+        ext = 'mp3' if extract_audio else 'webm' if audio_only else 'mp4'
+        duration = section[1] - section[0] if section else DURATION
+        clip = f', clip:{duration:f}' if section else ''
+        print(f'duration:{DURATION:f}, current:{autonumber}, total:{len(items)}, length:{PLAYLIST or 1}, '
+              f'max-playlist:-1, abort-on-long:0{clip}', file=screen, flush=True)
+        target = None
+        if streaming:
+            target = next(value for value in prints if value.startswith('before_dl:target:'))
+            target = render(target.removeprefix('before_dl:'), item, autonumber, ext)
+            print(target, file=screen, flush=True)
+            path = '-'
+        else:
+            path = render(output, item, autonumber, ext, section)
+        chunk = SIZE // max(1, LINES)
+        for line in progress_lines(url, item, path):
+            print(line, file=screen, flush=True)
+            if streaming:
+                sys.stdout.buffer.write(b'\0' * chunk)
+                sys.stdout.flush()
+            pace(LINE_RATE)
+        if streaming:
+            continue
+        write_file(path)
+        if progress_url and (extract_audio or '--use-postprocessor' in args):
+            send_progress(progress_url, duration)
+        print(f'saved:{path}', flush=True)
+    return 0
+
+
+def ffmpeg(args: list[str]):
+    if '-version' in args:
+        print(VERSIONS['ffmpeg'])
+        return 0
+    if '-encoders' in args:
+        print('Encoders:\n V..... = Video\n A..... = Audio\n ------')
+        print('\n'.join(ENCODERS))
+        return 0
+    source, target = get_arg(args, '-i'), args[-1]
+    if source == 'pipe:0':
+        while sys.stdin.buffer.read(65536):
+            pass
+    elif not os.path.isfile(source):
+        print(f'{source}: No such file or directory', file=sys.stderr)
+        return 1
+    if get_arg(args, '-progress') == 'pipe:1':
+        ffmpeg_progress(lambda block: (sys.stdout.write(block), sys.stdout.flush()))
+    write_file(target)
+    return 0
+
+
+def ffprobe(args: list[str]):
+    if '-version' in args:
+        print(VERSIONS['ffprobe'])
+        return 0
+    print(f'{DURATION:f}')
+    return 0
+
+
+TOOLS = {'yt-dlp': yt_dlp, 'ffmpeg': ffmpeg, 'ffprobe': ffprobe}
+
+
+def install(bin_dir: str) -> str:
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for tool in TOOLS:
+        if os.name == 'nt':
+            with open(os.path.join(bin_dir, f'{tool}.cmd'), 'w') as f:
+                f.write(f'@"{sys.executable}" "{script}" {tool} %*\n')
+            continue
+        path = os.path.join(bin_dir, tool)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "$@"\n')
+        os.chmod(path, 0o755)
+    return bin_dir
+
+
+if __name__ == '__main__':
+    sys.exit(TOOLS[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,68 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def show_window():
+    sys.path.insert(0, ROOT_DIR)
+    from PySide6.QtCore import QEvent, QObject, QTimer
+    from PySide6.QtWidgets import QApplication
+    import SongDownloader
+
+    class FirstPaintFilter(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Type.Paint and watched is window:
+                window.removeEventFilter(self)
+                QTimer.singleShot(0, lambda: (print('first-paint', flush=True), QApplication.quit()))
+            return False
+
+    SongDownloader.SongDownloader.resume_queue = lambda self: None
+    app = QApplication(sys.argv[:1])
+    window = SongDownloader.SongDownloader()
+    first_paint_filter = FirstPaintFilter()
+    window.installEventFilter(first_paint_filter)
+    window.show()
+    app.exec()
+
+
+def measure_first_paint(timeout: float) -> float:
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--show-window'], cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for line in process.stdout:
+            if line.strip() == b'first-paint':
+                return time.perf_counter() - started
+        raise RuntimeError(f'SongDownloader exited with {process.wait()} before the first paint')
+    finally:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SongDownloader time-to-first-paint')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--show-window', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.show_window:
+        show_window()
+        return
+
+    timings = [measure_first_paint(args.timeout) for _ in range(args.runs)]
+    print(f'time to first paint: median {statistics.median(timings) * 1000:.0f} ms, '
+          f'min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms over {args.runs} runs')
+
+
+if __name__ == '__main__':
+    main()
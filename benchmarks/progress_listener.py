@@ -0,0 +1,84 @@
+import argparse
+import os
+import socket
+import sys
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import downloader
+
+FFMPEG_PROGRESS_BLOCK = (
+    'frame=120\n'
+    'fps=60.00\n'
+    'stream_0_0_q=28.0\n'
+    'bitrate= 256.0kbits/s\n'
+    'total_size=393216\n'
+    'out_time_us={out_time}\n'
+    'out_time_ms={out_time}\n'
+    'out_time=00:00:01.000000\n'
+    'dup_frames=0\n'
+    'drop_frames=0\n'
+    'speed=2.00x\n'
+    'progress=continue\n'
+)
+BLOCK_LINES = FFMPEG_PROGRESS_BLOCK.count('\n')
+
+
+def make_payload(blocks: int) -> bytes:
+    return ''.join(FFMPEG_PROGRESS_BLOCK.format(out_time=i * 1000) for i in range(blocks)).encode()
+
+
+def legacy_parse(connection: socket.socket, progress_callback) -> None:
+    parser = downloader.ListenerParser(connection, 1000.0, '1/1', progress_callback)
+    data = b''
+    while True:
+        more_data = connection.recv(16)
+        if not more_data:
+            break
+        data += more_data
+        lines = data.split(b'\n')
+        for line in lines[:-1]:
+            line = line.decode()
+            parts = line.split('=')
+            key = parts[0] if len(parts) > 0 else None
+            value = parts[1] if len(parts) > 1 else None
+            if key == 'out_time_ms':
+                parser.parse_ffmpeg_data(f'{key}={value}'.encode())
+        data = lines[-1]
+    connection.close()
+
+
+def buffered_parse(connection: socket.socket, progress_callback) -> None:
+    parser = downloader.ListenerParser(connection, 1000.0, '1/1', progress_callback)
+    while data := connection.recv(downloader.ListenerThread.read_size):
+        parser.feed(data)
+    parser.close()
+
+
+def measure(parse, payload: bytes) -> float:
+    reader, writer = socket.socketpair()
+    sender = Thread(target=lambda: (writer.sendall(payload), writer.close()))
+    started = time.perf_counter()
+    sender.start()
+    parse(reader, lambda *args: None)
+    sender.join()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ffmpeg -progress parsing throughput')
+    parser.add_argument('--blocks', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    payload = make_payload(args.blocks)
+    lines = args.blocks * BLOCK_LINES
+    for name, parse in (('legacy recv(16)', legacy_parse), ('buffered', buffered_parse)):
+        elapsed = min(measure(parse, payload) for _ in range(args.repeat))
+        print(f'{name:>16}: {lines / elapsed:14,.0f} lines/s ({elapsed:.3f}s for {lines} lines)')
+
+
+if __name__ == '__main__':
+    main()
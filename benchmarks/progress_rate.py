@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import sys
+import time
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress_bus import GUI_RATE, ProgressBus
+
+
+def run(seconds: float, items: int, max_rate: float, event_rate: float) -> dict:
+    bus = ProgressBus(log_rate=None)
+    lock = Lock()
+    delivered = list()
+
+    def callback(value: int, label: str = None, count: str = None):
+        with lock:
+            delivered.append((time.monotonic(), value, label))
+
+    bus.subscribe(callback, max_rate)
+    publisher = bus.publisher('interleaved')
+    labels = ('download', 'postprocess')
+    published = 0
+    started = time.monotonic()
+    while (elapsed := time.monotonic() - started) < seconds:
+        for item in range(items):
+            publisher(min(99, int(100 * elapsed / seconds)), labels[item % len(labels)],
+                      f'{item}/{items}')
+            published += 1
+        time.sleep(items / event_rate)
+    publisher(100, 'postprocess', f'{items}/{items}')
+    publisher.complete()
+    bus.close()
+    elapsed = time.monotonic() - started
+    return {
+        'published': published,
+        'delivered': len(delivered),
+        'delivered_per_second': round(len(delivered) / elapsed, 1),
+        'max_rate': max_rate,
+        'last': list(delivered[-1][1:]) if delivered else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Progress bus rate cap with interleaved playlist items')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--items', type=int, default=2)
+    parser.add_argument('--max-rate', type=float, default=GUI_RATE)
+    parser.add_argument('--event-rate', type=float, default=2000, help='published progress events per second')
+    args = parser.parse_args()
+
+    result = run(args.seconds, args.items, args.max_rate, args.event_rate)
+    print(json.dumps(result))
+    if result['delivered_per_second'] > args.max_rate * 1.5 or result['last'] != [100, 'postprocess']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
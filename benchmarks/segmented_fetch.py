@@ -0,0 +1,106 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segmented_fetch
+
+RANGE_PATTERN = re.compile('bytes=(?P<start>\\d+)-(?P<end>\\d*)')
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    payload = b''
+    rate = 0
+    fail_after = 0
+    served = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        start, end = 0, len(self.payload) - 1
+        if match := RANGE_PATTERN.match(self.headers.get('Range') or ''):
+            start, end = int(match.group('start')), int(match.group('end') or end)
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(self.payload)}')
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"benchmark"')
+        self.end_headers()
+        chunk = 64 * 1024
+        for offset in range(start, end + 1, chunk):
+            data = self.payload[offset:min(offset + chunk, end + 1)]
+            if self.fail_after and RangeRequestHandler.served + len(data) > self.fail_after:
+                RangeRequestHandler.fail_after = 0
+                self.close_connection = True
+                return
+            self.wfile.write(data)
+            RangeRequestHandler.served += len(data)
+            if self.rate:
+                time.sleep(len(data) / self.rate)
+
+
+def serve(payload: bytes, rate: int) -> ThreadingHTTPServer:
+    RangeRequestHandler.payload = payload
+    RangeRequestHandler.rate = rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def timed_fetch(url: str, target: str, workers: int, segment_size: int, retries: int = 3) -> float:
+    started = time.perf_counter()
+    segmented_fetch.fetch(url, target, workers=workers, segment_size=segment_size, retries=retries)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segmented range fetching against a local Range server')
+    parser.add_argument('--size', type=int, default=64 * 1024 ** 2)
+    parser.add_argument('--segment-size', type=int, default=segmented_fetch.SEGMENT_SIZE)
+    parser.add_argument('--rate', type=int, default=8 * 1024 ** 2, help='per-connection bytes/s, 0 for unlimited')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size)
+    expected = hashlib.sha256(payload).hexdigest()
+    server = serve(payload, args.rate)
+    url = f'http://127.0.0.1:{server.server_address[1]}/media'
+
+    with tempfile.TemporaryDirectory(prefix='talelle_segments_') as work_dir:
+        for workers in args.workers:
+            target = os.path.join(work_dir, f'media_{workers}.bin')
+            elapsed = timed_fetch(url, target, workers, args.segment_size)
+            with open(target, 'rb') as f:
+                ok = hashlib.sha256(f.read()).hexdigest() == expected
+            print(f'{workers:>3} workers: {args.size / elapsed / 1024 ** 2:8.1f} MiB/s ({elapsed:.2f}s) '
+                  f'{"ok" if ok else "MISMATCH"}')
+
+        target = os.path.join(work_dir, 'resumed.bin')
+        RangeRequestHandler.served, RangeRequestHandler.fail_after = 0, args.size // 2
+        try:
+            timed_fetch(url, target, max(args.workers), args.segment_size, retries=1)
+        except OSError as e:
+            print(f'interrupted: {e}')
+        RangeRequestHandler.served = 0
+        elapsed = timed_fetch(url, target, max(args.workers), args.segment_size)
+        with open(target, 'rb') as f:
+            ok = hashlib.sha256(f.read()).hexdigest() == expected
+        print(f'resume: re-fetched {RangeRequestHandler.served / 1024 ** 2:.1f} of {args.size / 1024 ** 2:.1f} MiB '
+              f'in {elapsed:.2f}s {"ok" if ok else "MISMATCH"}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS_DIR = os.path.join(ROOT_DIR, 'benchmarks')
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+import fake_tools
+
+
+def start_worker(spool_dir: str, args) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'spool.py'), spool_dir, 'worker',
+                             '--threads', str(args.threads), '--engine', 'cli', '--lease-ttl', str(args.lease_ttl),
+                             '--heartbeat-interval', str(args.lease_ttl / 6), '--poll-interval', '0.2'],
+                            cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run spooled jobs on several local worker processes and kill '
+                                                 'some of them to check that every job still completes')
+    parser.add_argument('--jobs', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--kill', type=int, default=1, help='workers to SIGKILL while they hold a lease')
+    parser.add_argument('--lease-ttl', type=float, default=3.0)
+    parser.add_argument('--lines', type=int, default=40)
+    parser.add_argument('--line-rate', type=float, default=40)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='talelle_spool_') as work_dir:
+        os.environ['HOME'] = os.environ['USERPROFILE'] = work_dir
+        os.environ['PATH'] = os.pathsep.join((fake_tools.install(os.path.join(work_dir, 'bin')),
+                                              os.environ.get('PATH', '')))
+        os.environ.update({'TALELLE_FAKE_PLAYLIST': '0', 'TALELLE_FAKE_LINES': str(args.lines),
+                           'TALELLE_FAKE_LINE_RATE': str(args.line_rate), 'TALELLE_FAKE_BLOCKS': '5'})
+        import spool
+
+        spool_dir = os.path.join(work_dir, 'spool')
+        output_dir = os.path.join(work_dir, 'out')
+        os.makedirs(output_dir)
+        jobs = spool.Spool(spool_dir)
+        job_ids = [jobs.submit(f'https://fake.invalid/{i}', True, os.path.join(output_dir, f'{i}.mp3'))
+                   for i in range(args.jobs)]
+
+        started = time.perf_counter()
+        workers = [start_worker(spool_dir, args) for _ in range(args.workers)]
+        killed = 0
+        try:
+            while time.perf_counter() - started < args.timeout:
+                states = {job['id']: job for job in jobs.jobs()}
+                if all(states.get(job_id, {}).get('status') in (spool.DONE, spool.FAILED) for job_id in job_ids):
+                    break
+                if killed < args.kill:
+                    holders = {worker['pid'] for worker in jobs.workers() if worker['running']}
+                    for worker in workers:
+                        if worker.pid in holders and worker.poll() is None:
+                            worker.send_signal(signal.SIGKILL)
+                            killed += 1
+                            print(f'killed worker {worker.pid} while it held a lease')
+                            break
+                time.sleep(0.2)
+            elapsed = time.perf_counter() - started
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+            for worker in workers:
+                worker.wait()
+
+        states = {job['id']: job for job in jobs.jobs()}
+        summary = {
+            'jobs': args.jobs,
+            'workers': args.workers,
+            'killed': killed,
+            'done': sum(states.get(job_id, {}).get('status') == spool.DONE for job_id in job_ids),
+            'failed': sum(states.get(job_id, {}).get('status') == spool.FAILED for job_id in job_ids),
+            'reclaimed': sum(states.get(job_id, {}).get('attempts', 0) > 1 for job_id in job_ids),
+            'outputs': len(os.listdir(output_dir)),
+            'seconds': round(elapsed, 2),
+        }
+        print(json.dumps(summary))
+        if summary['done'] != args.jobs:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from threading import Lock
+from typing import Optional
+
+from talelle_setup import TALELLE_DIR
+
+logger = logging.getLogger(__name__)
+
+CAPABILITIES_FILE = os.path.join(TALELLE_DIR, 'capabilities.json')
+BINARIES = ('ffmpeg', 'ffprobe', 'yt-dlp')
+ENCODERS = ('libx265', 'aac', 'libmp3lame')
+ENCODER_PATTERN = re.compile('^\\s*[VAS][\\w.]{5}\\s+(?P<name>\\S+)', re.MULTILINE)
+
+_lock = Lock()
+_capabilities = None
+
+
+def run_version_command(cmd: list[str]) -> Optional[str]:
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, **kwargs)
+    except (subprocess.CalledProcessError, FileNotFoundError, PermissionError) as e:
+        logger.error('%s is not usable: %s', cmd[0], e)
+        return None
+    return result.stdout.decode(errors='replace')
+
+
+def get_binaries() -> dict:
+    binaries = dict()
+    for name in BINARIES:
+        path = shutil.which(name)
+        stat = os.stat(path) if path else None
+        binaries[name] = {
+            'path': path,
+            'mtime': stat.st_mtime if stat else None,
+            'size': stat.st_size if stat else None,
+        }
+    return binaries
+
+
+def probe(binaries: Optional[dict] = None) -> dict:
+    binaries = binaries or get_binaries()
+    capabilities = {'binaries': binaries, 'versions': dict(), 'encoders': dict.fromkeys(ENCODERS, False)}
+
+    if binaries['ffmpeg']['path'] and (output := run_version_command([binaries['ffmpeg']['path'], '-version'])):
+        capabilities['versions']['ffmpeg'] = output.splitlines()[0]
+        encoders = run_version_command([binaries['ffmpeg']['path'], '-hide_banner', '-encoders']) or ''
+        available = {match.group('name') for match in ENCODER_PATTERN.finditer(encoders)}
+        capabilities['encoders'] = {encoder: encoder in available for encoder in ENCODERS}
+    if binaries['yt-dlp']['path'] and (output := run_version_command([binaries['yt-dlp']['path'], '--version'])):
+        capabilities['versions']['yt-dlp'] = output.strip()
+
+    logger.info(f'Probed capabilities: {capabilities["versions"]}, encoders: {capabilities["encoders"]}')
+    return capabilities
+
+
+def load(path: str = CAPABILITIES_FILE) -> Optional[dict]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save(capabilities: dict, path: str = CAPABILITIES_FILE):
+    try:
+        with open(path, 'w') as f:
+            json.dump(capabilities, f)
+    except OSError as e:
+        logger.warning('could not save capabilities: %s', e)
+
+
+def get_capabilities(refresh: bool = False, path: str = CAPABILITIES_FILE) -> dict:
+    global _capabilities
+    with _lock:
+        binaries = get_binaries()
+        if not refresh and _capabilities and _capabilities['binaries'] == binaries:
+            return _capabilities
+        cached = None if refresh else load(path)
+        if cached and cached.get('binaries') == binaries:
+            _capabilities = cached
+        else:
+            _capabilities = probe(binaries)
+            save(_capabilities, path)
+        return _capabilities
+
+
+def ffmpeg_available() -> bool:
+    return bool(get_capabilities()['versions'].get('ffmpeg'))
+
+
+def has_encoder(encoder: str) -> bool:
+    return bool(get_capabilities()['encoders'].get(encoder))
+
+
+def get_version(binary: str) -> Optional[str]:
+    return get_capabilities()['versions'].get(binary)
+
+
+if __name__ == '__main__':
+    print(json.dumps(get_capabilities(refresh=True), indent=2))
@@ -0,0 +1,199 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Optional, NamedTuple
+
+from talelle_setup import TALELLE_DIR
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILE = os.path.join(TALELLE_DIR, 'download_queue.sqlite')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+MAX_ATTEMPTS = 3
+
+SCHEMA = ('''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    audio_only INTEGER NOT NULL,
+    output_path TEXT NOT NULL,
+    max_playlist INTEGER NOT NULL,
+    abort_on_long_playlist INTEGER NOT NULL,
+    do_postprocess INTEGER NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)''',
+    'CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, priority DESC, id)',
+)
+MIGRATIONS = (
+    ('sections', "ALTER TABLE jobs ADD COLUMN sections TEXT NOT NULL DEFAULT ''"),
+    ('both', 'ALTER TABLE jobs ADD COLUMN both INTEGER NOT NULL DEFAULT 0'),
+)
+
+
+class QueuedJob(NamedTuple):
+    id: int
+    url: str
+    audio_only: bool
+    output_path: str
+    max_playlist: int
+    abort_on_long_playlist: bool
+    do_postprocess: bool
+    priority: int
+    status: str
+    attempts: int
+    error: Optional[str]
+    sections: str
+    both: bool
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'QueuedJob':
+        return cls(
+            row['id'], row['url'], bool(row['audio_only']), row['output_path'],
+            row['max_playlist'], bool(row['abort_on_long_playlist']), bool(row['do_postprocess']),
+            row['priority'], row['status'], row['attempts'], row['error'], row['sections'], bool(row['both']),
+        )
+
+
+class DownloadQueue:
+    def __init__(self, path: str = QUEUE_FILE):
+        self.path = path
+        self.archive_dir = f'{os.path.splitext(path)[0]}_archives'
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+            columns = {row['name'] for row in db.execute('PRAGMA table_info(jobs)')}
+            for column, statement in MIGRATIONS:
+                if column not in columns:
+                    db.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def add(self, url: str, audio_only: bool, output_path: str, max_playlist: int,
+            abort_on_long_playlist: bool, do_postprocess: bool, priority: int = 0, sections: str = '',
+            both: bool = False) -> int:
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                'INSERT INTO jobs (url, audio_only, output_path, max_playlist, abort_on_long_playlist, '
+                'do_postprocess, priority, sections, both, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, int(audio_only), output_path, max_playlist, int(abort_on_long_playlist),
+                 int(do_postprocess), priority, sections, int(both), now, now)
+            )
+        logger.info(f'Job {cursor.lastrowid} queued: {url}')
+        return cursor.lastrowid
+
+    def recover(self) -> int:
+        with self.transaction() as db:
+            exhausted = db.execute(
+                'UPDATE jobs SET status = ?, error = ?, updated = ? WHERE status = ? AND attempts >= ?',
+                (FAILED, 'too_many_attempts', time.time(), RUNNING, MAX_ATTEMPTS)
+            )
+            cursor = db.execute('UPDATE jobs SET status = ?, updated = ? WHERE status = ?',
+                                (PENDING, time.time(), RUNNING))
+        if exhausted.rowcount:
+            logger.warning(f'{exhausted.rowcount} interrupted jobs failed after {MAX_ATTEMPTS} attempts')
+        if cursor.rowcount:
+            logger.info(f'{cursor.rowcount} interrupted jobs returned to the queue')
+        return cursor.rowcount
+
+    def claim(self) -> Optional[QueuedJob]:
+        with self.transaction() as db:
+            row = db.execute('SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, id LIMIT 1',
+                             (PENDING,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+                       (RUNNING, time.time(), row['id']))
+        return QueuedJob.from_row(row)._replace(status=RUNNING, attempts=row['attempts'] + 1)
+
+    def set_status(self, job_id: int, status: str, error: Optional[str] = None):
+        with self.transaction() as db:
+            db.execute('UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ?',
+                       (status, error, time.time(), job_id))
+        logger.info(f'Job {job_id} is {status}')
+
+    def complete(self, job_id: int, status: str, error: Optional[str] = None) -> bool:
+        with self.transaction() as db:
+            cursor = db.execute('UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? AND status = ?',
+                                (status, error, time.time(), job_id, RUNNING))
+        if cursor.rowcount:
+            logger.info(f'Job {job_id} is {status}')
+            if status == DONE:
+                self.remove_archive(job_id)
+        return bool(cursor.rowcount)
+
+    def finish(self, job_id: int) -> bool:
+        return self.complete(job_id, DONE)
+
+    def fail(self, job_id: int, error: str) -> bool:
+        return self.complete(job_id, FAILED, error)
+
+    def cancel(self, job_id: int) -> bool:
+        with self.transaction() as db:
+            cursor = db.execute('UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status IN (?, ?)',
+                                (CANCELLED, time.time(), job_id, PENDING, RUNNING))
+        if cursor.rowcount:
+            self.remove_archive(job_id)
+        return bool(cursor.rowcount)
+
+    def get_archive_path(self, job_id: int) -> str:
+        os.makedirs(self.archive_dir, exist_ok=True)
+        return os.path.join(self.archive_dir, f'job-{job_id}.txt')
+
+    def remove_archive(self, job_id: int):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.archive_dir, f'job-{job_id}.txt'))
+
+    def get(self, job_id: int) -> Optional[QueuedJob]:
+        with self.transaction() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return QueuedJob.from_row(row) if row else None
+
+    def retry(self, job_id: int):
+        self.set_status(job_id, PENDING)
+
+    def set_priority(self, job_id: int, priority: int):
+        with self.transaction() as db:
+            db.execute('UPDATE jobs SET priority = ?, updated = ? WHERE id = ?', (priority, time.time(), job_id))
+
+    def remove(self, job_id: int):
+        with self.transaction() as db:
+            db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        self.remove_archive(job_id)
+
+    def jobs(self, status: Optional[str] = None) -> list[QueuedJob]:
+        with self.transaction() as db:
+            if status:
+                rows = db.execute('SELECT * FROM jobs WHERE status = ? ORDER BY priority DESC, id',
+                                  (status,)).fetchall()
+            else:
+                rows = db.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+        return [QueuedJob.from_row(row) for row in rows]
+
+    def pending_count(self) -> int:
+        with self.transaction() as db:
+            return db.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', (PENDING, RUNNING)).fetchone()[0]
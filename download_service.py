@@ -0,0 +1,340 @@
+from talelle_setup import Path, TALELLE_DIR, config_log
+TALELLE_TOOL = Path(__file__).stem
+
+import argparse
+import json
+import logging
+import os
+import re
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Condition, Event
+from typing import Optional
+
+import bandwidth
+import downloader
+import download_queue
+import media_store
+import transcode_profiles
+import ytdlp_pool
+from job_control import JobCancelled, JobControl
+from progress_bus import CALLBACK_RATE, ProgressBus
+
+logger = logging.getLogger(__name__)
+
+SERVICE_QUEUE_FILE = os.path.join(TALELLE_DIR, f'{TALELLE_TOOL}.sqlite')
+JOB_PATH = re.compile('^/jobs/(?P<job_id>\\d+)(?P<action>/cancel|/events|/pause|/resume)?/?$')
+FINAL_STATUSES = (download_queue.DONE, download_queue.FAILED, download_queue.CANCELLED)
+
+
+class JobProgress:
+    def __init__(self):
+        self.value = 0
+        self.label = None
+        self.count = None
+        self.version = 0
+        self.changed = Condition()
+
+    def update(self, value: int, label: Optional[str] = None, count: Optional[str] = None):
+        with self.changed:
+            self.value, self.label, self.count = value, label or self.label, count or self.count
+            self.version += 1
+            self.changed.notify_all()
+
+    def touch(self):
+        with self.changed:
+            self.version += 1
+            self.changed.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def as_dict(self) -> dict:
+        return {'value': self.value, 'label': self.label, 'count': self.count}
+
+
+class DownloadService:
+    def __init__(self, queue: download_queue.DownloadQueue, service_workers: int,
+                 poll_interval: float = 1.0, **download_options):
+        self.queue = queue
+        self.service_workers = service_workers
+        self.download_options = download_options
+        self.poll_interval = poll_interval
+        self.progress = dict()
+        self.controls = dict()
+        self.shares = dict()
+        self.wakeup = Event()
+        self.stopping = False
+        self.threads = list()
+
+    def get_progress(self, job_id: int) -> JobProgress:
+        return self.progress.setdefault(job_id, JobProgress())
+
+    def start(self):
+        self.queue.recover()
+        for i in range(self.service_workers):
+            thread = Thread(target=self.work, name=f'service-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f'{self.service_workers} service workers started')
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    def forget(self, job_id: int):
+        if job_id not in self.controls:
+            self.progress.pop(job_id, None)
+
+    def submit(self, options: dict) -> int:
+        job_id = self.queue.add(
+            options['url'],
+            bool(options.get('audio_only', True)),
+            options.get('output_path', os.path.expanduser('~')),
+            int(options.get('max_playlist', -1)),
+            bool(options.get('abort_on_long_playlist', False)),
+            bool(options.get('do_postprocess', False)),
+            int(options.get('priority', 0)),
+            options.get('sections', ''),
+            bool(options.get('both', False)),
+        )
+        self.wakeup.set()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        if not self.queue.cancel(job_id):
+            return False
+        if control := self.controls.get(job_id):
+            control.cancel()
+        self.get_progress(job_id).touch()
+        self.forget(job_id)
+        return True
+
+    def pause(self, job_id: int, paused: bool) -> bool:
+        if not (control := self.controls.get(job_id)):
+            return False
+        if paused:
+            control.pause()
+        else:
+            control.resume()
+        self.get_progress(job_id).touch()
+        return True
+
+    def describe(self, job: download_queue.QueuedJob) -> dict:
+        description = job._asdict()
+        if progress := self.progress.get(job.id):
+            description['progress'] = progress.as_dict()
+        else:
+            description['progress'] = {'value': 100 if job.status == download_queue.DONE else 0,
+                                       'label': None, 'count': None}
+        description['paused'] = bool((control := self.controls.get(job.id)) and control.paused)
+        if share := self.shares.get(job.id):
+            description['bandwidth'] = share.as_dict()
+        return description
+
+    def work(self):
+        while not self.stopping:
+            job = self.queue.claim()
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+            progress = self.get_progress(job.id)
+            bus = ProgressBus()
+            bus.subscribe(progress.update, CALLBACK_RATE)
+            publisher = bus.publisher(f'job-{job.id}')
+            control = self.controls[job.id] = JobControl(self.queue.get_archive_path(job.id), job.attempts > 1)
+            share = self.shares[job.id] = bandwidth.register(f'job-{job.id}', job.priority)
+            try:
+                downloader.download(job.url, job.audio_only, job.output_path,
+                                    job.max_playlist, job.abort_on_long_playlist, job.do_postprocess,
+                                    publisher, control=control, share=share, both=job.both,
+                                    sections=downloader.parse_sections(job.sections) or None, **self.download_options)
+                publisher.complete()
+                self.queue.finish(job.id)
+            except JobCancelled:
+                logger.info(f'Job {job.id} cancelled')
+            except ValueError as e:
+                self.queue.fail(job.id, ' '.join(str(arg) for arg in e.args))
+            except Exception as e:
+                logger.exception(f'Job {job.id} failed')
+                self.queue.fail(job.id, str(e))
+            finally:
+                bus.close()
+                self.controls.pop(job.id, None)
+                bandwidth.unregister(self.shares.pop(job.id))
+            progress.touch()
+            self.forget(job.id)
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    service: DownloadService = None
+    event_timeout = 15.0
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def send_json(self, payload, status: HTTPStatus = HTTPStatus.OK):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/bandwidth':
+            return self.send_json(bandwidth.snapshot())
+        if self.path.rstrip('/') == '/store':
+            return self.send_json(media_store.MediaStore().report()._asdict())
+        if self.path.rstrip('/') == '/jobs':
+            return self.send_json([self.service.describe(job) for job in self.service.queue.jobs()])
+        match = JOB_PATH.match(self.path)
+        job = match and self.service.queue.get(int(match.group('job_id')))
+        if not job:
+            return self.send_json({'error': 'not_found'}, HTTPStatus.NOT_FOUND)
+        if match.group('action') == '/events':
+            return self.stream_events(job)
+        return self.send_json(self.service.describe(job))
+
+    def do_POST(self):
+        if self.path.rstrip('/') == '/jobs':
+            try:
+                options = self.read_json()
+            except ValueError:
+                return self.send_json({'error': 'invalid_json'}, HTTPStatus.BAD_REQUEST)
+            if not isinstance(options, dict):
+                return self.send_json({'error': 'invalid_json'}, HTTPStatus.BAD_REQUEST)
+            if not options.get('url') or not isinstance(options['url'], str):
+                return self.send_json({'error': 'url_not_valid'}, HTTPStatus.BAD_REQUEST)
+            try:
+                downloader.parse_sections(options.get('sections', ''))
+            except (AttributeError, ValueError):
+                return self.send_json({'error': 'invalid_sections'}, HTTPStatus.BAD_REQUEST)
+            try:
+                job_id = self.service.submit(options)
+            except (TypeError, ValueError):
+                return self.send_json({'error': 'invalid_options'}, HTTPStatus.BAD_REQUEST)
+            return self.send_json({'id': job_id}, HTTPStatus.CREATED)
+        if self.path.rstrip('/') == '/bandwidth':
+            try:
+                bandwidth.set_limit(self.read_json().get('limit'))
+            except ValueError:
+                return self.send_json({'error': 'invalid_rate'}, HTTPStatus.BAD_REQUEST)
+            return self.send_json(bandwidth.snapshot())
+        match = JOB_PATH.match(self.path)
+        if match and match.group('action') == '/cancel':
+            return self.cancel(int(match.group('job_id')))
+        if match and match.group('action') in ('/pause', '/resume'):
+            job_id = int(match.group('job_id'))
+            if self.service.pause(job_id, match.group('action') == '/pause'):
+                return self.send_json(self.service.describe(self.service.queue.get(job_id)))
+            return self.send_json({'error': 'not_running'}, HTTPStatus.CONFLICT)
+        self.send_json({'error': 'not_found'}, HTTPStatus.NOT_FOUND)
+
+    def do_DELETE(self):
+        match = JOB_PATH.match(self.path)
+        if not match or match.group('action'):
+            return self.send_json({'error': 'not_found'}, HTTPStatus.NOT_FOUND)
+        self.cancel(int(match.group('job_id')))
+
+    def cancel(self, job_id: int):
+        if self.service.cancel(job_id):
+            return self.send_json({'id': job_id, 'status': download_queue.CANCELLED})
+        self.send_json({'error': 'not_cancellable'}, HTTPStatus.CONFLICT)
+
+    def stream_events(self, job: download_queue.QueuedJob):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        job_id = job.id
+        progress = self.service.get_progress(job_id)
+        version = -1
+        try:
+            while True:
+                version = progress.wait(version, self.event_timeout)
+                if (job := self.service.queue.get(job_id)) is None:
+                    self.wfile.write(f'data: {json.dumps({"id": job_id, "error": "not_found"})}\n\n'.encode())
+                    self.wfile.flush()
+                    return
+                description = self.service.describe(job)
+                self.wfile.write(f'data: {json.dumps(description)}\n\n'.encode())
+                self.wfile.flush()
+                if job.status in FINAL_STATUSES:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f'event stream for job {job_id} closed by client')
+        finally:
+            if job is None or job.status in FINAL_STATUSES:
+                self.service.forget(job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless download service with a local HTTP/JSON API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--playlist-workers', type=int, default=1)
+    parser.add_argument('--engine', choices=downloader.ENGINES, default='pool')
+    parser.add_argument('--pool-size', type=int, default=ytdlp_pool.POOL_SIZE,
+                        help='warm yt-dlp worker processes kept for the pool engine')
+    parser.add_argument('--pool-max-jobs', type=int, default=ytdlp_pool.MAX_JOBS,
+                        help='recycle a pool worker after this many jobs')
+    parser.add_argument('--cache', action='store_true', help='reuse already downloaded media')
+    parser.add_argument('--pipeline', action='store_true', help='transcode in a separate pipeline stage')
+    parser.add_argument('--transcode-workers', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--segments', type=int, default=0,
+                        help='fetch media as this many concurrent resumable byte ranges')
+    parser.add_argument('--stream-audio', action='store_true',
+                        help='pipe downloaded audio straight into the mp3 encoder without an intermediate file')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='reflink finished outputs into the content-addressed media store')
+    parser.add_argument('--dedupe-hardlinks', action='store_true',
+                        help='hardlink outputs into the media store when the file system cannot reflink them')
+    parser.add_argument('--library', action='store_true',
+                        help='record finished outputs with their source URL in the library index')
+    parser.add_argument('--preset', choices=transcode_profiles.PRESETS, help='libx265 preset for postprocessing')
+    parser.add_argument('--crf', type=int, help='libx265 CRF for postprocessing')
+    parser.add_argument('--queue-file', default=SERVICE_QUEUE_FILE)
+    parser.add_argument('--profile', action='store_true', help='write a cProfile dump for every job')
+    parser.add_argument('--bandwidth-limit', default='0',
+                        help='global download rate cap shared by all jobs, e.g. 4M (0 for unlimited)')
+    args = parser.parse_args()
+
+    config_log(TALELLE_TOOL)
+    bandwidth.set_limit(args.bandwidth_limit)
+    if args.engine == 'pool' and ytdlp_pool.available():
+        ytdlp_pool.configure(args.pool_size, args.pool_max_jobs, prewarm=min(args.pool_size, args.workers))
+    transcode_profile = None
+    if args.preset or args.crf is not None:
+        transcode_profile = {key: value for key, value in (('preset', args.preset), ('crf', args.crf)) if value is not None}
+    service = DownloadService(download_queue.DownloadQueue(args.queue_file), args.workers,
+                              workers=args.playlist_workers, engine=args.engine, cache=args.cache,
+                              pipeline=args.pipeline, transcode_workers=args.transcode_workers,
+                              transcode_profile=transcode_profile, profile=args.profile, segments=args.segments,
+                              streaming=args.stream_audio, dedupe=args.dedupe,
+                              dedupe_hardlinks=args.dedupe_hardlinks, library=args.library)
+    service.start()
+
+    ServiceRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), ServiceRequestHandler)
+    server.daemon_threads = True
+    logger.info(f'{TALELLE_TOOL} listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
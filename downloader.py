@@ -1,69 +1,123 @@
 import logging
 import os
 import re
-from typing import Optional, Callable
+from typing import Optional, Callable, NamedTuple
 
 import math
 import socket
+import sqlite3
+import selectors
 import subprocess
-from threading import Thread
+import time
+from threading import Thread, Lock
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 import contextlib
+import functools
+import json
+import queue
+import urllib.parse
+
+import bandwidth
+import transcode_profiles
+import ytdlp_pool
+from job_control import JobCancelled, JobControl, get_process_group_kwargs, kill_tree
+from job_metrics import ItemMetrics, JobMetrics, parse_transfer, profiled, wait_process, write_metrics
+from progress_bus import CALLBACK_RATE, ProgressBus, ProgressPublisher
 
 logger = logging.getLogger(__name__)
 
-class ListenerParser(Thread):
-    def __init__(self, connection, final_duration, count_str, progress_callback, **kwargs):
-        super().__init__(**kwargs)
+INFO_PATTERN = re.compile(',\\s+'.join((
+    'duration:(?P<duration>\\d+(\\.\\d+))',
+    'current:(?P<current>\\d+)',
+    'total:(?P<total>\\d+)',
+    'length:(?P<length>\\d+)',
+    'max-playlist:(?P<max_playlist>-?\\d+)',
+    'abort-on-long:(?P<abort_on_long>\\d+)',
+)) + '(,\\s+clip:(?P<clip>\\d+(\\.\\d+)?))?')
+DOWNLOAD_PATTERN = re.compile('\\[download\\]\\s+(\\d+(\\.\\d+))\\%\\s+of')
+
+DESTINATION_PATTERN = re.compile('^\\[\\w+\\] Destination: (?P<path>.+)$')
+
+SCAN_PATTERN = re.compile('(?P<index>\\d+)\\s+(?P<length>\\d+)\\s+(?P<extractor>\\S+)\\s+(?P<id>\\S+)'
+                          '(\\s+(?P<duration>\\d+)(\\s(?P<title>.*))?)?')
+SAVED_PREFIX = 'saved:'
+SECTION_SUFFIX = ' %(section_start)d-%(section_end)d'
+TARGET_PREFIX = 'target:'
+
+DEFAULT_NAME_PREFIX = '%(playlist_autonumber|)s%(playlist_autonumber&_|)s'
+
+ENGINES = ytdlp_pool.ENGINES
+
+MP3_ARGS = ['-vn', '-c:a', 'libmp3lame', '-q:a', '5']
+H265_ARGS = ['-c:a', 'aac', '-c:v', 'libx265', '-tag:v', 'hvc1']
+
+class ListenerParser:
+    def __init__(self, connection, final_duration, count_str, progress_callback, item_metrics=None,
+                 part_n=2, part_i=1):
         self.connection = connection
         self.final_duration = final_duration
         self.count_str = count_str
         self.progress_callback = progress_callback
+        self.item_metrics = item_metrics
+        self.part_n = part_n
+        self.part_i = part_i
+        self.buffer = b''
 
+    def feed(self, data: bytes):
+        data = self.buffer + data
+        end = data.rfind(b'\n')
+        if end < 0:
+            self.buffer = data
+            return
+        self.buffer = data[end + 1:]
+        for line in data[:end].split(b'\n'):
+            self.parse_ffmpeg_data(line)
 
-    def run(self):
-        logger.debug('parsing postprocess data')
-        data = b''
+    def close(self):
         try:
-            while True:
-                more_data = self.connection.recv(16)
-                if not more_data:
-                    break
-                data += more_data
-                lines = data.split(b'\n')
-                for line in lines[:-1]:
-                    self.parse_ffmpeg_data(line)
-                data = lines[-1]
+            if self.buffer:
+                self.parse_ffmpeg_data(self.buffer)
+                self.buffer = b''
         finally:
             self.connection.close()
             logger.debug('parsing postprocess data finished')
 
-
     def parse_ffmpeg_data(self, line: bytes):
-        line = line.decode()
-        parts = line.split('=')
-        key = parts[0] if len(parts) > 0 else None
-        value = parts[1] if len(parts) > 1 else None
-        if key == 'out_time_ms':
+        key, _, value = line.strip().partition(b'=')
+        if key == b'out_time_ms' and self.final_duration:
             duration = int(value) / 1000000 if value.isdigit() else 0
-            update_progress(duration, self.final_duration, self.progress_callback,
-                            label='postprocess', part_n=2, part_i=1, count=self.count_str)
-        elif key == 'progress' and value == 'end':
+            update_progress(min(duration, self.final_duration), self.final_duration, self.progress_callback,
+                            label='postprocess', part_n=self.part_n, part_i=self.part_i, count=self.count_str)
+        elif key == b'progress' and value == b'end':
             update_progress_percent(100, self.progress_callback,
-                                    label='postprocess', part_n=2, part_i=1, count=self.count_str)
+                                    label='postprocess', part_n=self.part_n, part_i=self.part_i, count=self.count_str)
+        elif self.item_metrics and key in (b'speed', b'fps'):
+            self.item_metrics.add_ffmpeg(key.decode(), value.decode())
 
 
 class ListenerThread(Thread):
-    def __init__(self, sock: Optional[socket.socket], listen_on: Optional[str], progress_callback: Callable, **kwargs):
+    read_size = 65536
+
+    def __init__(self, sock: Optional[socket.socket], listen_on: Optional[str], progress_callback: Callable,
+                 metrics: Optional[JobMetrics] = None, item_key: Optional[int] = None, **kwargs):
         super().__init__(**kwargs)
         self.sock = sock
         self.listen_on = listen_on
         self.progress_callback = progress_callback
+        self.metrics = metrics
+        self.item_key = item_key
+        self.item_metrics = None
+        self.stream = None
+        self.control = None
         self.part_n = 1 + (1 if self.sock else 0)
         self.final_duration = None
         self.current = 0
         self.total = 0
         self.length = 0
-        self.parsers = list()
+        self.parsers = dict()
+        self.saved_files = list()
+        self.stopping = False
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair() if self.sock else (None, None)
 
     def set_info(self, duration: float, current: int, total: int, length: int):
         self.final_duration = duration
@@ -71,19 +125,78 @@ class ListenerThread(Thread):
         self.total = total
         self.length = length
 
+    def enter_item(self, current: int, phase: str):
+        if self.metrics is None:
+            return
+        key = self.item_key or current
+        if self.item_metrics is not None and self.item_metrics.key != key:
+            self.item_metrics.finish()
+        self.item_metrics = self.metrics.item(key)
+        self.item_metrics.enter(phase)
+
+    def finish_item(self):
+        if self.item_metrics is not None:
+            self.item_metrics.finish()
+
+    def stop(self):
+        self.stopping = True
+        if self.wakeup_writer:
+            with contextlib.suppress(OSError):
+                self.wakeup_writer.send(b'\0')
+
     def run(self):
-        while True:
+        self.sock.setblocking(False)
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ)
+            selector.register(self.wakeup_reader, selectors.EVENT_READ)
             try:
-                connection, client_address = self.sock.accept()
-                logger.debug('Postprocess process started')
-                self.parsers.append(ListenerParser(
-                    connection, self.final_duration, self.get_count_str(), self.progress_callback
-                ))
-                self.parsers[-1].start()
-            except (ConnectionAbortedError, OSError) as e:
+                while True:
+                    for key, _ in selector.select():
+                        if key.fileobj is self.sock:
+                            self.accept(selector)
+                        elif key.fileobj is self.wakeup_reader:
+                            self.wakeup_reader.recv(self.read_size)
+                        else:
+                            self.read(selector, key.fileobj)
+                    if self.stopping and not self.parsers and not self.accept(selector):
+                        break
+            finally:
+                for connection in list(self.parsers):
+                    self.parsers.pop(connection).close()
+                self.wakeup_reader.close()
+                self.wakeup_writer.close()
                 logger.debug('Postprocess process finished')
-                return
 
+    def accept(self, selector: selectors.BaseSelector) -> bool:
+        try:
+            connection, client_address = self.sock.accept()
+        except BlockingIOError:
+            return False
+        logger.debug('Postprocess process started')
+        connection.setblocking(False)
+        if self.item_metrics is not None:
+            self.item_metrics.enter('postprocess')
+        self.parsers[connection] = ListenerParser(
+            connection, self.final_duration, self.get_count_str(), self.progress_callback, self.item_metrics
+        )
+        selector.register(connection, selectors.EVENT_READ)
+        return True
+
+    def read(self, selector: selectors.BaseSelector, connection: socket.socket):
+        try:
+            data = connection.recv(self.read_size)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if data:
+            try:
+                self.parsers[connection].feed(data)
+                return
+            except Exception:
+                logger.exception('failed to parse postprocess data')
+        selector.unregister(connection)
+        self.parsers.pop(connection).close()
 
     def get_count_str(self):
         return f'{str(self.current)}/{str(self.total)}'
@@ -91,53 +204,59 @@ class ListenerThread(Thread):
 
     def parse_yt_dlp_data(self, bin_line: bytes):
         line = bin_line.decode()
-        info_pattern = ',\\s+'.join((
-            'duration:(?P<duration>\\d+(\\.\\d+))',
-            'current:(?P<current>\\d+)',
-            'total:(?P<total>\\d+)',
-            'length:(?P<length>\\d+)',
-            'max-playlist:(?P<max_playlist>-?\\d+)',
-            'abort-on-long:(?P<abort_on_long>\\d+)',
-        ))
-        if match := re.search(info_pattern, line):
-            logger.info(f'Download info: {line}')
+        if line.startswith(SAVED_PREFIX):
+            self.saved_files.append(line[len(SAVED_PREFIX):].strip())
+            self.finish_item()
+        elif match := INFO_PATTERN.search(line):
+            logger.info('Download info: %s', line)
             if (int(match.group('abort_on_long')) and
                     int(match.group('length')) > int(match.group('max_playlist'))):
                 return 'playlist_too_long', match.group('max_playlist'), match.group('length')
             self.set_info(
-                float(match.group('duration')),
+                float(match.group('clip') or match.group('duration')),
                 int(match.group('current')),
                 int(match.group('total')),
                 int(match.group('length')),
             )
-        elif match := re.search('\\[download\\]\\s+(\\d+(\\.\\d+))\\%\\s+of', line):
-            update_progress_percent(float(match.group(1)), self.progress_callback, label='download',
+            self.enter_item(self.current, 'transfer')
+        elif self.control is not None and (match := DESTINATION_PATTERN.match(line.strip())):
+            self.control.track(match.group('path'))
+        elif match := DOWNLOAD_PATTERN.search(line):
+            percent = float(match.group(1))
+            update_progress_percent(percent, self.progress_callback, label='download',
                                     part_n=self.part_n, part_i=0, count=self.get_count_str())
+            if (self.item_metrics is not None or self.stream is not None) and \
+                    (transfer := parse_transfer(line, percent)):
+                if self.item_metrics is not None:
+                    self.item_metrics.add_transfer(*transfer)
+                if self.stream is not None:
+                    self.stream.update_total(transfer[0])
 
 
 @contextlib.contextmanager
-def get_progress_listener(use_socket: bool, progress_callback: Callable):
+def get_progress_listener(use_socket: bool, progress_callback: Callable,
+                          metrics: Optional[JobMetrics] = None, item_key: Optional[int] = None):
     sock = type("Closable", (object,), {"close": lambda self: "closed"})
-    listener = type("Joinable", (object,), {"join": lambda self: "joined" })
+    listener = type("Joinable", (object,), {"join": lambda self: "joined", "stop": lambda self: "stopped"})
 
     try:
         if use_socket:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.bind(('localhost', 0))
             listen_on = '{}:{:d}'.format(*sock.getsockname())
-            sock.listen(1)
-            listener = ListenerThread(sock, listen_on, progress_callback)
+            sock.listen(socket.SOMAXCONN)
+            listener = ListenerThread(sock, listen_on, progress_callback, metrics, item_key)
             listener.start()
         else:
-            listener = ListenerThread(None, None, progress_callback)
+            listener = ListenerThread(None, None, progress_callback, metrics, item_key)
         yield listener
     finally:
-        for parser in listener.parsers:
-            parser.join()
         with contextlib.suppress(Exception):
-            sock.close()
+            listener.stop()
         with contextlib.suppress(Exception):
             listener.is_alive() and listener.join()
+        with contextlib.suppress(Exception):
+            sock.close()
 
 
 def default_progress_callback(percent: int, label: str=None, count: str=None):
@@ -153,8 +272,6 @@ def default_progress_callback(percent: int, label: str=None, count: str=None):
 def update_progress_percent(percent: float, progress_callback: Callable,
                             label: Optional[str] = None, part_n: int = 1, part_i: int = 0, count: str = ''
                             ) -> float:
-    process = label.upper() if label else 'PROCESS'
-    logger.debug(f'{count} -> {process} IS DONE for {str(percent)}%')
     progress_callback(int(percent)//part_n + 100//part_n * part_i, label, count)
     return percent
 
@@ -162,39 +279,227 @@ def update_progress_percent(percent: float, progress_callback: Callable,
 def update_progress(done: float, total: float, progress_callback: Callable,
                     label: Optional[str] = None, part_n: int = 1, part_i: int = 0, count: str = '') -> int:
     calculated_progress = math.floor((done / total)*100)
-    process = label.upper() if label else 'PROCESS'
-    logger.debug(f'{count} -> {process} IS DONE for {str(calculated_progress)}%: {str(done)} of {str(total)}')
     progress_callback(calculated_progress//part_n + 100//part_n * part_i, label, count)
     return calculated_progress
 
 
+class PlaylistProgress:
+    def __init__(self, total: int, progress_callback: Callable):
+        self.total = total
+        self.progress_callback = progress_callback
+        self.values = dict()
+        self.done = 0
+        self.lock = Lock()
+
+    def item_callback(self, index: int) -> Callable:
+        def callback(value: int, label: str = None, count: str = None):
+            with self.lock:
+                self.values[index] = value
+                self.report(label)
+        return callback
+
+    def finish_item(self, index: int):
+        with self.lock:
+            self.values[index] = 100
+            self.done += 1
+            self.report('download')
+
+    def get_count_str(self):
+        return f'{str(self.done)}/{str(self.total)}'
+
+    def report(self, label: Optional[str]):
+        percent = sum(self.values.values()) // self.total
+        self.progress_callback(percent, label, self.get_count_str())
+
+
+def get_subprocess_kwargs() -> dict:
+    kwargs = {
+        'stdout': subprocess.PIPE,
+        'stderr': subprocess.PIPE
+    }
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    return kwargs
+
+
+def start_process(cmd: list[str], control: Optional[JobControl] = None, **kwargs) -> subprocess.Popen:
+    if control is None:
+        return subprocess.Popen(cmd, **kwargs)
+    control.checkpoint()
+    group_kwargs = get_process_group_kwargs()
+    if 'creationflags' in group_kwargs:
+        group_kwargs['creationflags'] |= kwargs.pop('creationflags', 0)
+    process = subprocess.Popen(cmd, **kwargs, **group_kwargs)
+    control.register(process)
+    return process
+
+
+def stop_process(process: subprocess.Popen, control: Optional[JobControl] = None):
+    if control is None:
+        process.terminate()
+        return
+    control.unregister(process)
+    kill_tree(process)
+
+
+def run_process(cmd: list[str], control: Optional[JobControl] = None) -> subprocess.CompletedProcess:
+    process = start_process(cmd, control, **get_subprocess_kwargs())
+    try:
+        stdout, stderr = process.communicate()
+    except BaseException:
+        stop_process(process, control)
+        raise
+    if control:
+        control.unregister(process)
+        control.check()
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+class Section(NamedTuple):
+    start: float
+    end: Optional[float]
+
+
+def parse_timestamp(value: str) -> float:
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_sections(text: str) -> list[Section]:
+    sections = list()
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        start, separator, end = part.partition('-')
+        try:
+            section = Section(parse_timestamp(start) if start.strip() else 0.0,
+                              parse_timestamp(end) if end.strip() else None)
+        except ValueError:
+            raise ValueError('invalid_sections', text)
+        if not separator or (section.end is not None and section.end <= section.start):
+            raise ValueError('invalid_sections', text)
+        sections.append(section)
+    return sections
+
+
+def clip_duration(sections: list[Section], duration: float) -> float:
+    return sum(max(0.0, min(duration if section.end is None else section.end, duration) - section.start)
+               for section in sections)
+
+
+def get_section_args(sections: Optional[list[Section]]) -> list[str]:
+    args = list()
+    for section in sections or ():
+        args.extend(['--download-sections', f'*{section.start}-{"inf" if section.end is None else section.end}'])
+    return args
+
+
+PLAYLIST_PATHS = ('playlist', 'channel', 'c', 'user', 'sets', 'album')
+
+
+def is_playlist_url(youtube_url: str) -> bool:
+    url = urllib.parse.urlsplit(youtube_url)
+    if 'list' in urllib.parse.parse_qs(url.query):
+        return True
+    segments = [segment for segment in url.path.split('/') if segment]
+    return bool(segments) and (segments[0].startswith('@') or any(segment in PLAYLIST_PATHS for segment in segments))
+
+
+class PlaylistEntry(NamedTuple):
+    index: int
+    extractor: str
+    video_id: str
+    title: str = ''
+    duration: int = 0
+
+
+def scan_playlist(youtube_url: str, max_playlist: int, metrics: Optional[JobMetrics] = None,
+                  control: Optional[JobControl] = None, engine: str = 'cli',
+                  use_cache: bool = True) -> tuple[list[PlaylistEntry], int]:
+    scan_cache = None
+    if use_cache:
+        import metadata_cache
+        scan_cache = metadata_cache.MetadataCache()
+    if scan_cache and (cached := scan_cache.lookup(youtube_url, max_playlist)):
+        entries, length = [PlaylistEntry(*entry) for entry in cached[0]], cached[1]
+        logger.info(f'Playlist scan (cached): {len(entries)} items of {length}')
+        return entries, length
+
+    if engine == 'pool':
+        if metrics:
+            metrics.job.enter('scan')
+        scanned, length = ytdlp_pool.scan(youtube_url, max_playlist, control)
+        if metrics:
+            metrics.job.enter('dispatch')
+        entries = [PlaylistEntry(*entry) for entry in scanned]
+        logger.info(f'Playlist scan: {len(entries)} items of {length}')
+        if entries and scan_cache:
+            scan_cache.store(youtube_url, max_playlist, entries, length)
+        return entries, length
+
+    cmd = [
+        'yt-dlp',
+        '--flat-playlist',
+        '--playlist-items', f'1:{max_playlist}',
+        '--print', '%(playlist_index|0)d %(playlist_count|0)d %(extractor_key,ie_key|NA)s %(id|NA)s '
+                   '%(duration|0)d %(title|)s',
+        youtube_url,
+    ]
+    if metrics:
+        metrics.job.enter('scan')
+    result = run_process(cmd, control)
+    if metrics:
+        metrics.job.enter('dispatch')
+    entries, length = list(), 0
+    for line in result.stdout.decode(errors='replace').splitlines():
+        if match := SCAN_PATTERN.match(line.strip()):
+            entries.append(PlaylistEntry(int(match.group('index')), match.group('extractor'), match.group('id'),
+                                         match.group('title') or '', int(match.group('duration') or 0)))
+            length = max(length, int(match.group('length')))
+    logger.info(f'Playlist scan: {len(entries)} items of {length}')
+    if entries and not result.returncode and scan_cache:
+        scan_cache.store(youtube_url, max_playlist, entries, length)
+    return entries, length
+
+
+def check_playlist_length(entries: list[PlaylistEntry], length: int, max_playlist: int,
+                          abort_on_long_playlist: bool):
+    if entries and entries[0].index > 0 and abort_on_long_playlist and length > max_playlist:
+        logger.error('error occurred when downloading: playlist too long (%d > %d)', length, max_playlist)
+        raise ValueError('playlist_too_long', str(max_playlist), str(length))
+
+
 def prepare_subprocess(youtube_url: str, audio_only: bool, output_path: str,
                        max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
-                       progress_path: str) -> tuple[list[str], dict]:
+                       progress_path: str, playlist_items: Optional[str] = None,
+                       name_prefix: Optional[str] = None, source_only: bool = False,
+                       video_args: Optional[list[str]] = None, rate_limit: Optional[float] = None,
+                       sections: Optional[list[Section]] = None, archive: Optional[str] = None,
+                       resume: bool = False) -> tuple[list[str], dict]:
     cmd = [
         'yt-dlp',
         '--progress', '--newline',
         #'--restrict-filenames',
-        '--force-overwrites',
-        '--playlist-items', f'1:{max_playlist}'
+        '--playlist-items', playlist_items or f'1:{max_playlist}'
     ]
-
-    print_info = ', '.join((
-        'duration:%(duration)f',
-        'current:%(playlist_autonumber|1)d',
-        'total:%(n_entries|1)d',
-        'length:%(playlist_count|1)d',
-        f'max-playlist:{max_playlist}',
-        f'abort-on-long:{int(abort_on_long_playlist)}',
-    ))
+    cmd.extend(get_archive_args(archive, resume))
+    if rate_limit:
+        cmd.extend(['--limit-rate', str(int(rate_limit))])
+    cmd.extend(get_section_args(sections))
 
     cmd.extend([
         '--print',
-        print_info,
+        get_print_info(max_playlist, abort_on_long_playlist, bool(sections)),
+        '--print',
+        f'after_move:{SAVED_PREFIX}%(filepath)s',
         '--no-simulate',
     ])
 
-    if audio_only:
+    if audio_only and source_only:
+        cmd.extend([
+            '--format', 'bestaudio/best',
+        ])
+    elif audio_only:
         cmd.extend([
             '-x', '--audio-format', 'mp3',
         ])
@@ -203,13 +508,13 @@ def prepare_subprocess(youtube_url: str, audio_only: bool, output_path: str,
             '--format', 'mp4',
             '--format-sort', 'codec:h265',
         ])
-        if do_postprocess:
+        if do_postprocess and not source_only:
             cmd.extend([
                 '--use-postprocessor', 'FFmpegCopyStream',
-                '--postprocessor-args', "CopyStream: -c:a aac -c:v libx265 -tag:v hvc1",
+                '--postprocessor-args', 'CopyStream: {}'.format(' '.join(video_args or H265_ARGS)),
             ])
 
-    if audio_only or do_postprocess:
+    if (audio_only or do_postprocess) and not source_only:
         cmd.extend([
             '--postprocessor-args', "ffmpeg:-progress {}".format(progress_path),
         ])
@@ -218,77 +523,744 @@ def prepare_subprocess(youtube_url: str, audio_only: bool, output_path: str,
         youtube_url,
     ])
 
+    cmd.extend([
+        '-o', get_output_template(output_path, name_prefix, sections),
+    ])
+
+    return cmd, get_subprocess_kwargs()
+
+
+def get_archive_args(archive: Optional[str], resume: bool) -> list[str]:
+    args = list() if resume else ['--force-overwrites']
+    if archive:
+        args.extend(['--download-archive', archive])
+    return args
+
+
+def get_print_info(max_playlist: int, abort_on_long_playlist: bool, clipped: bool = False) -> str:
+    fields = [
+        'duration:%(duration)f',
+        'current:%(playlist_autonumber|1)d',
+        'total:%(n_entries|1)d',
+        'length:%(playlist_count|1)d',
+        f'max-playlist:{max_playlist}',
+        f'abort-on-long:{int(abort_on_long_playlist)}',
+    ]
+    if clipped:
+        fields.append('clip:%(section_end-section_start)f')
+    return ', '.join(fields)
+
+
+def get_output_template(output_path: str, name_prefix: Optional[str] = None,
+                        sections: Optional[list[Section]] = None) -> str:
+    if name_prefix is None:
+        name_prefix = DEFAULT_NAME_PREFIX
+    section_suffix = SECTION_SUFFIX if sections and len(sections) > 1 else ''
+
     if not output_path or os.path.isdir(output_path):
-        cmd.extend([
-            '-o', os.path.join(output_path, '%(playlist_autonumber|)s%(playlist_autonumber&_|)s%(title)s.%(ext)s'),
-        ])
-    else:
-        cmd.extend([
-            '-o', os.path.join(
-                os.path.dirname(output_path),
-                ''.join(('%(playlist_autonumber|)s%(playlist_autonumber&_|)s', os.path.basename(output_path)))
-            ),
-        ])
+        return os.path.join(output_path, f'{name_prefix}%(title)s{section_suffix}.%(ext)s')
+    stem, ext = os.path.splitext(os.path.basename(output_path))
+    return os.path.join(
+        os.path.dirname(output_path),
+        ''.join((name_prefix, stem, section_suffix, ext))
+    )
 
-    kwargs = {
-        'stdout': subprocess.PIPE,
-        'stderr': subprocess.PIPE
+
+def check_ffmpeg_available():
+    import capabilities
+    return capabilities.ffmpeg_available()
+
+
+def check_encoders(audio_only: bool, do_postprocess: bool, both: bool = False):
+    import capabilities
+    encoders = list()
+    if audio_only or both:
+        encoders.append('libmp3lame')
+    if do_postprocess and not audio_only:
+        encoders.extend(('libx265', 'aac'))
+    for encoder in encoders:
+        if not capabilities.has_encoder(encoder):
+            logger.warning('ffmpeg encoder %s is not available', encoder)
+
+
+def probe_duration(file_path: str, control: Optional[JobControl] = None) -> float:
+    result = run_process(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1',
+         file_path],
+        control
+    )
+    try:
+        return float(result.stdout.decode().strip())
+    except ValueError:
+        logger.warning('could not probe duration of %s', file_path)
+        return 0.0
+
+
+def get_source_output(output_path: str) -> str:
+    if output_path and not os.path.isdir(output_path):
+        return os.path.splitext(output_path)[0] + '.%(ext)s'
+    return output_path
+
+
+def run_ffmpeg(source_path: str, target_path: str, args: list[str], duration: float,
+               progress_callback: Callable, count: str = '', item_metrics: Optional[ItemMetrics] = None,
+               control: Optional[JobControl] = None):
+    cmd = ['ffmpeg', '-y', '-nostdin', '-loglevel', 'error', '-i', source_path, *args,
+           '-progress', 'pipe:1', target_path]
+    logger.debug(f'Running {" ".join(cmd)}')
+    process = start_process(cmd, control, **get_subprocess_kwargs())
+    parser = ListenerParser(process.stdout, duration or None, count, progress_callback, item_metrics)
+    try:
+        while data := process.stdout.read1(ListenerThread.read_size):
+            if duration or item_metrics:
+                parser.feed(data)
+    except BaseException:
+        stop_process(process, control)
+        raise
+    finally:
+        parser.close()
+    returncode = wait_process(process, item_metrics)
+    if control:
+        control.unregister(process)
+        control.check()
+    if returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=process.stderr.read())
+    update_progress_percent(100, progress_callback, label='postprocess', part_n=2, part_i=1, count=count)
+
+
+def derive_outputs(source_path: str, do_postprocess: bool, progress_callback: Callable,
+                   count: str = '', video_args: Optional[list[str]] = None,
+                   item_metrics: Optional[ItemMetrics] = None, control: Optional[JobControl] = None) -> list[str]:
+    stem = os.path.splitext(source_path)[0]
+    outputs = {
+        f'{stem}.mp3': MP3_ARGS,
     }
-    if os.name == 'nt':
-        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    if do_postprocess:
+        outputs[f'{stem}.h265.mp4'] = video_args or H265_ARGS
 
-    return cmd, kwargs
+    if item_metrics:
+        item_metrics.enter('postprocess')
+    duration = probe_duration(source_path, control)
+    progress = dict.fromkeys(outputs, 50)
+    lock = Lock()
 
+    def output_callback(target_path: str) -> Callable:
+        def callback(value: int, label: str = None, count: str = None):
+            with lock:
+                progress[target_path] = value
+                progress_callback(sum(progress.values()) // len(progress), label, count)
+        return callback
 
-def check_ffmpeg_available():
+    with ThreadPoolExecutor(max_workers=len(outputs), thread_name_prefix='derive') as executor:
+        futures = [executor.submit(run_ffmpeg, source_path, target_path, args, duration,
+                                   output_callback(target_path), count, item_metrics, control)
+                   for target_path, args in outputs.items()]
+        for future in futures:
+            future.result()
+
+    if do_postprocess:
+        os.replace(f'{stem}.h265.mp4', source_path)
+    if item_metrics:
+        item_metrics.finish()
+    logger.info(f'Derived audio and video outputs from {source_path}')
+    return [f'{stem}.mp3', source_path]
+
+
+def download_both(youtube_url: str, output_path: str, max_playlist: int, abort_on_long_playlist: bool,
+                  do_postprocess: bool, progress_callback: Callable, engine: str = 'cli',
+                  video_args: Optional[list[str]] = None, metrics: Optional[JobMetrics] = None,
+                  control: Optional[JobControl] = None, share: Optional[bandwidth.JobShare] = None,
+                  sections: Optional[list[Section]] = None) -> list[str]:
+    output_path = get_source_output(output_path)
+
+    def download_callback(value: int, label: str = None, count: str = None):
+        progress_callback(value // 2, label, count)
+
+    source_files = get_engine(engine)(youtube_url, False, output_path,
+                                      max_playlist, abort_on_long_playlist, False, download_callback,
+                                      metrics=metrics, control=control, share=share, sections=sections)
+    derived_files = list()
+    for i, source_path in enumerate(source_files, start=1):
+        derived_files.extend(derive_outputs(source_path, do_postprocess, progress_callback,
+                                            f'{str(i)}/{str(len(source_files))}', video_args,
+                                            metrics.item(i) if metrics else None, control))
+    return derived_files
+
+
+def run_download(youtube_url: str, audio_only: bool, output_path: str,
+                 max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                 progress_callback: Callable, playlist_items: Optional[str] = None,
+                 name_prefix: Optional[str] = None, source_only: bool = False,
+                 video_args: Optional[list[str]] = None, metrics: Optional[JobMetrics] = None,
+                 item_key: Optional[int] = None, control: Optional[JobControl] = None,
+                 share: Optional[bandwidth.JobShare] = None, sections: Optional[list[Section]] = None) -> list[str]:
+    use_ffmpeg = (audio_only or do_postprocess) and not source_only
+
+    with get_progress_listener(use_ffmpeg, progress_callback, metrics, item_key) as listener, \
+            bandwidth.open_stream(share) as stream:
+        paced = stream is not None and control is not None and os.name != 'nt'
+        cmd, kwargs = prepare_subprocess(youtube_url, audio_only, output_path,
+                                         max_playlist, abort_on_long_playlist, do_postprocess,
+                                         progress_path='http://{}'.format(listener.listen_on),
+                                         playlist_items=playlist_items, name_prefix=name_prefix,
+                                         source_only=source_only, video_args=video_args,
+                                         rate_limit=stream.rate if stream and not paced else None,
+                                         sections=sections, archive=control and control.archive,
+                                         resume=bool(control and control.resume))
+        process = start_process(cmd, control, **kwargs)
+        if paced:
+            stream.pace = functools.partial(control.hold, process)
+        listener.stream = stream
+        listener.control = control
+        if control:
+            control.on_cancel(listener.stop)
+        listener.enter_item(1, 'metadata')
+        try:
+            for line in process.stdout:
+                if err := listener.parse_yt_dlp_data(line):
+                    logger.error('error occurred when downloading: %s', err)
+                    raise ValueError(*err)
+        except BaseException:
+            stop_process(process, control)
+            raise
+        finally:
+            if control:
+                control.remove_closer(listener.stop)
+        if metrics:
+            wait_process(process, listener.item_metrics)
+        if control:
+            control.unregister(process)
+            control.check()
+    return listener.saved_files
+
+
+def get_engine(engine: str) -> Callable:
+    if engine == 'cli':
+        return run_download
+    if engine == 'embedded':
+        import ytdlp_engine
+        return ytdlp_engine.run_download
+    if engine == 'pool':
+        return ytdlp_pool.run_download
+    raise ValueError('unknown_engine', engine)
+
+
+def download_playlist(youtube_url: str, audio_only: bool, output_path: str,
+                      max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                      progress_callback: Callable, workers: int, engine: str = 'cli',
+                      cache: bool = False, video_args: Optional[list[str]] = None,
+                      metrics: Optional[JobMetrics] = None, control: Optional[JobControl] = None,
+                      share: Optional[bandwidth.JobShare] = None, sections: Optional[list[Section]] = None,
+                      scan_cache: bool = True) -> bool:
+    entries, length = scan_playlist(youtube_url, max_playlist, metrics, control, engine, scan_cache)
+    is_playlist = bool(entries) and entries[0].index > 0
+    if not entries or not (is_playlist or cache):
+        return False
+    check_playlist_length(entries, length, max_playlist, abort_on_long_playlist)
+
+    width = len(str(len(entries)))
+    playlist_progress = PlaylistProgress(len(entries), progress_callback)
+
+    engine_run_download = get_engine(engine)
+    if cache:
+        import media_cache
+        cache = media_cache.MediaCache()
+        media_format = media_cache.get_media_format(audio_only, do_postprocess)
+        profile = media_cache.get_media_profile((video_args or H265_ARGS) if media_format == 'mp4-h265' else None)
+
+    def download_item(autonumber: int, entry: PlaylistEntry):
+        if control:
+            control.checkpoint()
+        name_prefix = f'{autonumber:0{width}d}_' if is_playlist else ''
+        if cache and cache.restore(entry.extractor, entry.video_id, media_format, output_path, name_prefix,
+                                   profile):
+            playlist_progress.item_callback(entry.index)(100, 'cached', None)
+            if metrics:
+                metrics.item(entry.index).finish()
+        else:
+            saved_files = engine_run_download(youtube_url, audio_only, output_path,
+                                              max_playlist, False, do_postprocess,
+                                              playlist_progress.item_callback(entry.index),
+                                              playlist_items=str(entry.index) if is_playlist else None,
+                                              name_prefix=name_prefix, video_args=video_args,
+                                              metrics=metrics, item_key=entry.index, control=control,
+                                              share=share, sections=sections)
+            for file_path in (saved_files if cache else ()):
+                cache.store(entry.extractor, entry.video_id, media_format, file_path, name_prefix, profile)
+        playlist_progress.finish_item(entry.index)
+
+    logger.info(f'Downloading {len(entries)} playlist items with {workers} workers')
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='playlist-item') as executor:
+        futures = [executor.submit(download_item, autonumber, entry)
+                   for autonumber, entry in enumerate(entries, start=1)]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if err := future.exception():
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise err
+    return True
+
+
+def transcode_source(source_path: str, audio_only: bool, progress_callback: Callable, count: str = '',
+                     video_args: Optional[list[str]] = None, item_metrics: Optional[ItemMetrics] = None,
+                     control: Optional[JobControl] = None) -> str:
+    stem, ext = os.path.splitext(source_path)
+    if audio_only and ext.lower() == '.mp3':
+        update_progress_percent(100, progress_callback, label='postprocess', part_n=2, part_i=1, count=count)
+        return source_path
+
+    duration = probe_duration(source_path, control)
+    if audio_only:
+        target_path = f'{stem}.mp3'
+        run_ffmpeg(source_path, target_path, MP3_ARGS, duration, progress_callback, count, item_metrics, control)
+        os.remove(source_path)
+        return target_path
+
+    run_ffmpeg(source_path, f'{stem}.h265.mp4', video_args or H265_ARGS, duration, progress_callback, count,
+               item_metrics, control)
+    os.replace(f'{stem}.h265.mp4', source_path)
+    return source_path
+
+
+def download_pipeline(youtube_url: str, audio_only: bool, output_path: str,
+                      max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                      progress_callback: Callable, workers: int, transcode_workers: int,
+                      engine: str = 'cli', queue_size: int = 0, video_args: Optional[list[str]] = None,
+                      metrics: Optional[JobMetrics] = None, control: Optional[JobControl] = None,
+                      share: Optional[bandwidth.JobShare] = None, sections: Optional[list[Section]] = None,
+                      scan_cache: bool = True) -> bool:
+    entries, length = scan_playlist(youtube_url, max_playlist, metrics, control, engine, scan_cache)
+    if not entries or entries[0].index == 0:
+        return False
+    check_playlist_length(entries, length, max_playlist, abort_on_long_playlist)
+
+    width = len(str(len(entries)))
+    playlist_progress = PlaylistProgress(len(entries), progress_callback)
+    transcode_queue = queue.Queue(maxsize=queue_size or 2 * transcode_workers)
+    source_output = get_source_output(output_path)
+    engine_run_download = get_engine(engine)
+    errors = list()
+
+    def download_item(autonumber: int, entry: PlaylistEntry):
+        if errors:
+            return
+        if control:
+            control.checkpoint()
+        item_callback = playlist_progress.item_callback(entry.index)
+
+        def download_callback(value: int, label: str = None, count: str = None):
+            item_callback(value // 2, label, count)
+
+        saved_files = engine_run_download(youtube_url, audio_only, source_output,
+                                          max_playlist, False, do_postprocess, download_callback,
+                                          playlist_items=str(entry.index), name_prefix=f'{autonumber:0{width}d}_',
+                                          source_only=True, metrics=metrics, item_key=entry.index,
+                                          control=control, share=share, sections=sections)
+        for source_path in saved_files:
+            if metrics:
+                metrics.item(entry.index).enter('queued')
+            transcode_queue.put((entry, source_path))
+
+    def transcode_items():
+        while (item := transcode_queue.get()) is not None:
+            entry, source_path = item
+            if errors:
+                continue
+            item_metrics = metrics.item(entry.index) if metrics else None
+            try:
+                if item_metrics:
+                    item_metrics.enter('postprocess')
+                transcode_source(source_path, audio_only, playlist_progress.item_callback(entry.index),
+                                 video_args=video_args, item_metrics=item_metrics, control=control)
+                if item_metrics:
+                    item_metrics.finish()
+                playlist_progress.finish_item(entry.index)
+            except JobCancelled as e:
+                errors.append(e)
+            except Exception as e:
+                logger.exception(f'transcoding {source_path} failed')
+                errors.append(e)
+
+    logger.info(f'Pipelining {len(entries)} playlist items: '
+                f'{workers} download workers, {transcode_workers} transcode workers')
+    transcoders = [Thread(target=transcode_items, name=f'transcode-{i}') for i in range(transcode_workers)]
+    for transcoder in transcoders:
+        transcoder.start()
     try:
-        subprocess.run(
-            ['ffmpeg', '-version'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True
-        )
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='download-stage') as executor:
+            futures = [executor.submit(download_item, autonumber, entry)
+                       for autonumber, entry in enumerate(entries, start=1)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if err := future.exception():
+                    errors.append(err)
+                    executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        for _ in transcoders:
+            transcode_queue.put(None)
+        for transcoder in transcoders:
+            transcoder.join()
+    if errors:
+        raise errors[0]
+    return True
+
+
+def get_stream_target_template(output_path: str, name_prefix: Optional[str] = None) -> str:
+    stem = os.path.splitext(get_output_template(output_path, name_prefix))[0]
+    return stem.replace('%(title)s', '%(title)S')
+
+
+def stream_audio(youtube_url: str, output_path: str, max_playlist: int, abort_on_long_playlist: bool,
+                 progress_callback: Callable, playlist_items: Optional[str] = None,
+                 name_prefix: Optional[str] = None, metrics: Optional[JobMetrics] = None,
+                 item_key: Optional[int] = None, control: Optional[JobControl] = None,
+                 share: Optional[bandwidth.JobShare] = None) -> list[str]:
+    cmd = [
+        'yt-dlp',
+        '--progress', '--newline',
+        '--playlist-items', playlist_items or '1',
+        *get_archive_args(control and control.archive, bool(control and control.resume)),
+        '--format', 'bestaudio/best',
+        '--print', get_print_info(max_playlist, abort_on_long_playlist),
+        '--print', f'before_dl:{TARGET_PREFIX}{get_stream_target_template(output_path, name_prefix)}',
+        '--no-simulate',
+        '-o', '-',
+        youtube_url,
+    ]
+    listener = ListenerThread(None, None, lambda *args: None, metrics, item_key)
+    transcoder = target_path = pump = None
+    errors = list()
+
+    with bandwidth.open_stream(share) as stream:
+        paced = stream is not None and control is not None and os.name != 'nt'
+        if stream and stream.rate and not paced:
+            cmd[1:1] = ['--limit-rate', str(int(stream.rate))]
+        process = start_process(cmd, control, **get_subprocess_kwargs())
+        if paced:
+            stream.pace = functools.partial(control.hold, process)
+        listener.stream = stream
+        listener.enter_item(1, 'metadata')
+        try:
+            for line in process.stderr:
+                if not line.startswith(TARGET_PREFIX.encode()):
+                    if err := listener.parse_yt_dlp_data(line):
+                        logger.error('error occurred when downloading: %s', err)
+                        raise ValueError(*err)
+                    if not DOWNLOAD_PATTERN.search(line.decode(errors='replace')):
+                        errors.append(line)
+                    continue
+                if transcoder is not None:
+                    continue
+                target_path = f'{line[len(TARGET_PREFIX):].decode().strip()}.mp3'
+                transcoder_cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', 'pipe:0', *MP3_ARGS,
+                                  '-progress', 'pipe:1', target_path]
+                logger.debug(f'Streaming into {" ".join(transcoder_cmd)}')
+                transcoder = start_process(transcoder_cmd, control, stdin=process.stdout,
+                                           **get_subprocess_kwargs())
+                process.stdout.close()
+                if listener.item_metrics is not None:
+                    listener.item_metrics.enter('stream')
+                parser = ListenerParser(transcoder.stdout, listener.final_duration, listener.get_count_str(),
+                                        progress_callback, listener.item_metrics, part_n=1, part_i=0)
+                pump = Thread(target=pump_progress, args=(transcoder, parser), name='stream-progress', daemon=True)
+                pump.start()
+        except BaseException:
+            stop_process(process, control)
+            if transcoder is not None:
+                stop_process(transcoder, control)
+            raise
+        finally:
+            if pump is not None:
+                pump.join()
+            if transcoder is None:
+                process.stdout.close()
+
+        returncode = wait_process(process, listener.item_metrics)
+        transcoder_returncode = wait_process(transcoder, listener.item_metrics) if transcoder else None
+        if control:
+            control.unregister(process)
+            if transcoder:
+                control.unregister(transcoder)
+            control.check()
+
+    if returncode or transcoder is None:
+        with contextlib.suppress(OSError, TypeError):
+            os.remove(target_path)
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=b''.join(errors[-20:]))
+    if transcoder_returncode:
+        with contextlib.suppress(OSError):
+            os.remove(target_path)
+        raise subprocess.CalledProcessError(transcoder_returncode, transcoder.args, stderr=transcoder.stderr.read())
+    listener.finish_item()
+    update_progress_percent(100, progress_callback, label='postprocess', count=listener.get_count_str())
+    logger.info(f'Streamed audio into {target_path}')
+    return [target_path]
+
+
+def pump_progress(process: subprocess.Popen, parser: ListenerParser):
+    try:
+        while data := process.stdout.read1(ListenerThread.read_size):
+            parser.feed(data)
+    except Exception:
+        logger.exception('failed to parse streaming progress')
+    finally:
+        parser.close()
+
+
+def download_streamed(youtube_url: str, output_path: str, max_playlist: int, abort_on_long_playlist: bool,
+                      progress_callback: Callable, workers: int, metrics: Optional[JobMetrics] = None,
+                      control: Optional[JobControl] = None, share: Optional[bandwidth.JobShare] = None,
+                      scan_cache: bool = True) -> bool:
+    entries, length = scan_playlist(youtube_url, max_playlist, metrics, control, use_cache=scan_cache)
+    if not entries:
+        return False
+    check_playlist_length(entries, length, max_playlist, abort_on_long_playlist)
+    if entries[0].index == 0:
+        stream_audio(youtube_url, output_path, max_playlist, False, progress_callback,
+                     metrics=metrics, control=control, share=share)
         return True
-    except (subprocess.CalledProcessError, FileNotFoundError, PermissionError) as e:
-        logger.error('ffmpeg is not usable: %s', e)
+
+    width = len(str(len(entries)))
+    playlist_progress = PlaylistProgress(len(entries), progress_callback)
+
+    def stream_item(autonumber: int, entry: PlaylistEntry):
+        if control:
+            control.checkpoint()
+        stream_audio(youtube_url, output_path, max_playlist, False, playlist_progress.item_callback(entry.index),
+                     playlist_items=str(entry.index), name_prefix=f'{autonumber:0{width}d}_',
+                     metrics=metrics, item_key=entry.index, control=control, share=share)
+        playlist_progress.finish_item(entry.index)
+
+    logger.info(f'Streaming {len(entries)} playlist items with {workers} workers')
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stream-item') as executor:
+        futures = [executor.submit(stream_item, autonumber, entry)
+                   for autonumber, entry in enumerate(entries, start=1)]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if err := future.exception():
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise err
+    return True
+
+
+def resolve_media(youtube_url: str, audio_only: bool, output_path: str, max_playlist: int,
+                  control: Optional[JobControl] = None) -> list[dict]:
+    cmd = [
+        'yt-dlp',
+        '--playlist-items', f'1:{max_playlist}',
+        '--format', 'bestaudio/best' if audio_only else 'mp4',
+        *(() if audio_only else ('--format-sort', 'codec:h265')),
+        '--print', '%(.{url,http_headers,protocol,filename})j',
+        '-o', get_output_template(output_path),
+        youtube_url,
+    ]
+    result = run_process(cmd, control)
+    media = list()
+    for line in result.stdout.decode(errors='replace').splitlines():
+        with contextlib.suppress(ValueError):
+            media.append(json.loads(line))
+    return media
+
+
+def download_segmented(youtube_url: str, audio_only: bool, output_path: str, max_playlist: int,
+                       do_postprocess: bool, progress_callback: Callable, segments: int,
+                       video_args: Optional[list[str]] = None, metrics: Optional[JobMetrics] = None,
+                       control: Optional[JobControl] = None, share: Optional[bandwidth.JobShare] = None) -> bool:
+    import segmented_fetch
+    media = resolve_media(youtube_url, audio_only, output_path, max_playlist, control)
+    if not media or any(info.get('protocol') not in ('http', 'https') or not info.get('url') for info in media):
+        logger.info('Segmented download not possible, falling back to yt-dlp')
         return False
 
+    use_ffmpeg = audio_only or do_postprocess
+    part_n = 2 if use_ffmpeg else 1
+    for i, info in enumerate(media, start=1):
+        count = f'{str(i)}/{str(len(media))}'
+        item_metrics = metrics.item(i) if metrics else None
+
+        def fetch_callback(done: int, total: int):
+            update_progress(done, total, progress_callback, label='download', part_n=part_n, part_i=0, count=count)
+            if item_metrics:
+                item_metrics.add_transfer(done)
+
+        if item_metrics:
+            item_metrics.enter('transfer')
+        if control:
+            control.track(info['filename'])
+        with bandwidth.open_stream(share, pace=control.sleep if control else time.sleep) as stream:
+            segmented_fetch.fetch(info['url'], info['filename'], info.get('http_headers'), segments,
+                                  progress_callback=fetch_callback, checkpoint=control and control.checkpoint,
+                                  throttle=stream and stream.transferred)
+        if use_ffmpeg:
+            if item_metrics:
+                item_metrics.enter('postprocess')
+            transcode_source(info['filename'], audio_only, progress_callback, count, video_args, item_metrics,
+                             control)
+        else:
+            update_progress_percent(100, progress_callback, label='download', count=count)
+        if item_metrics:
+            item_metrics.finish()
+    return True
+
+
+def dispatch_download(youtube_url: str, audio_only: bool, output_path: str,
+                      max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                      progress_callback: Callable, workers: int, engine: str, cache: bool, both: bool,
+                      pipeline: bool, transcode_workers: int, video_args: Optional[list[str]],
+                      metrics: Optional[JobMetrics] = None, prescan: bool = True, segments: int = 0,
+                      control: Optional[JobControl] = None, share: Optional[bandwidth.JobShare] = None,
+                      streaming: bool = False, sections: Optional[list[Section]] = None):
+    use_ffmpeg = audio_only or do_postprocess or both
+    if sections:
+        cache = streaming = False
+        segments = 0
+
+    if prescan and is_playlist_url(youtube_url):
+        entries, length = scan_playlist(youtube_url, max_playlist, metrics, control, engine)
+        check_playlist_length(entries, length, max_playlist, abort_on_long_playlist)
+        if entries:
+            progress_callback(0, 'scan', f'0/{len(entries)}')
+
+    if both:
+        download_both(youtube_url, output_path, max_playlist, abort_on_long_playlist, do_postprocess,
+                      progress_callback, engine, video_args, metrics, control, share, sections)
+    elif streaming and audio_only and download_streamed(youtube_url, output_path, max_playlist,
+                                                        abort_on_long_playlist, progress_callback, workers,
+                                                        metrics, control, share, prescan):
+        pass
+    elif segments > 1 and download_segmented(youtube_url, audio_only, output_path, max_playlist, do_postprocess,
+                                             progress_callback, segments, video_args, metrics, control, share):
+        pass
+    elif pipeline and use_ffmpeg and download_pipeline(youtube_url, audio_only, output_path,
+                                                       max_playlist, abort_on_long_playlist, do_postprocess,
+                                                       progress_callback, workers, transcode_workers, engine,
+                                                       video_args=video_args, metrics=metrics, control=control,
+                                                       share=share, sections=sections, scan_cache=prescan):
+        pass
+    elif (workers > 1 or cache) and download_playlist(youtube_url, audio_only, output_path,
+                                                      max_playlist, abort_on_long_playlist, do_postprocess,
+                                                      progress_callback, workers, engine, cache, video_args,
+                                                      metrics, control, share, sections, prescan):
+        pass
+    else:
+        get_engine(engine)(youtube_url, audio_only, output_path,
+                           max_playlist, abort_on_long_playlist, do_postprocess, progress_callback,
+                           video_args=video_args, metrics=metrics, control=control, share=share,
+                           sections=sections)
+
+
+def record_library(youtube_url: str, output_path: str, max_playlist: int, existing_outputs: dict,
+                   scan_cache: bool = True, engine: str = 'cli', control: Optional[JobControl] = None):
+    import library
+    entries, _ = scan_playlist(youtube_url, max_playlist, control=control, engine=engine, use_cache=scan_cache)
+    try:
+        library.Library().record_outputs(output_path, existing_outputs, youtube_url, entries)
+    except sqlite3.Error:
+        logger.exception('updating the library index failed')
+
 
 def download(youtube_url: str, audio_only: bool, output_path: str,
              max_playlist: int = -1, abort_on_long_playlist: bool = False, do_postprocess: bool = True,
-             progress_callback: Callable = default_progress_callback):
+             progress_callback: Callable = default_progress_callback, workers: int = 1,
+             engine: str = 'cli', cache: bool = False, both: bool = False,
+             pipeline: bool = False, transcode_workers: int = 1, transcode_profile: Optional[dict] = None,
+             metrics: bool = True, profile: bool = False, prescan: bool = True, segments: int = 0,
+             control: Optional[JobControl] = None, priority: int = 0, share: Optional[bandwidth.JobShare] = None,
+             streaming: bool = False, dedupe: bool = False, library: bool = False,
+             sections: Optional[list[Section]] = None, dedupe_hardlinks: bool = False):
 
-    use_ffmpeg = audio_only or do_postprocess
+    use_ffmpeg = audio_only or do_postprocess or both
 
     if use_ffmpeg and not check_ffmpeg_available():
         raise EnvironmentError("FFmpeg is not available or not usable. Please ensure it is installed and accessible.")
+    if use_ffmpeg:
+        check_encoders(audio_only, do_postprocess, both)
 
-    with get_progress_listener(use_ffmpeg, progress_callback) as listener:
-        cmd, kwargs = prepare_subprocess(youtube_url, audio_only, output_path,
-                                         max_playlist, abort_on_long_playlist, do_postprocess,
-                                         progress_path='http://{}'.format(listener.listen_on))
-        process = subprocess.Popen(cmd, **kwargs)
-        for line in process.stdout:
-            if err := listener.parse_yt_dlp_data(line):
-                process.terminate()
-                logger.error('error occurred when downloading: %s', err)
-                raise ValueError(*err)
+    if engine == 'pool' and not ytdlp_pool.available():
+        ytdlp_pool.warn_unavailable()
+        engine = 'cli'
+
+    video_args = None
+    if transcode_profile is not None:
+        video_args = transcode_profiles.get_video_args(transcode_profile, transcode_workers if pipeline else workers)
+
+    bus = None
+    if not isinstance(progress_callback, ProgressPublisher):
+        bus = ProgressBus()
+        bus.subscribe(progress_callback, CALLBACK_RATE)
+        progress_callback = bus.publisher(youtube_url)
+    registered = share is None
+    if registered:
+        share = bandwidth.register(progress_callback.job_id, priority)
+    job_metrics = None
+    if metrics:
+        job_metrics = JobMetrics(progress_callback.job_id, youtube_url, {
+            'audio_only': audio_only, 'do_postprocess': do_postprocess, 'both': both, 'engine': engine,
+            'workers': workers, 'cache': bool(cache), 'pipeline': pipeline, 'transcode_workers': transcode_workers,
+            'segments': segments, 'priority': share.priority, 'streaming': streaming, 'dedupe': dedupe,
+            'library': library, 'sections': sections,
+        })
+    if control:
+        control.watch(output_path)
+    store = existing_outputs = None
+    if dedupe or library:
+        import media_store
+        existing_outputs = media_store.snapshot(output_path)
+        if dedupe:
+            store = media_store.MediaStore(hardlinks=dedupe_hardlinks)
+            if store.link_mode == 'inactive':
+                logger.warning('The media store cannot reflink on this file system and hardlinks are disabled, '
+                               'not deduplicating outputs')
+                store = None
+    status = 'failed'
+    try:
+        with profiled(progress_callback.job_id, profile):
+            dispatch_download(youtube_url, audio_only, output_path, max_playlist, abort_on_long_playlist,
+                              do_postprocess, progress_callback, workers, engine, cache, both,
+                              pipeline, transcode_workers, video_args, job_metrics, prescan, segments, control,
+                              share, streaming, sections)
+        if store:
+            if job_metrics:
+                job_metrics.job.enter('dedupe')
+            store.adopt_outputs(output_path, existing_outputs, youtube_url)
+        if library:
+            record_library(youtube_url, output_path, max_playlist, existing_outputs, prescan, engine, control)
+        status = 'done'
+        if bus:
+            progress_callback.complete()
+    except JobCancelled:
+        status = 'cancelled'
+        logger.info('Download cancelled')
+        control.cleanup()
+        raise
+    finally:
+        if registered:
+            bandwidth.unregister(share)
+        if bus:
+            bus.close()
+        if job_metrics:
+            job_metrics.finish(status)
+            write_metrics(job_metrics)
     logger.info('Download finished')
 
 
+if __name__ == '__main__':
+    import argparse
 
+    parser = argparse.ArgumentParser(description='Download a video or playlist with yt-dlp and ffmpeg')
+    parser.add_argument('url')
+    parser.add_argument('output_path', help='output file, or a directory for playlists')
+    parser.add_argument('--video', action='store_true', help='keep the video instead of extracting mp3 audio')
+    parser.add_argument('--both', action='store_true', help='keep the video and also extract mp3 audio')
+    parser.add_argument('--no-postprocess', action='store_true', help='skip the libx265 video transcode')
+    parser.add_argument('--max-playlist', type=int, default=10)
+    parser.add_argument('--abort-on-long-playlist', action='store_true')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--engine', choices=ENGINES, default='pool')
+    parser.add_argument('--sections', type=parse_sections, default='',
+                        help='only download these time ranges, e.g. "1:30-2:45,10:00-"')
+    args = parser.parse_args()
 
-if __name__ == "__main__":
-    # youtube_url = 'https://www.youtube.com/watch?v=YG9otasNmxI'
-    # youtube_url = 'https://www.youtube.com/watch?v=-4_bi5E6Z1E'
-    # youtube_url = 'https://www.youtube.com/playlist?list=PL8-QChleIXYoF73aPIswV0umaJLPJ7Jod'         # short list
-    # youtube_url = 'https://www.youtube.com/playlist?list=PL8-QChleIXYo1bmmKrbh5H52IsJWnJ_8L'       # long list
-    # youtube_url = 'https://www.youtube.com/watch?v=cC1xVOiCAwc'
-    youtube_url = 'https://www.youtube.com/watch?v=VQX_achGHew'
-    # output_mp3_path = '/Users/betty/projects/2024-03-20/talelle/song.mp3'
-    output_mp3_path = '/Users/betty/projects/2025-03-25/vetochka/2025-03-25_vetochka.mp3'
-    output_mp4_path = '/Users/betty/projects/2024-03-20/yona'
-    # download(youtube_url, True, output_path=output_mp3_path, do_postprocess=False)
-    download(youtube_url = 'https://www.youtube.com/watch?v=VQX_achGHew', audio_only = True,
-             output_path = '/Users/betty/projects/2025-03-25/vetochka/2025-03-25_vetochka.mp3',
-             max_playlist = 10, abort_on_long_playlist = True, do_postprocess = False)
\ No newline at end of file
+    download(args.url, not args.video, args.output_path, max_playlist=args.max_playlist,
+             abort_on_long_playlist=args.abort_on_long_playlist, do_postprocess=not args.no_postprocess,
+             workers=args.workers, engine=args.engine, both=args.both, sections=args.sections or None)
@@ -0,0 +1,198 @@
+import contextlib
+import logging
+import os
+import re
+import signal
+import subprocess
+import time
+from threading import Lock, Event, Thread
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+CANCEL_TIMEOUT = 5.0
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.segments.json', '.temp.mp4', '.temp.m4a', '.temp.webm')
+FORMAT_ID_PATTERN = re.compile('\\.f\\d[\\w-]*$')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def get_process_group_kwargs() -> dict:
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'start_new_session': True}
+
+
+def signal_tree(process: subprocess.Popen, sig: int):
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(process.pid, sig)
+
+
+def kill_tree(process: subprocess.Popen, timeout: float = CANCEL_TIMEOUT):
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, creationflags=subprocess.CREATE_NO_WINDOW)
+        return
+    signal_tree(process, signal.SIGTERM)
+    signal_tree(process, signal.SIGCONT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning(f'process {process.pid} ignored SIGTERM, killing it')
+        signal_tree(process, signal.SIGKILL)
+
+
+def find_partials(directory: str) -> set[str]:
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return set()
+    return {os.path.join(directory, name) for name in names
+            if name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name}
+
+
+def get_partial_stem(path: str) -> str:
+    stem = os.path.splitext(os.path.abspath(path))[0]
+    return FORMAT_ID_PATTERN.sub('', stem)
+
+
+class JobControl:
+    def __init__(self, archive: Optional[str] = None, resume: bool = False):
+        self.archive = archive
+        self.resume = resume
+        self.lock = Lock()
+        self.resumed = Event()
+        self.resumed.set()
+        self.stopped = Event()
+        self.cancelled = False
+        self.keep_partial = False
+        self.processes = set()
+        self.closers = list()
+        self.directories = dict()
+        self.stems = set()
+        self.killers = list()
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def checkpoint(self):
+        self.check()
+        while not self.resumed.wait(0.5):
+            self.check()
+        self.check()
+
+    def register(self, process: subprocess.Popen):
+        with self.lock:
+            if not self.cancelled:
+                self.processes.add(process)
+                if self.paused and os.name != 'nt':
+                    signal_tree(process, signal.SIGSTOP)
+                return
+        kill_tree(process)
+        raise JobCancelled()
+
+    def unregister(self, process: subprocess.Popen):
+        with self.lock:
+            self.processes.discard(process)
+
+    def on_cancel(self, closer: Callable):
+        with self.lock:
+            if not self.cancelled:
+                self.closers.append(closer)
+                return
+        closer()
+
+    def remove_closer(self, closer: Callable):
+        with self.lock:
+            if closer in self.closers:
+                self.closers.remove(closer)
+
+    def watch(self, output_path: str):
+        is_directory = os.path.isdir(output_path or '.')
+        directory = output_path if is_directory else os.path.dirname(output_path) or '.'
+        self.directories.setdefault(directory, find_partials(directory))
+        if not is_directory:
+            self.track(output_path)
+
+    def track(self, path: str):
+        with self.lock:
+            self.stems.add(get_partial_stem(path))
+
+    def owns(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        return any(path.startswith(f'{stem}.') for stem in self.stems)
+
+    def sleep(self, seconds: float):
+        self.stopped.wait(seconds)
+
+    def hold(self, process: subprocess.Popen, seconds: float):
+        if os.name == 'nt':
+            return
+        with self.lock:
+            if self.cancelled or self.paused or process not in self.processes:
+                return
+            signal_tree(process, signal.SIGSTOP)
+        self.sleep(seconds)
+        with self.lock:
+            if not self.paused and process in self.processes:
+                signal_tree(process, signal.SIGCONT)
+
+    def pause(self):
+        with self.lock:
+            if self.cancelled or self.paused:
+                return
+            self.resumed.clear()
+            if os.name == 'nt':
+                logger.warning('pausing running processes is not supported on Windows')
+            else:
+                for process in self.processes:
+                    signal_tree(process, signal.SIGSTOP)
+        logger.info('Job paused')
+
+    def resume(self):
+        with self.lock:
+            if os.name != 'nt':
+                for process in self.processes:
+                    signal_tree(process, signal.SIGCONT)
+            self.resumed.set()
+        logger.info('Job resumed')
+
+    def cancel(self, keep_partial: bool = False, timeout: float = CANCEL_TIMEOUT):
+        with self.lock:
+            self.cancelled = True
+            self.stopped.set()
+            self.keep_partial = keep_partial
+            processes, self.processes = list(self.processes), set()
+            closers, self.closers = list(self.closers), list()
+            self.resumed.set()
+        logger.info(f'Job cancelled, stopping {len(processes)} processes')
+        for closer in closers:
+            with contextlib.suppress(Exception):
+                closer()
+        for process in processes:
+            killer = Thread(target=kill_tree, args=(process, timeout), name='kill-tree', daemon=True)
+            killer.start()
+            self.killers.append(killer)
+
+    def cleanup(self):
+        deadline = time.monotonic() + CANCEL_TIMEOUT
+        for killer in self.killers:
+            killer.join(max(0.0, deadline - time.monotonic()))
+        if self.keep_partial:
+            return
+        for directory, before in self.directories.items():
+            for path in find_partials(directory) - before:
+                if not self.owns(path):
+                    continue
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                    logger.info(f'Removed partial file {path}')
@@ -0,0 +1,325 @@
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import subprocess
+import sys
+import threading
+import time
+from threading import Lock
+from typing import Optional
+
+from talelle_setup import TALELLE_DIR, to_path
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.path.join(TALELLE_DIR, 'metrics')
+JOBS_FILE = 'jobs.jsonl'
+PROMETHEUS_FILE = 'talelle.prom'
+PROFILES_DIR = 'profiles'
+
+SIZE_UNITS = {
+    'B': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4,
+    'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+}
+TRANSFER_PATTERN = re.compile('of\\s+~?\\s*(?P<size>\\d+(\\.\\d+)?)(?P<size_unit>[KMGT]?i?B)'
+                              '(\\s+at\\s+(?P<speed>\\d+(\\.\\d+)?)(?P<speed_unit>[KMGT]?i?B)/s)?')
+
+
+def parse_size(value: Optional[str], unit: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    return float(value) * SIZE_UNITS.get(unit, 1)
+
+
+def parse_transfer(line: str, percent: float) -> Optional[tuple[float, float]]:
+    if match := TRANSFER_PATTERN.search(line):
+        return (parse_size(match.group('size'), match.group('size_unit')) * percent / 100,
+                parse_size(match.group('speed'), match.group('speed_unit')))
+    return None
+
+
+class ItemMetrics:
+    def __init__(self, key):
+        self.key = key
+        self.lock = Lock()
+        self.started = time.time()
+        self.finished = None
+        self.phases = dict()
+        self.phase = None
+        self.phase_started = None
+        self.done_bytes = 0
+        self.stream_bytes = 0
+        self.peak_throughput = 0.0
+        self.ffmpeg = dict()
+        self.cpu_seconds = 0.0
+        self.max_rss = 0
+
+    def enter(self, phase: Optional[str]):
+        with self.lock:
+            now = time.monotonic()
+            if self.phase:
+                self.phases[self.phase] = self.phases.get(self.phase, 0.0) + now - self.phase_started
+            self.phase, self.phase_started = phase, now
+
+    def finish(self):
+        self.enter(None)
+        self.finished = time.time()
+
+    def add_transfer(self, downloaded_bytes: float, speed: Optional[float] = None):
+        with self.lock:
+            if downloaded_bytes < self.stream_bytes:
+                self.done_bytes += self.stream_bytes
+            self.stream_bytes = downloaded_bytes
+            if speed:
+                self.peak_throughput = max(self.peak_throughput, speed)
+
+    def add_ffmpeg(self, key: str, value: str):
+        try:
+            value = float(value.rstrip('x'))
+        except ValueError:
+            return
+        with self.lock:
+            count, total, peak = self.ffmpeg.get(key, (0, 0.0, 0.0))
+            self.ffmpeg[key] = count + 1, total + value, max(peak, value)
+
+    def add_rusage(self, cpu_seconds: float, max_rss: int):
+        with self.lock:
+            self.cpu_seconds += cpu_seconds
+            self.max_rss = max(self.max_rss, max_rss)
+
+    @property
+    def bytes(self) -> int:
+        return int(self.done_bytes + self.stream_bytes)
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            phases = dict(self.phases)
+            if self.phase:
+                phases[self.phase] = phases.get(self.phase, 0.0) + time.monotonic() - self.phase_started
+            transfer = phases.get('transfer')
+            return {
+                'key': self.key,
+                'started': self.started,
+                'finished': self.finished,
+                'phases': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+                'bytes': self.bytes,
+                'avg_throughput': round(self.bytes / transfer, 1) if transfer else None,
+                'peak_throughput': round(self.peak_throughput, 1),
+                'ffmpeg': {key: {'avg': round(total / count, 3), 'peak': round(peak, 3)}
+                           for key, (count, total, peak) in self.ffmpeg.items()},
+                'cpu_seconds': round(self.cpu_seconds, 3),
+                'max_rss': self.max_rss,
+            }
+
+
+class JobMetrics:
+    def __init__(self, job_id: str, url: str, options: Optional[dict] = None):
+        self.job_id = job_id
+        self.url = url
+        self.options = options or dict()
+        self.job = ItemMetrics(job_id)
+        self.job.enter('dispatch')
+        self.items = dict()
+        self.lock = Lock()
+        self.status = None
+
+    def item(self, key) -> ItemMetrics:
+        with self.lock:
+            if key not in self.items:
+                self.items[key] = ItemMetrics(key)
+            return self.items[key]
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        self.job.enter(name)
+        try:
+            yield
+        finally:
+            self.job.enter('dispatch')
+
+    def finish(self, status: str):
+        self.status = status
+        self.job.finish()
+        for item in list(self.items.values()):
+            if item.finished is None:
+                item.finish()
+
+    def as_dict(self) -> dict:
+        job = self.job.as_dict()
+        items = [item.as_dict() for item in list(self.items.values())]
+        job_bytes = sum(item['bytes'] for item in items)
+        transfer = sum(item['phases'].get('transfer', 0.0) for item in items)
+        return {
+            'job_id': self.job_id,
+            'url': self.url,
+            'status': self.status,
+            'options': self.options,
+            'started': job['started'],
+            'finished': job['finished'],
+            'duration': round((job['finished'] or time.time()) - job['started'], 3),
+            'phases': job['phases'],
+            'bytes': job_bytes,
+            'avg_throughput': round(job_bytes / transfer, 1) if transfer else None,
+            'peak_throughput': max((item['peak_throughput'] for item in items), default=0.0),
+            'cpu_seconds': round(sum(item['cpu_seconds'] for item in items), 3),
+            'max_rss': max((item['max_rss'] for item in items), default=0),
+            'items': items,
+        }
+
+
+def wait_process(process: subprocess.Popen, item: Optional[ItemMetrics] = None) -> int:
+    if item is None or not hasattr(os, 'wait4'):
+        return process.wait()
+    with contextlib.suppress(ChildProcessError):
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        item.add_rusage(rusage.ru_utime + rusage.ru_stime,
+                        rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024))
+    return process.wait()
+
+
+class MetricsWriter:
+    def __init__(self, metrics_dir: str = METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self.lock = Lock()
+        self.jobs = dict()
+        self.totals = {'duration': 0.0, 'bytes': 0, 'cpu_seconds': 0.0}
+        self.phases = dict()
+        self.last = None
+
+    def write(self, metrics: JobMetrics):
+        record = metrics.as_dict()
+        try:
+            to_path(self.metrics_dir).mkdir(parents=True, exist_ok=True)
+            with self.lock:
+                with open(os.path.join(self.metrics_dir, JOBS_FILE), 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+                self.update(record)
+                self.write_prometheus()
+        except OSError as e:
+            logger.warning('could not write job metrics: %s', e)
+
+    def update(self, record: dict):
+        self.jobs[record['status']] = self.jobs.get(record['status'], 0) + 1
+        for key in self.totals:
+            self.totals[key] += record[key]
+        for item in record['items']:
+            for phase, seconds in item['phases'].items():
+                self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.last = record
+
+    def write_prometheus(self):
+        lines = [
+            '# HELP talelle_jobs_total Finished download jobs by status.',
+            '# TYPE talelle_jobs_total counter',
+            *(f'talelle_jobs_total{{status="{status}"}} {count}' for status, count in self.jobs.items()),
+            '# HELP talelle_job_seconds_total Wall time spent in download jobs.',
+            '# TYPE talelle_job_seconds_total counter',
+            f'talelle_job_seconds_total {self.totals["duration"]:.3f}',
+            '# HELP talelle_item_phase_seconds_total Time spent per item phase.',
+            '# TYPE talelle_item_phase_seconds_total counter',
+            *(f'talelle_item_phase_seconds_total{{phase="{phase}"}} {seconds:.3f}'
+              for phase, seconds in self.phases.items()),
+            '# HELP talelle_downloaded_bytes_total Bytes transferred by downloads.',
+            '# TYPE talelle_downloaded_bytes_total counter',
+            f'talelle_downloaded_bytes_total {self.totals["bytes"]}',
+            '# HELP talelle_subprocess_cpu_seconds_total CPU time used by yt-dlp and ffmpeg processes.',
+            '# TYPE talelle_subprocess_cpu_seconds_total counter',
+            f'talelle_subprocess_cpu_seconds_total {self.totals["cpu_seconds"]:.3f}',
+        ]
+        if self.last:
+            lines.extend([
+                '# HELP talelle_last_job_seconds Duration of the last finished job.',
+                '# TYPE talelle_last_job_seconds gauge',
+                f'talelle_last_job_seconds {self.last["duration"]}',
+                '# HELP talelle_last_job_throughput_bytes Average and peak throughput of the last finished job.',
+                '# TYPE talelle_last_job_throughput_bytes gauge',
+                f'talelle_last_job_throughput_bytes{{kind="avg"}} {self.last["avg_throughput"] or 0}',
+                f'talelle_last_job_throughput_bytes{{kind="peak"}} {self.last["peak_throughput"]}',
+                '# HELP talelle_last_job_max_rss_bytes Peak subprocess RSS of the last finished job.',
+                '# TYPE talelle_last_job_max_rss_bytes gauge',
+                f'talelle_last_job_max_rss_bytes {self.last["max_rss"]}',
+            ])
+        path = os.path.join(self.metrics_dir, PROMETHEUS_FILE)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f'{path}.tmp', path)
+
+
+_writer = MetricsWriter()
+
+
+def write_metrics(metrics: JobMetrics):
+    _writer.write(metrics)
+
+
+class ThreadProfiles:
+    def __init__(self):
+        self.lock = Lock()
+        self.profilers = list()
+
+    def __call__(self, frame, event, arg):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+
+_profile_lock = Lock()
+
+
+@contextlib.contextmanager
+def profiled(job_id: str, enabled: bool = True):
+    if not enabled:
+        yield
+        return
+    profiles_dir = os.path.join(METRICS_DIR, PROFILES_DIR)
+    to_path(profiles_dir).mkdir(parents=True, exist_ok=True)
+    safe_name = re.sub('[^\\w.-]+', '_', job_id)[:80]
+    profile_path = os.path.join(profiles_dir, f'{safe_name}_{time.time_ns()}.prof')
+    if not _profile_lock.acquire(blocking=False):
+        logger.info(f'Job {job_id} waits for the running profiled job to finish')
+        _profile_lock.acquire()
+    # cProfile only sees all threads by itself from 3.12 on, older versions need one profiler per new thread
+    thread_profiles = ThreadProfiles() if sys.version_info < (3, 12) else None
+    profiler = cProfile.Profile()
+    try:
+        if thread_profiles:
+            threading.setprofile(thread_profiles)
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if thread_profiles:
+                threading.setprofile(None)
+            stats = pstats.Stats(profiler)
+            if thread_profiles:
+                with thread_profiles.lock:
+                    for thread_profiler in thread_profiles.profilers:
+                        with contextlib.suppress(TypeError):
+                            stats.add(thread_profiler)
+            stats.dump_stats(profile_path)
+            logger.info(f'Profile of job {job_id} written to {profile_path}')
+    finally:
+        _profile_lock.release()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize recorded per-job metrics')
+    parser.add_argument('--last', type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(METRICS_DIR, JOBS_FILE), 'r') as f:
+        records = [json.loads(line) for line in f if line.strip()][-args.last:]
+    for record in records:
+        phases = ', '.join(f'{phase} {seconds:.1f}s' for phase, seconds in record['phases'].items())
+        print(f'{record["job_id"]}: {record["status"]} in {record["duration"]:.1f}s, {record["bytes"]} bytes, '
+              f'avg {record["avg_throughput"] or 0:.0f} B/s, cpu {record["cpu_seconds"]:.1f}s ({phases})')
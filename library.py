@@ -0,0 +1,254 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Optional, NamedTuple
+
+from talelle_setup import TALELLE_DIR
+from media_store import MEDIA_EXTENSIONS, snapshot
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_FILE = os.path.join(TALELLE_DIR, 'library.sqlite')
+AUTONUMBER_PATTERN = re.compile('^(?P<autonumber>\\d+)_')
+
+SCHEMA = (
+    '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    duration REAL,
+    source_url TEXT NOT NULL DEFAULT '',
+    video_id TEXT NOT NULL DEFAULT '',
+    extractor TEXT NOT NULL DEFAULT ''
+)''',
+    'CREATE INDEX IF NOT EXISTS files_by_directory ON files (directory)',
+    'CREATE INDEX IF NOT EXISTS files_by_mtime ON files (mtime DESC, path)',
+    'CREATE INDEX IF NOT EXISTS files_by_video ON files (video_id)',
+    '''
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    mtime REAL NOT NULL
+)''',
+    'CREATE INDEX IF NOT EXISTS directories_by_parent ON directories (parent)',
+)
+
+
+class LibraryEntry(NamedTuple):
+    path: str
+    directory: str
+    name: str
+    format: str
+    size: int
+    mtime: float
+    duration: Optional[float]
+    source_url: str
+    video_id: str
+    extractor: str
+
+
+class ScanStats(NamedTuple):
+    directories: int
+    listed: int
+    added: int
+    removed: int
+    seconds: float
+
+
+def get_format(name: str) -> str:
+    return os.path.splitext(name)[1][1:].lower()
+
+
+def is_under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+class Library:
+    def __init__(self, path: str = LIBRARY_FILE):
+        self.path = path
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+
+    @contextmanager
+    def transaction(self):
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    @contextmanager
+    def query(self):
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            db.row_factory = sqlite3.Row
+            yield db
+
+    @staticmethod
+    def list_directory(directory: str) -> tuple[list[str], dict[str, os.stat_result]]:
+        subdirectories, files = list(), dict()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.name.lower().endswith(MEDIA_EXTENSIONS) and entry.is_file():
+                        files[entry.path] = entry.stat()
+                except OSError:
+                    continue
+        return subdirectories, files
+
+    def rescan(self, root: str) -> ScanStats:
+        started = time.perf_counter()
+        root = os.path.abspath(root)
+        with self.query() as db:
+            known = {row['path']: row['mtime'] for row in db.execute('SELECT path, mtime FROM directories')
+                     if is_under(row['path'], root)}
+            children = dict()
+            for row in db.execute('SELECT path, parent FROM directories'):
+                if row['path'] in known:
+                    children.setdefault(row['parent'], list()).append(row['path'])
+
+        seen, changed = set(), list()
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime
+            except OSError:
+                continue
+            seen.add(directory)
+            if known.get(directory) == mtime:
+                stack.extend(children.get(directory, ()))
+                continue
+            try:
+                subdirectories, files = self.list_directory(directory)
+            except OSError:
+                logger.warning(f'cannot list {directory}')
+                continue
+            changed.append((directory, mtime, files))
+            stack.extend(subdirectories)
+
+        added = removed = 0
+        with self.transaction() as db:
+            for directory, mtime, files in changed:
+                db.execute('INSERT OR REPLACE INTO directories (path, parent, mtime) VALUES (?, ?, ?)',
+                           (directory, os.path.dirname(directory), mtime))
+                indexed = {row['path']: (row['size'], row['mtime']) for row in
+                           db.execute('SELECT path, size, mtime FROM files WHERE directory = ?', (directory,))}
+                for path in indexed.keys() - files.keys():
+                    db.execute('DELETE FROM files WHERE path = ?', (path,))
+                    removed += 1
+                for path, stat in files.items():
+                    if indexed.get(path) == (stat.st_size, stat.st_mtime):
+                        continue
+                    if path not in indexed:
+                        added += 1
+                    name = os.path.basename(path)
+                    db.execute(
+                        'INSERT INTO files (path, directory, name, format, size, mtime) VALUES (?, ?, ?, ?, ?, ?) '
+                        'ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime',
+                        (path, directory, name, get_format(name), stat.st_size, stat.st_mtime)
+                    )
+            for directory in known.keys() - seen:
+                db.execute('DELETE FROM directories WHERE path = ?', (directory,))
+                removed += db.execute('DELETE FROM files WHERE directory = ?', (directory,)).rowcount
+
+        stats = ScanStats(len(seen), len(changed), added, removed, round(time.perf_counter() - started, 3))
+        logger.info(f'Library scan of {root}: {stats}')
+        return stats
+
+    def record(self, file_path: str, source_url: str = '', video_id: str = '', extractor: str = '',
+               duration: Optional[float] = None):
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        name = os.path.basename(file_path)
+        with self.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO files (path, directory, name, format, size, mtime, duration, source_url, '
+                'video_id, extractor) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_path, os.path.dirname(file_path), name, get_format(name), stat.st_size, stat.st_mtime,
+                 duration, source_url, video_id, extractor.lower())
+            )
+
+    def record_outputs(self, output_path: str, before: dict[str, tuple[int, int]], source_url: str,
+                       entries: Optional[list[list]] = None):
+        entries = entries or list()
+        for path, state in snapshot(output_path).items():
+            if before.get(path) == state:
+                continue
+            entry = None
+            if len(entries) == 1:
+                entry = entries[0]
+            elif match := AUTONUMBER_PATTERN.match(os.path.basename(path)):
+                autonumber = int(match.group('autonumber'))
+                entry = entries[autonumber - 1] if 0 < autonumber <= len(entries) else None
+            try:
+                if entry:
+                    self.record(path, source_url, entry[2], entry[1], float(entry[4]) or None)
+                else:
+                    self.record(path, source_url)
+            except OSError:
+                logger.exception(f'indexing {path} failed')
+
+    @staticmethod
+    def get_search_filter(search: str) -> tuple[str, list]:
+        if not search:
+            return '', list()
+        pattern = f'%{search}%'
+        return 'WHERE (name LIKE ? OR source_url LIKE ? OR video_id = ?)', [pattern, pattern, search]
+
+    def page(self, search: str = '', after: Optional[tuple[float, str]] = None, limit: int = 256
+             ) -> list[LibraryEntry]:
+        where, params = self.get_search_filter(search)
+        if after:
+            where = f'{where} AND' if where else 'WHERE'
+            where = f'{where} (mtime < ? OR (mtime = ? AND path > ?))'
+            params.extend((after[0], after[0], after[1]))
+        with self.query() as db:
+            rows = db.execute(f'SELECT {", ".join(LibraryEntry._fields)} FROM files {where} '
+                              f'ORDER BY mtime DESC, path LIMIT ?', (*params, limit)).fetchall()
+        return [LibraryEntry(*row) for row in rows]
+
+    def count(self, search: str = '') -> int:
+        where, params = self.get_search_filter(search)
+        with self.query() as db:
+            return db.execute(f'SELECT COUNT(*) FROM files {where}', params).fetchone()[0]
+
+    def find(self, source_url: str = '', video_id: str = '') -> list[LibraryEntry]:
+        with self.query() as db:
+            rows = db.execute(f'SELECT {", ".join(LibraryEntry._fields)} FROM files '
+                              "WHERE (? != '' AND source_url = ?) OR (? != '' AND video_id = ?)",
+                              (source_url, source_url, video_id, video_id)).fetchall()
+        return [LibraryEntry(*row) for row in rows]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Index and search downloaded media under the project folders')
+    parser.add_argument('action', choices=('scan', 'search'))
+    parser.add_argument('root_or_text', nargs='?', default='')
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    library = Library()
+    if args.action == 'scan':
+        print(library.rescan(args.root_or_text or os.path.expanduser('~')))
+    else:
+        for entry in library.page(args.root_or_text, limit=args.limit):
+            print(f'{entry.path}\t{entry.format}\t{entry.size}\t{entry.source_url}')
+    print(f'{library.count()} files indexed')
@@ -0,0 +1,204 @@
+import logging
+import os
+from typing import Optional, Callable
+
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QThread, QTimer, QUrl, Signal
+from PySide6.QtGui import QDesktopServices
+from PySide6.QtWidgets import QAbstractItemView, QDialog, QHeaderView, QLabel, QLineEdit, QTableView, QVBoxLayout
+
+import library
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 256
+SEARCH_DELAY_MS = 250
+COLUMNS = ('name', 'format', 'duration', 'size', 'source_url', 'directory')
+HEADER_KEYS = ('library_name', 'library_format', 'library_duration', 'library_size', 'library_source',
+               'library_folder')
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if not seconds:
+        return ''
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
+def format_size(size: int) -> str:
+    return f'{size / 1024 ** 2:.1f} MiB'
+
+
+class LibraryModel(QAbstractTableModel):
+    def __init__(self, library_index: library.Library, parent=None):
+        super().__init__(parent)
+        self.library = library_index
+        self.headers = list(COLUMNS)
+        self.search = ''
+        self.rows = list()
+        self.exhausted = False
+
+    def set_headers(self, headers: list[str]):
+        self.headers = headers
+        self.headerDataChanged.emit(Qt.Orientation.Horizontal, 0, len(COLUMNS) - 1)
+
+    def set_search(self, search: str):
+        self.beginResetModel()
+        self.search = search
+        self.rows = list()
+        self.exhausted = False
+        self.endResetModel()
+
+    def refresh(self):
+        self.set_search(self.search)
+
+    def entry(self, row: int) -> library.LibraryEntry:
+        return self.rows[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.rows[index.row()]
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return entry.path
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        column = COLUMNS[index.column()]
+        if column == 'duration':
+            return format_duration(entry.duration)
+        if column == 'size':
+            return format_size(entry.size)
+        return getattr(entry, column)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.headers[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        after = (self.rows[-1].mtime, self.rows[-1].path) if self.rows else None
+        batch = self.library.page(self.search, after, BATCH_SIZE)
+        self.exhausted = len(batch) < BATCH_SIZE
+        if not batch:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(batch) - 1)
+        self.rows.extend(batch)
+        self.endInsertRows()
+
+
+class ScanThread(QThread):
+    scanFinished = Signal(int)
+
+    def __init__(self, library_index: library.Library, root: str):
+        super().__init__()
+        self.library = library_index
+        self.root = root
+
+    def run(self):
+        try:
+            stats = self.library.rescan(self.root)
+        except Exception:
+            logger.exception(f'library scan of {self.root} failed')
+            self.scanFinished.emit(0)
+            return
+        self.scanFinished.emit(stats.added + stats.removed)
+
+
+class LibraryDialog(QDialog):
+    def __init__(self, translate: Callable, parent=None):
+        super().__init__(parent)
+        self.translate = translate
+        self.library = library.Library()
+        self.model = LibraryModel(self.library, self)
+        self.scanThread = None
+        self.root = None
+
+        searchLineEdit = QLineEdit()
+        searchLineEdit.setClearButtonEnabled(True)
+        searchTimer = QTimer(self)
+        searchTimer.setSingleShot(True)
+        searchTimer.setInterval(SEARCH_DELAY_MS)
+        searchTimer.timeout.connect(self.apply_search)
+        searchLineEdit.textChanged.connect(searchTimer.start)
+
+        tableView = QTableView()
+        tableView.setModel(self.model)
+        tableView.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        tableView.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        tableView.verticalHeader().setVisible(False)
+        tableView.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        tableView.horizontalHeader().setStretchLastSection(True)
+        tableView.setColumnWidth(0, 280)
+        tableView.doubleClicked.connect(self.open_folder)
+
+        statusLabel = QLabel()
+
+        layout = QVBoxLayout()
+        layout.addWidget(searchLineEdit)
+        layout.addWidget(tableView)
+        layout.addWidget(statusLabel)
+        self.setLayout(layout)
+        self.resize(900, 500)
+
+        self.searchLineEdit = searchLineEdit
+        self.tableView = tableView
+        self.statusLabel = statusLabel
+
+    def retranslate(self, is_rtl: bool):
+        self.setWindowTitle(self.translate('library_title'))
+        self.searchLineEdit.setPlaceholderText(self.translate('library_search'))
+        self.model.set_headers([self.translate(key) for key in HEADER_KEYS])
+        self.setLayoutDirection(Qt.LayoutDirection.RightToLeft if is_rtl else Qt.LayoutDirection.LeftToRight)
+        self.update_status()
+
+    def open_library(self, root: str):
+        self.root = root
+        self.model.refresh()
+        self.update_status()
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.rescan()
+
+    def rescan(self):
+        if self.scanThread and self.scanThread.isRunning():
+            return
+        if not os.path.isdir(self.root or ''):
+            return
+        self.scanThread = ScanThread(self.library, self.root)
+        self.scanThread.scanFinished.connect(self.on_scan_finished)
+        self.statusLabel.setText(self.translate('library_scanning'))
+        self.scanThread.start()
+
+    def on_scan_finished(self, changes: int):
+        if changes:
+            self.model.refresh()
+        self.update_status()
+
+    def update_status(self):
+        if self.scanThread and self.scanThread.isRunning():
+            return
+        self.statusLabel.setText(self.translate('library_count').format(self.library.count(self.model.search)))
+
+    def apply_search(self):
+        self.model.set_search(self.searchLineEdit.text().strip())
+        self.update_status()
+
+    def open_folder(self, index: QModelIndex):
+        entry = self.model.entry(index.row())
+        QDesktopServices.openUrl(QUrl.fromLocalFile(entry.directory))
+
+    def wait_scan(self):
+        if self.scanThread:
+            self.scanThread.wait()
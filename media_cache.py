@@ -0,0 +1,207 @@
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Optional, NamedTuple
+
+from media_store import clone_file
+from talelle_setup import TALELLE_DIR, to_path
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(TALELLE_DIR, 'media_cache')
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3
+
+SCHEMA = (
+    '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    media_format TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+)''',
+    'CREATE INDEX IF NOT EXISTS entries_by_use ON entries (last_used)',
+)
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    extractor: str
+    video_id: str
+    media_format: str
+    path: str
+    name: str
+    size: int
+
+
+def get_media_format(audio_only: bool, do_postprocess: bool) -> str:
+    if audio_only:
+        return 'mp3'
+    return 'mp4-h265' if do_postprocess else 'mp4'
+
+
+def get_media_profile(video_args: Optional[list[str]] = None) -> str:
+    return hashlib.sha1(' '.join(video_args).encode()).hexdigest()[:12] if video_args else ''
+
+
+def get_cache_key(extractor: str, video_id: str, media_format: str, profile: str = '') -> str:
+    key = f'{extractor.lower()}:{video_id}:{media_format}'
+    return f'{key}:{profile}' if profile else key
+
+
+def get_target_path(output_path: str, name_prefix: str, name: str) -> str:
+    if not output_path or os.path.isdir(output_path):
+        return os.path.join(output_path, f'{name_prefix}{name}')
+    return os.path.join(os.path.dirname(output_path), f'{name_prefix}{os.path.basename(output_path)}')
+
+
+def clone_or_copy(source: str, target: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(target)
+    if not clone_file(source, target):
+        shutil.copy2(source, target)
+
+
+class MediaCache:
+    def __init__(self, cache_dir: str = CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.files_dir = os.path.join(cache_dir, 'files')
+        self.index_path = os.path.join(cache_dir, 'index.sqlite')
+        self.max_size = max_size
+        to_path(self.files_dir).mkdir(parents=True, exist_ok=True)
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        with closing(sqlite3.connect(self.index_path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def is_intact(entry: CacheEntry) -> bool:
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return False
+        return stat.st_size == entry.size and stat.st_nlink == 1
+
+    def lookup(self, extractor: str, video_id: str, media_format: str, profile: str = '') -> Optional[CacheEntry]:
+        key = get_cache_key(extractor, video_id, media_format, profile)
+        with self.transaction() as db:
+            row = db.execute('SELECT * FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            entry = CacheEntry(row['key'], row['extractor'], row['video_id'], row['media_format'],
+                               row['path'], row['name'], row['size'])
+            if not self.is_intact(entry):
+                logger.info(f'Cache entry {key} is stale or shared with an output, dropping it')
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+                return None
+            db.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+        return entry
+
+    def restore(self, extractor: str, video_id: str, media_format: str,
+                output_path: str, name_prefix: str, profile: str = '') -> Optional[str]:
+        if not (entry := self.lookup(extractor, video_id, media_format, profile)):
+            return None
+        target = get_target_path(output_path, name_prefix, entry.name)
+        clone_or_copy(entry.path, target)
+        logger.info(f'Restored {entry.key} from cache into {target}')
+        return target
+
+    def store(self, extractor: str, video_id: str, media_format: str, file_path: str, name_prefix: str = '',
+              profile: str = ''):
+        key = get_cache_key(extractor, video_id, media_format, profile)
+        name = os.path.basename(file_path)
+        if name_prefix and name.startswith(name_prefix):
+            name = name[len(name_prefix):]
+        cached_path = os.path.join(self.files_dir, f'{hashlib.sha1(key.encode()).hexdigest()}'
+                                                   f'{os.path.splitext(name)[1]}')
+        clone_or_copy(file_path, cached_path)
+        now = time.time()
+        with self.transaction() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO entries (key, extractor, video_id, media_format, path, name, size, '
+                'created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, extractor.lower(), video_id, media_format, cached_path, name,
+                 os.path.getsize(cached_path), now, now)
+            )
+        logger.info(f'Stored {key} in cache')
+        self.evict()
+
+    def invalidate(self, extractor: Optional[str] = None, video_id: Optional[str] = None,
+                   media_format: Optional[str] = None) -> int:
+        conditions, params = list(), list()
+        for column, value in (('extractor', extractor and extractor.lower()), ('video_id', video_id),
+                              ('media_format', media_format)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        with self.transaction() as db:
+            rows = db.execute(f'SELECT key, path FROM entries{where}', params).fetchall()
+            db.execute(f'DELETE FROM entries{where}', params)
+        for row in rows:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(row['path'])
+        logger.info(f'{len(rows)} cache entries invalidated')
+        return len(rows)
+
+    def total_size(self) -> int:
+        with self.transaction() as db:
+            return db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def evict(self) -> int:
+        evicted = list()
+        with self.transaction() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            for row in db.execute('SELECT key, path, size FROM entries ORDER BY last_used').fetchall():
+                if total <= self.max_size:
+                    break
+                db.execute('DELETE FROM entries WHERE key = ?', (row['key'],))
+                evicted.append(row['path'])
+                total -= row['size']
+        for path in evicted:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        if evicted:
+            logger.info(f'{len(evicted)} cache entries evicted')
+        return len(evicted)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or invalidate the downloaded media cache')
+    parser.add_argument('action', choices=('stats', 'invalidate', 'evict'))
+    parser.add_argument('--extractor')
+    parser.add_argument('--video-id')
+    parser.add_argument('--format', choices=('mp3', 'mp4', 'mp4-h265'))
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE)
+    args = parser.parse_args()
+
+    media_cache = MediaCache(max_size=args.max_size)
+    if args.action == 'invalidate':
+        print(f'{media_cache.invalidate(args.extractor, args.video_id, args.format)} entries invalidated')
+    elif args.action == 'evict':
+        print(f'{media_cache.evict()} entries evicted')
+    print(f'cache size: {media_cache.total_size()} bytes')
@@ -0,0 +1,323 @@
+import contextlib
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing, contextmanager
+from typing import Optional, NamedTuple
+
+from talelle_setup import TALELLE_DIR, to_path
+
+logger = logging.getLogger(__name__)
+
+STORE_DIR = os.path.join(TALELLE_DIR, 'media_store')
+MEDIA_EXTENSIONS = ('.mp3', '.mp4', '.m4a', '.webm', '.mkv', '.opus')
+HASH_BLOCK_SIZE = 1024 * 1024
+FICLONE = 0x40049409
+
+SCHEMA = (
+    '''
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL
+)''',
+    '''
+CREATE TABLE IF NOT EXISTS links (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    linked REAL NOT NULL
+)''',
+    'CREATE INDEX IF NOT EXISTS links_by_digest ON links (digest)',
+)
+
+MIGRATIONS = (
+    ('objects', 'mtime_ns', 'ALTER TABLE objects ADD COLUMN mtime_ns INTEGER'),
+    ('links', 'mtime_ns', 'ALTER TABLE links ADD COLUMN mtime_ns INTEGER'),
+)
+
+
+class StoreReport(NamedTuple):
+    objects: int
+    links: int
+    stored_bytes: int
+    linked_bytes: int
+    saved_bytes: int
+    reclaimable_bytes: int
+    link_mode: str
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@functools.cache
+def get_clonefile():
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return getattr(libc, 'clonefile', None)
+
+
+def clone_file(source: str, target: str) -> bool:
+    if sys.platform == 'darwin':
+        clonefile = get_clonefile()
+        return bool(clonefile) and clonefile(os.fsencode(source), os.fsencode(target), 0) == 0
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(target)
+        return False
+    return True
+
+
+def link_file(source: str, target: str, hardlinks: bool = False) -> Optional[str]:
+    temp_path = f'{target}.store-tmp'
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temp_path)
+    if clone_file(source, temp_path):
+        kind = 'reflink'
+    elif not hardlinks:
+        return None
+    else:
+        try:
+            os.link(source, temp_path)
+            kind = 'hardlink'
+        except OSError:
+            return None
+    os.replace(temp_path, target)
+    return kind
+
+
+def get_output_dir(output_path: str) -> str:
+    return output_path if os.path.isdir(output_path or '.') else os.path.dirname(output_path) or '.'
+
+
+def snapshot(output_path: str) -> dict[str, tuple[int, int]]:
+    directory = get_output_dir(output_path)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return dict()
+    files = dict()
+    for name in names:
+        if not name.lower().endswith(MEDIA_EXTENSIONS):
+            continue
+        path = os.path.abspath(os.path.join(directory, name))
+        with contextlib.suppress(OSError):
+            stat = os.stat(path)
+            files[path] = stat.st_mtime_ns, stat.st_size
+    return files
+
+
+class MediaStore:
+    def __init__(self, store_dir: str = STORE_DIR, hardlinks: bool = False):
+        self.store_dir = store_dir
+        self.hardlinks = hardlinks
+        self.objects_dir = os.path.join(store_dir, 'objects')
+        self.index_path = os.path.join(store_dir, 'index.sqlite')
+        to_path(self.objects_dir).mkdir(parents=True, exist_ok=True)
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+            for table, column, statement in MIGRATIONS:
+                if column not in {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}:
+                    db.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        with closing(sqlite3.connect(self.index_path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    @functools.cached_property
+    def link_mode(self) -> str:
+        probe_path = os.path.join(self.objects_dir, '.link-probe')
+        clone_path = f'{probe_path}-clone'
+        try:
+            with open(probe_path, 'wb') as f:
+                f.write(b'\0')
+            if clone_file(probe_path, clone_path):
+                return 'reflink'
+            return 'hardlink' if self.hardlinks else 'inactive'
+        finally:
+            for path in (probe_path, clone_path):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+
+    def get_object_path(self, digest: str, name: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], f'{digest}{os.path.splitext(name)[1].lower()}')
+
+    @staticmethod
+    def is_intact(obj: sqlite3.Row) -> bool:
+        try:
+            stat = os.stat(obj['path'])
+        except OSError:
+            return False
+        if stat.st_size != obj['size']:
+            return False
+        if obj['mtime_ns'] is None:
+            return hash_file(obj['path']) == obj['digest']
+        return stat.st_mtime_ns == obj['mtime_ns']
+
+    def adopt(self, file_path: str, source: str = '') -> Optional[str]:
+        file_path = os.path.abspath(file_path)
+        if os.stat(file_path).st_dev != os.stat(self.objects_dir).st_dev:
+            logger.info(f'{file_path} is on another file system than the media store, not deduplicating it')
+            return None
+        digest = hash_file(file_path)
+        with self.transaction() as db:
+            row = db.execute('SELECT * FROM objects WHERE digest = ?', (digest,)).fetchone()
+            if row and self.is_intact(row):
+                if os.path.samefile(row['path'], file_path):
+                    kind = 'hardlink'
+                else:
+                    kind = link_file(row['path'], file_path, self.hardlinks)
+            else:
+                if row:
+                    logger.warning(f'Stored object {digest[:12]} no longer matches its digest, replacing it')
+                object_path = self.get_object_path(digest, file_path)
+                to_path(os.path.dirname(object_path)).mkdir(exist_ok=True)
+                if kind := link_file(file_path, object_path, self.hardlinks):
+                    stat = os.stat(object_path)
+                    db.execute(
+                        'INSERT OR REPLACE INTO objects (digest, source, path, size, created, mtime_ns) '
+                        'VALUES (?, ?, ?, ?, ?, ?)',
+                        (digest, source, object_path, stat.st_size, time.time(), stat.st_mtime_ns)
+                    )
+            if kind is None:
+                logger.info(f'{file_path} cannot be linked into the media store')
+                return None
+            db.execute('INSERT OR REPLACE INTO links (path, digest, kind, linked, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+                       (file_path, digest, kind, time.time(), os.stat(file_path).st_mtime_ns))
+        logger.info(f'Stored {file_path} as {digest[:12]} ({kind})')
+        return digest
+
+    def adopt_outputs(self, output_path: str, before: dict[str, tuple[int, int]], source: str = '') -> list[str]:
+        digests = list()
+        for path, state in snapshot(output_path).items():
+            if before.get(path) == state:
+                continue
+            try:
+                if digest := self.adopt(path, source):
+                    digests.append(digest)
+            except OSError:
+                logger.exception(f'storing {path} failed')
+        return digests
+
+    def refcount(self, digest: str) -> int:
+        with self.transaction() as db:
+            return db.execute('SELECT COUNT(*) FROM links WHERE digest = ?', (digest,)).fetchone()[0]
+
+    @staticmethod
+    def is_linked(link: sqlite3.Row, obj: sqlite3.Row) -> bool:
+        try:
+            if link['kind'] == 'hardlink':
+                return os.path.samefile(link['path'], obj['path'])
+            stat = os.stat(link['path'])
+        except OSError:
+            return False
+        if stat.st_size != obj['size']:
+            return False
+        if link['mtime_ns'] is None:
+            return hash_file(link['path']) == obj['digest']
+        return stat.st_mtime_ns == link['mtime_ns']
+
+    def collect_garbage(self, dry_run: bool = False) -> tuple[int, int]:
+        removed = list()
+        with self.transaction() as db:
+            objects = {row['digest']: row for row in db.execute('SELECT * FROM objects').fetchall()}
+            referenced = set()
+            for link in db.execute('SELECT * FROM links').fetchall():
+                obj = objects.get(link['digest'])
+                if obj is not None and self.is_linked(link, obj):
+                    referenced.add(link['digest'])
+                elif not dry_run:
+                    db.execute('DELETE FROM links WHERE path = ?', (link['path'],))
+            for digest, obj in objects.items():
+                if digest in referenced:
+                    continue
+                removed.append((obj['path'], obj['size']))
+                if not dry_run:
+                    db.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+            known = {obj['path'] for obj in objects.values()}
+            for directory, _, names in os.walk(self.objects_dir):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    if path not in known:
+                        with contextlib.suppress(OSError):
+                            removed.append((path, os.path.getsize(path)))
+            if not dry_run:
+                for path, _ in removed:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(path)
+        freed = sum(size for _, size in removed)
+        logger.info(f'Media store garbage collection {"would remove" if dry_run else "removed"} '
+                    f'{len(removed)} objects ({freed} bytes)')
+        return len(removed), freed
+
+    def report(self) -> StoreReport:
+        with self.transaction() as db:
+            rows = db.execute(
+                'SELECT objects.size AS size, COUNT(links.path) AS links FROM objects '
+                'LEFT JOIN links ON links.digest = objects.digest GROUP BY objects.digest'
+            ).fetchall()
+        return StoreReport(
+            objects=len(rows),
+            links=sum(row['links'] for row in rows),
+            stored_bytes=sum(row['size'] for row in rows),
+            linked_bytes=sum(row['size'] * row['links'] for row in rows),
+            saved_bytes=sum(row['size'] * (row['links'] - 1) for row in rows if row['links']),
+            reclaimable_bytes=sum(row['size'] for row in rows if not row['links']),
+            link_mode=self.link_mode,
+        )
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Deduplicate downloaded media into a content-addressed store')
+    parser.add_argument('action', choices=('report', 'gc', 'adopt'))
+    parser.add_argument('paths', nargs='*', help='files or folders to adopt into the store')
+    parser.add_argument('--dry-run', action='store_true', help='only report what gc would remove')
+    parser.add_argument('--hardlinks', action='store_true',
+                        help='hardlink files when the file system cannot reflink them')
+    args = parser.parse_args()
+
+    media_store = MediaStore(hardlinks=args.hardlinks)
+    if args.action == 'adopt':
+        for path in args.paths:
+            adopted = media_store.adopt_outputs(path, dict()) if os.path.isdir(path) else \
+                [digest for digest in (media_store.adopt(path),) if digest]
+            print(f'{path}: {len(adopted)} files stored')
+    elif args.action == 'gc':
+        count, freed = media_store.collect_garbage(args.dry_run)
+        print(f'{count} objects {"to remove" if args.dry_run else "removed"}, {freed} bytes')
+    report = media_store.report()
+    print(f'{report.objects} objects, {report.links} links, {report.stored_bytes} bytes stored, '
+          f'{report.linked_bytes} bytes linked, {report.saved_bytes} bytes saved, '
+          f'{report.reclaimable_bytes} bytes reclaimable')
+    if report.link_mode == 'inactive':
+        print('this file system cannot reflink files, use --hardlinks to deduplicate with hardlinks')
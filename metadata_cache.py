@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Optional
+
+from talelle_setup import TALELLE_DIR
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = os.path.join(TALELLE_DIR, 'metadata_cache.sqlite')
+DEFAULT_TTL = 6 * 60 * 60
+
+SCHEMA = (
+    '''
+CREATE TABLE IF NOT EXISTS scans (
+    url TEXT NOT NULL,
+    max_playlist INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    entries TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (url, max_playlist)
+)''',
+    'CREATE INDEX IF NOT EXISTS scans_by_age ON scans (created)',
+)
+
+
+class MetadataCache:
+    def __init__(self, path: str = METADATA_FILE, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        with self.transaction() as db:
+            for statement in SCHEMA:
+                db.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as db:
+            db.row_factory = sqlite3.Row
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+
+    def lookup(self, url: str, max_playlist: int) -> Optional[tuple[list[list], int]]:
+        with self.transaction() as db:
+            row = db.execute('SELECT * FROM scans WHERE url = ? AND max_playlist = ? AND created > ?',
+                             (url, max_playlist, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row['entries']), row['length']
+
+    def store(self, url: str, max_playlist: int, entries: list, length: int):
+        with self.transaction() as db:
+            db.execute('INSERT OR REPLACE INTO scans (url, max_playlist, length, entries, created) '
+                       'VALUES (?, ?, ?, ?, ?)', (url, max_playlist, length, json.dumps(entries), time.time()))
+
+    def invalidate(self, url: Optional[str] = None) -> int:
+        with self.transaction() as db:
+            if url:
+                return db.execute('DELETE FROM scans WHERE url = ?', (url,)).rowcount
+            return db.execute('DELETE FROM scans').rowcount
+
+    def purge(self) -> int:
+        with self.transaction() as db:
+            purged = db.execute('DELETE FROM scans WHERE created <= ?', (time.time() - self.ttl,)).rowcount
+        if purged:
+            logger.info(f'{purged} expired metadata scans purged')
+        return purged
+
+    def count(self) -> int:
+        with self.transaction() as db:
+            return db.execute('SELECT COUNT(*) FROM scans').fetchone()[0]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or invalidate the playlist metadata cache')
+    parser.add_argument('action', choices=('stats', 'invalidate', 'purge'))
+    parser.add_argument('--url')
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL)
+    args = parser.parse_args()
+
+    metadata_cache = MetadataCache(ttl=args.ttl)
+    if args.action == 'invalidate':
+        print(f'{metadata_cache.invalidate(args.url)} scans invalidated')
+    elif args.action == 'purge':
+        print(f'{metadata_cache.purge()} scans purged')
+    print(f'cached scans: {metadata_cache.count()}')
@@ -0,0 +1,155 @@
+import logging
+import time
+from threading import Thread, Condition
+from typing import Optional, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+GUI_RATE = 20.0
+CALLBACK_RATE = 10.0
+LOG_RATE = 1.0
+
+
+class ProgressEvent(NamedTuple):
+    job_id: str
+    value: int
+    label: Optional[str]
+    count: Optional[str]
+    final: bool
+
+
+def log_progress(event: ProgressEvent):
+    process = event.label.upper() if event.label else 'PROCESS'
+    logger.debug('%s %s -> %s IS DONE for %s%%%s', event.job_id, event.count or '', process, event.value,
+                  ' (final)' if event.final else '')
+
+
+class Subscriber:
+    def __init__(self, callback: Callable, max_rate: Optional[float], pass_event: bool):
+        self.callback = callback
+        self.interval = 1 / max_rate if max_rate else 0
+        self.pass_event = pass_event
+        self.pending = dict()
+        self.urgent = set()
+        self.last_sent = dict()
+        self.seen_labels = dict()
+        self.last_value = dict()
+
+    def deliver(self, event: ProgressEvent):
+        if self.pass_event:
+            self.callback(event)
+        else:
+            self.callback(event.value, event.label, event.count)
+
+    def is_urgent(self, event: ProgressEvent) -> bool:
+        labels = self.seen_labels.setdefault(event.job_id, set())
+        new_phase = event.label not in labels
+        labels.add(event.label)
+        reached_end = event.value >= 100 > self.last_value.get(event.job_id, 0)
+        self.last_value[event.job_id] = event.value
+        return event.final or reached_end or new_phase
+
+    def offer(self, event: ProgressEvent):
+        self.pending[event.job_id] = event
+        if self.is_urgent(event):
+            self.urgent.add(event.job_id)
+
+    def collect(self, now: float) -> tuple[list[ProgressEvent], Optional[float]]:
+        due, wake_at = list(), None
+        for job_id, event in list(self.pending.items()):
+            next_at = self.last_sent.get(job_id, 0) + self.interval
+            if job_id in self.urgent or now >= next_at:
+                due.append(self.pending.pop(job_id))
+                self.urgent.discard(job_id)
+                if event.final:
+                    self.last_sent.pop(job_id, None)
+                    self.seen_labels.pop(job_id, None)
+                    self.last_value.pop(job_id, None)
+                else:
+                    self.last_sent[job_id] = now
+            else:
+                wake_at = next_at if wake_at is None else min(wake_at, next_at)
+        return due, wake_at
+
+
+class ProgressPublisher:
+    def __init__(self, bus: 'ProgressBus', job_id: str):
+        self.bus = bus
+        self.job_id = job_id
+        self.last = (0, None, None)
+
+    def __call__(self, value: int, label: Optional[str] = None, count: Optional[str] = None):
+        self.last = (value, label, count)
+        self.bus.publish(ProgressEvent(self.job_id, value, label, count, False))
+
+    def complete(self):
+        self.bus.publish(ProgressEvent(self.job_id, *self.last, True))
+
+
+class ProgressBus:
+    def __init__(self, log_rate: Optional[float] = LOG_RATE):
+        self.subscribers = list()
+        self.changed = Condition()
+        self.thread = None
+        self.closed = False
+        if log_rate:
+            self.subscribe(log_progress, log_rate, pass_event=True)
+
+    def subscribe(self, callback: Callable, max_rate: Optional[float] = None, pass_event: bool = False) -> Subscriber:
+        subscriber = Subscriber(callback, max_rate, pass_event)
+        with self.changed:
+            self.subscribers.append(subscriber)
+            if subscriber.interval and self.thread is None:
+                self.thread = Thread(target=self.run, name='progress-bus', daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self.changed:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publisher(self, job_id: str) -> ProgressPublisher:
+        return ProgressPublisher(self, job_id)
+
+    def publish(self, event: ProgressEvent):
+        immediate = list()
+        with self.changed:
+            for subscriber in self.subscribers:
+                if subscriber.interval:
+                    subscriber.offer(event)
+                else:
+                    immediate.append(subscriber)
+            self.changed.notify()
+        for subscriber in immediate:
+            subscriber.deliver(event)
+
+    def run(self):
+        while True:
+            with self.changed:
+                now = time.monotonic()
+                deliveries, wake_at = list(), None
+                for subscriber in self.subscribers:
+                    due, subscriber_wake_at = subscriber.collect(now)
+                    deliveries.extend((subscriber, event) for event in due)
+                    if subscriber_wake_at is not None:
+                        wake_at = subscriber_wake_at if wake_at is None else min(wake_at, subscriber_wake_at)
+                if not deliveries:
+                    if self.closed and wake_at is None:
+                        return
+                    self.changed.wait(None if wake_at is None else max(0.0, wake_at - now))
+                    continue
+            for subscriber, event in deliveries:
+                try:
+                    subscriber.deliver(event)
+                except Exception:
+                    logger.exception('progress subscriber failed')
+
+    def close(self):
+        with self.changed:
+            self.closed = True
+            for subscriber in self.subscribers:
+                subscriber.urgent.update(subscriber.pending)
+            self.changed.notify()
+        if self.thread:
+            self.thread.join()
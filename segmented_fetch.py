@@ -0,0 +1,234 @@
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import re
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from threading import Lock
+from typing import Optional, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SIZE = 4 * 1024 ** 2
+READ_SIZE = 256 * 1024
+PART_SUFFIX = '.part'
+SIDECAR_SUFFIX = '.segments.json'
+CONTENT_RANGE_PATTERN = re.compile('bytes\\s+(?P<start>\\d+)-(?P<end>\\d+)/(?P<size>\\d+|\\*)')
+
+
+class RemoteFile(NamedTuple):
+    size: int
+    ranges: bool
+    validator: str
+
+
+def open_url(url: str, headers: Optional[dict], timeout: float, byte_range: Optional[tuple[int, int]] = None):
+    headers = dict(headers or {})
+    if byte_range:
+        headers['Range'] = 'bytes={}-{}'.format(*byte_range)
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+
+
+def probe(url: str, headers: Optional[dict] = None, timeout: float = 30) -> RemoteFile:
+    with open_url(url, headers, timeout, (0, 0)) as response:
+        validator = response.headers.get('ETag') or response.headers.get('Last-Modified') or ''
+        content_range = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range') or '')
+        if response.status == 206 and content_range and content_range.group('size') != '*':
+            return RemoteFile(int(content_range.group('size')), True, validator)
+        return RemoteFile(int(response.headers.get('Content-Length') or 0), False, validator)
+
+
+def get_segments(size: int, segment_size: int) -> list[tuple[int, int]]:
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+class SegmentState:
+    def __init__(self, path: str, remote: RemoteFile, segment_size: int):
+        self.path = path
+        self.size = remote.size
+        self.validator = remote.validator
+        self.segment_size = segment_size
+        self.done = dict()
+        self.lock = Lock()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if (state.get('size'), state.get('validator'), state.get('segmentSize')) != \
+                (self.size, self.validator, self.segment_size):
+            logger.info(f'Discarding stale segment state {self.path}')
+            return False
+        self.done = {int(index): digest for index, digest in state.get('done', {}).items()}
+        return True
+
+    def save(self):
+        state = {'size': self.size, 'validator': self.validator, 'segmentSize': self.segment_size,
+                 'done': self.done}
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def mark(self, index: int, digest: str):
+        with self.lock:
+            self.done[index] = digest
+            self.save()
+
+    def drop(self, indexes: list[int]):
+        with self.lock:
+            for index in indexes:
+                self.done.pop(index, None)
+            self.save()
+
+
+def fetch_segment(url: str, headers: Optional[dict], part_path: str, start: int, end: int,
+                  timeout: float, on_bytes: Callable, checkpoint: Optional[Callable] = None,
+                  throttle: Optional[Callable] = None) -> str:
+    digest = hashlib.sha256()
+    written = 0
+    with open_url(url, headers, timeout, (start, end)) as response, open(part_path, 'r+b') as f:
+        if response.status != 206:
+            raise IOError(f'server ignored range {start}-{end}')
+        f.seek(start)
+        while data := response.read(min(READ_SIZE, end - start + 1 - written)):
+            if checkpoint:
+                checkpoint()
+            f.write(data)
+            digest.update(data)
+            written += len(data)
+            on_bytes(len(data))
+            if throttle:
+                throttle(len(data))
+        f.flush()
+        os.fsync(f.fileno())
+    if written != end - start + 1:
+        raise IOError(f'segment {start}-{end} truncated after {written} bytes')
+    return digest.hexdigest()
+
+
+def hash_segment(part_path: str, start: int, end: int) -> str:
+    digest = hashlib.sha256()
+    with open(part_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining and (data := f.read(min(READ_SIZE, remaining))):
+            digest.update(data)
+            remaining -= len(data)
+    return digest.hexdigest()
+
+
+def verify(part_path: str, state: SegmentState, segments: list[tuple[int, int]]) -> list[int]:
+    if os.path.getsize(part_path) != state.size:
+        return list(range(len(segments)))
+    return [index for index, (start, end) in enumerate(segments)
+            if state.done.get(index) != hash_segment(part_path, start, end)]
+
+
+def fetch_stream(url: str, target_path: str, headers: Optional[dict], timeout: float,
+                 progress_callback: Optional[Callable], size: int, checkpoint: Optional[Callable] = None,
+                 throttle: Optional[Callable] = None) -> str:
+    part_path = f'{target_path}{PART_SUFFIX}'
+    done = 0
+    with open_url(url, headers, timeout) as response, open(part_path, 'wb') as f:
+        while data := response.read(READ_SIZE):
+            if checkpoint:
+                checkpoint()
+            f.write(data)
+            done += len(data)
+            if progress_callback and size:
+                progress_callback(done, size)
+            if throttle:
+                throttle(len(data))
+    if size and done != size:
+        raise IOError(f'{url} truncated after {done} of {size} bytes')
+    os.replace(part_path, target_path)
+    return target_path
+
+
+def fetch(url: str, target_path: str, headers: Optional[dict] = None, workers: int = 4,
+          segment_size: int = SEGMENT_SIZE, progress_callback: Optional[Callable] = None,
+          timeout: float = 30, retries: int = 3, checkpoint: Optional[Callable] = None,
+          throttle: Optional[Callable] = None) -> str:
+    remote = probe(url, headers, timeout)
+    if not remote.ranges or not remote.size:
+        logger.info(f'{url} does not support ranges, fetching as one stream')
+        return fetch_stream(url, target_path, headers, timeout, progress_callback, remote.size, checkpoint,
+                            throttle)
+
+    part_path = f'{target_path}{PART_SUFFIX}'
+    state = SegmentState(f'{target_path}{SIDECAR_SUFFIX}', remote, segment_size)
+    if not (os.path.isfile(part_path) and state.load()):
+        with open(part_path, 'wb') as f:
+            f.truncate(remote.size)
+        state.save()
+
+    segments = get_segments(remote.size, segment_size)
+    missing = [index for index in range(len(segments)) if index not in state.done]
+    lock = Lock()
+    progress = {'done': sum(end - start + 1 for index, (start, end) in enumerate(segments)
+                            if index in state.done)}
+    if state.done:
+        logger.info(f'Resuming {target_path}: {len(segments) - len(missing)} of {len(segments)} segments present')
+
+    def on_bytes(count: int):
+        with lock:
+            progress['done'] += count
+            done = progress['done']
+        if progress_callback:
+            progress_callback(done, remote.size)
+
+    def fetch_index(index: int):
+        start, end = segments[index]
+        for attempt in range(1, retries + 1):
+            fetched = [0]
+
+            def count_bytes(count: int):
+                fetched[0] += count
+                on_bytes(count)
+
+            try:
+                state.mark(index, fetch_segment(url, headers, part_path, start, end, timeout, count_bytes,
+                                                checkpoint, throttle))
+                return
+            except (urllib.error.URLError, OSError) as e:
+                on_bytes(-fetched[0])
+                if attempt == retries:
+                    raise
+                logger.warning(f'segment {index} of {url} failed (attempt {attempt}): {e}')
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='segment') as executor:
+        futures = [executor.submit(fetch_index, index) for index in missing]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if err := future.exception():
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise err
+
+    if corrupt := verify(part_path, state, segments):
+        state.drop(corrupt)
+        raise IOError(f'{len(corrupt)} segments of {target_path} failed verification')
+    os.replace(part_path, target_path)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(state.path)
+    logger.info(f'Fetched {target_path} in {len(segments)} segments ({len(missing)} downloaded)')
+    return target_path
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fetch a URL as concurrent resumable byte ranges')
+    parser.add_argument('url')
+    parser.add_argument('target')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE)
+    args = parser.parse_args()
+
+    fetch(args.url, args.target, workers=args.workers, segment_size=args.segment_size,
+          progress_callback=lambda done, total: print(f'\r{done * 100 // total}%', end='', flush=True))
+    print()
@@ -0,0 +1,391 @@
+import contextlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from threading import Event, Lock, Thread
+from typing import Optional, NamedTuple
+
+from job_control import JobCancelled, JobControl
+from progress_bus import ProgressBus
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+SPOOL_DIRS = (PENDING, LEASED, DONE, FAILED, CANCELLED, 'progress', 'workers', 'cancel', 'reclaim')
+
+LEASE_TTL = 60.0
+HEARTBEAT_INTERVAL = 10.0
+POLL_INTERVAL = 2.0
+PROGRESS_RATE = 1.0
+MAX_ATTEMPTS = 3
+PRIORITY_OFFSET = 1000
+
+
+class SpoolJob(NamedTuple):
+    id: str
+    url: str
+    audio_only: bool
+    output_path: str
+    max_playlist: int
+    abort_on_long_playlist: bool
+    do_postprocess: bool
+    priority: int
+    attempts: int
+    submitted: float
+    sections: str = ''
+    both: bool = False
+
+
+class Lease(NamedTuple):
+    job: SpoolJob
+    path: str
+    token: str
+
+
+def write_json(path: str, data: dict):
+    temp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def get_pending_name(job: SpoolJob) -> str:
+    return f'{PRIORITY_OFFSET - max(1 - PRIORITY_OFFSET, min(PRIORITY_OFFSET - 1, job.priority)):04d}-{job.id}.json'
+
+
+def get_job_id(pending_name: str) -> str:
+    return pending_name[:-len('.json')].split('-', 1)[1]
+
+
+class Spool:
+    def __init__(self, spool_dir: str):
+        self.spool_dir = spool_dir
+        self.dirs = {name: os.path.join(spool_dir, name) for name in SPOOL_DIRS}
+        for path in self.dirs.values():
+            os.makedirs(path, exist_ok=True)
+
+    def names(self, state: str) -> list[str]:
+        return sorted(name for name in os.listdir(self.dirs[state]) if name.endswith('.json'))
+
+    def submit(self, url: str, audio_only: bool, output_path: str, max_playlist: int = -1,
+               abort_on_long_playlist: bool = False, do_postprocess: bool = False, priority: int = 0,
+               sections: str = '', both: bool = False) -> str:
+        job = SpoolJob(f'{time.time_ns():016x}-{uuid.uuid4().hex[:8]}', url, audio_only, output_path,
+                       max_playlist, abort_on_long_playlist, do_postprocess, priority, 0, time.time(), sections,
+                       both)
+        write_json(os.path.join(self.dirs[PENDING], get_pending_name(job)), job._asdict())
+        logger.info(f'Job {job.id} spooled: {url}')
+        return job.id
+
+    def claim(self, token: str) -> Optional[Lease]:
+        for name in self.names(PENDING):
+            job_id = get_job_id(name)
+            path = os.path.join(self.dirs[LEASED], f'{job_id}.{token}.json')
+            try:
+                os.rename(os.path.join(self.dirs[PENDING], name), path)
+            except FileNotFoundError:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(path)
+            if (data := read_json(path)) is None:
+                continue
+            job = SpoolJob(**data)
+            return Lease(job._replace(attempts=job.attempts + 1), path, token)
+        return None
+
+    def heartbeat(self, lease: Lease) -> bool:
+        try:
+            os.utime(lease.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, lease: Lease, state: str, worker_id: str, error: Optional[str] = None) -> bool:
+        path = os.path.join(self.dirs[state], f'{lease.job.id}.json')
+        try:
+            os.rename(lease.path, path)
+        except FileNotFoundError:
+            logger.warning(f'lease on job {lease.job.id} was lost before it finished as {state}')
+            return False
+        write_json(path, {**lease.job._asdict(), 'status': state, 'error': error, 'worker': worker_id,
+                          'finished': time.time()})
+        for path in (os.path.join(self.dirs['cancel'], lease.job.id),
+                     os.path.join(self.dirs['progress'], f'{lease.job.id}.json')):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        logger.info(f'Job {lease.job.id} is {state}')
+        return True
+
+    def release(self, lease: Lease) -> bool:
+        try:
+            os.rename(lease.path, os.path.join(self.dirs[PENDING], get_pending_name(lease.job)))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def reap(self, now: float, ttl: float = LEASE_TTL) -> int:
+        reclaimed = 0
+        for name in self.names(LEASED):
+            path = os.path.join(self.dirs[LEASED], name)
+            try:
+                if now - os.stat(path).st_mtime < ttl:
+                    continue
+            except FileNotFoundError:
+                continue
+            reclaim_path = os.path.join(self.dirs['reclaim'], f'{uuid.uuid4().hex}.json')
+            try:
+                os.rename(path, reclaim_path)
+            except FileNotFoundError:
+                continue
+            if (data := read_json(reclaim_path)) is None:
+                os.remove(reclaim_path)
+                continue
+            job = SpoolJob(**data)
+            job = job._replace(attempts=job.attempts + 1)
+            if job.attempts >= MAX_ATTEMPTS:
+                write_json(reclaim_path, {**job._asdict(), 'status': FAILED, 'error': 'lease_expired',
+                                          'worker': None, 'finished': time.time()})
+                os.rename(reclaim_path, os.path.join(self.dirs[FAILED], f'{job.id}.json'))
+                logger.warning(f'Job {job.id} failed after {job.attempts} expired leases')
+            else:
+                write_json(reclaim_path, job._asdict())
+                os.rename(reclaim_path, os.path.join(self.dirs[PENDING], get_pending_name(job)))
+                logger.warning(f'Lease on job {job.id} expired, returned it to the spool (attempt {job.attempts})')
+            reclaimed += 1
+        return reclaimed
+
+    def touch_worker(self, worker_id: str, info: dict) -> float:
+        path = os.path.join(self.dirs['workers'], f'{worker_id}.json')
+        write_json(path, info)
+        return os.stat(path).st_mtime
+
+    def remove_worker(self, worker_id: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.dirs['workers'], f'{worker_id}.json'))
+
+    def report_progress(self, job_id: str, worker_id: str, value: int, label: Optional[str], count: Optional[str]):
+        write_json(os.path.join(self.dirs['progress'], f'{job_id}.json'),
+                   {'value': value, 'label': label, 'count': count, 'worker': worker_id, 'updated': time.time()})
+
+    def cancel(self, job_id: str) -> bool:
+        for name in self.names(PENDING):
+            if get_job_id(name) == job_id:
+                path = os.path.join(self.dirs[CANCELLED], f'{job_id}.json')
+                try:
+                    os.rename(os.path.join(self.dirs[PENDING], name), path)
+                except FileNotFoundError:
+                    break
+                return True
+        if any(name.startswith(f'{job_id}.') for name in self.names(LEASED)):
+            with open(os.path.join(self.dirs['cancel'], job_id), 'w'):
+                pass
+            return True
+        return False
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return os.path.exists(os.path.join(self.dirs['cancel'], job_id))
+
+    def jobs(self) -> list[dict]:
+        jobs = list()
+        for state in (PENDING, LEASED, DONE, FAILED, CANCELLED):
+            for name in self.names(state):
+                if (data := read_json(os.path.join(self.dirs[state], name))) is None:
+                    continue
+                data['status'] = 'running' if state == LEASED else state
+                if state == LEASED:
+                    data['progress'] = read_json(os.path.join(self.dirs['progress'], f'{data["id"]}.json'))
+                jobs.append(data)
+        return jobs
+
+    def workers(self) -> list[dict]:
+        workers = list()
+        for name in self.names('workers'):
+            path = os.path.join(self.dirs['workers'], name)
+            with contextlib.suppress(FileNotFoundError):
+                seen = os.stat(path).st_mtime
+                if (data := read_json(path)) is not None:
+                    workers.append({**data, 'seen': seen})
+        return workers
+
+
+class SpoolWorker:
+    def __init__(self, spool: Spool, threads: int = 1, poll_interval: float = POLL_INTERVAL,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL, lease_ttl: float = LEASE_TTL, **download_options):
+        self.spool = spool
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.lease_ttl = lease_ttl
+        self.download_options = download_options
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+        self.started = time.time()
+        self.lock = Lock()
+        self.leases = dict()
+        self.finished = 0
+        self.stopping = Event()
+
+    def describe(self) -> dict:
+        with self.lock:
+            running = list(self.leases)
+        return {'id': self.worker_id, 'host': socket.gethostname(), 'pid': os.getpid(), 'threads': self.threads,
+                'running': running, 'finished': self.finished, 'started': self.started}
+
+    def run(self):
+        self.spool.touch_worker(self.worker_id, self.describe())
+        workers = [Thread(target=self.work, name=f'spool-worker-{i}') for i in range(self.threads)]
+        heartbeat = Thread(target=self.heartbeat, name='spool-heartbeat', daemon=True)
+        heartbeat.start()
+        for thread in workers:
+            thread.start()
+        logger.info(f'Spool worker {self.worker_id} started with {self.threads} threads on {self.spool.spool_dir}')
+        try:
+            for thread in workers:
+                while thread.is_alive():
+                    thread.join(1.0)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in workers:
+                thread.join()
+        finally:
+            self.spool.remove_worker(self.worker_id)
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            controls = [control for _, control in self.leases.values()]
+        for control in controls:
+            control.cancel(keep_partial=True)
+
+    def heartbeat(self):
+        while not self.stopping.wait(self.heartbeat_interval):
+            with self.lock:
+                leases = list(self.leases.values())
+            for lease, control in leases:
+                if not self.spool.heartbeat(lease):
+                    logger.warning(f'lost the lease on job {lease.job.id}, stopping it')
+                    control.cancel(keep_partial=True)
+                elif self.spool.cancel_requested(lease.job.id):
+                    control.cancel()
+            try:
+                now = self.spool.touch_worker(self.worker_id, self.describe())
+                self.spool.reap(now, self.lease_ttl)
+            except OSError:
+                logger.exception('spool heartbeat failed')
+
+    def work(self):
+        token = uuid.uuid4().hex[:12]
+        while not self.stopping.is_set():
+            try:
+                lease = self.spool.claim(token)
+            except OSError:
+                logger.exception('claiming from the spool failed')
+                lease = None
+            if lease is None:
+                self.stopping.wait(self.poll_interval)
+                continue
+            self.run_job(lease)
+
+    def run_job(self, lease: Lease):
+        import downloader
+        job = lease.job
+        logger.info(f'Running spooled job {job.id} (attempt {job.attempts}): {job.url}')
+        control = JobControl()
+        with self.lock:
+            self.leases[job.id] = lease, control
+
+        def report(value: int, label: Optional[str] = None, count: Optional[str] = None):
+            with contextlib.suppress(OSError):
+                self.spool.report_progress(job.id, self.worker_id, value, label, count)
+
+        bus = ProgressBus()
+        bus.subscribe(report, PROGRESS_RATE)
+        publisher = bus.publisher(f'spool-{job.id}')
+        try:
+            downloader.download(job.url, job.audio_only, job.output_path,
+                                job.max_playlist, job.abort_on_long_playlist, job.do_postprocess,
+                                publisher, control=control, priority=job.priority, both=job.both,
+                                sections=downloader.parse_sections(job.sections) or None, **self.download_options)
+            publisher.complete()
+            self.spool.complete(lease, DONE, self.worker_id)
+        except JobCancelled:
+            if self.stopping.is_set():
+                self.spool.release(lease)
+            elif self.spool.cancel_requested(job.id):
+                self.spool.complete(lease, CANCELLED, self.worker_id)
+        except ValueError as e:
+            self.spool.complete(lease, FAILED, self.worker_id, ' '.join(str(arg) for arg in e.args))
+        except Exception as e:
+            logger.exception(f'Spooled job {job.id} failed')
+            self.spool.complete(lease, FAILED, self.worker_id, str(e))
+        finally:
+            bus.close()
+            with self.lock:
+                self.leases.pop(job.id, None)
+                self.finished += 1
+
+
+if __name__ == '__main__':
+    import argparse
+    from talelle_setup import config_log
+
+    parser = argparse.ArgumentParser(description='Run downloads from a spool directory shared between hosts')
+    parser.add_argument('spool_dir')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    worker_parser = subparsers.add_parser('worker', help='claim and run spooled jobs')
+    worker_parser.add_argument('--threads', type=int, default=1)
+    worker_parser.add_argument('--playlist-workers', type=int, default=1)
+    worker_parser.add_argument('--engine', default='pool')
+    worker_parser.add_argument('--lease-ttl', type=float, default=LEASE_TTL)
+    worker_parser.add_argument('--heartbeat-interval', type=float, default=HEARTBEAT_INTERVAL)
+    worker_parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL)
+    submit_parser = subparsers.add_parser('submit', help='add a job to the spool')
+    submit_parser.add_argument('url')
+    submit_parser.add_argument('output_path', help='output path as seen from the worker hosts')
+    submit_parser.add_argument('--video', action='store_true')
+    submit_parser.add_argument('--both', action='store_true', help='keep the video and also extract mp3 audio')
+    submit_parser.add_argument('--postprocess', action='store_true')
+    submit_parser.add_argument('--max-playlist', type=int, default=-1)
+    submit_parser.add_argument('--abort-on-long-playlist', action='store_true')
+    submit_parser.add_argument('--priority', type=int, default=0)
+    submit_parser.add_argument('--sections', default='', help='only download these time ranges, e.g. "1:30-2:45"')
+    cancel_parser = subparsers.add_parser('cancel', help='cancel a spooled or running job')
+    cancel_parser.add_argument('job_id')
+    subparsers.add_parser('status', help='list spooled jobs and live workers')
+    args = parser.parse_args()
+
+    spool = Spool(args.spool_dir)
+    if args.action == 'worker':
+        config_log('spool_worker')
+        import signal
+        spool_worker = SpoolWorker(spool, args.threads, args.poll_interval, args.heartbeat_interval, args.lease_ttl,
+                                   workers=args.playlist_workers, engine=args.engine)
+        signal.signal(signal.SIGTERM, lambda signum, frame: spool_worker.stop())
+        spool_worker.run()
+    elif args.action == 'submit':
+        import downloader
+        try:
+            downloader.parse_sections(args.sections)
+        except ValueError:
+            parser.error(f'invalid --sections: {args.sections}')
+        print(spool.submit(args.url, not args.video, args.output_path, args.max_playlist,
+                           args.abort_on_long_playlist, args.postprocess, args.priority, args.sections,
+                           args.both))
+    elif args.action == 'cancel':
+        print('cancelled' if spool.cancel(args.job_id) else 'not found')
+    else:
+        print(json.dumps({'jobs': spool.jobs(), 'workers': spool.workers()}, indent=2))
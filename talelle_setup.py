@@ -1,9 +1,14 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
 
 import os
+import queue
 import shutil
+import time
 from pathlib import Path
+from threading import Thread
 
 def to_path(path: str) -> Path:
     return Path(path)
@@ -11,6 +16,117 @@ def to_path(path: str) -> Path:
 TALELLE_DIR = os.path.join(os.path.expanduser('~'), 'TalelleApps')
 to_path(TALELLE_DIR).mkdir(parents=True, exist_ok=True)
 
+LOG_BATCH_SIZE = 512
+DEBUG_SAMPLE_INTERVAL = 1.0
+DEBUG_SAMPLE_BURST = 5
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, interval: float = DEBUG_SAMPLE_INTERVAL, burst: int = DEBUG_SAMPLE_BURST):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.windows = dict()
+        self.suppressed = dict()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        site = (record.name, record.lineno)
+        now = time.monotonic()
+        started, count = self.windows.get(site, (now, 0))
+        if now - started >= self.interval:
+            started, count = now, 0
+        self.windows[site] = started, count + 1
+        if count >= self.burst:
+            self.suppressed[site] = self.suppressed.get(site, 0) + 1
+            return False
+        if suppressed := self.suppressed.pop(site, 0):
+            record.msg = f'{record.msg} [{suppressed} similar records sampled out]'
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def handle(self, record: logging.LogRecord):
+        if not (result := self.filter(record)):
+            return result
+        self.emit(result if isinstance(result, logging.LogRecord) else record)
+        return result
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogWriter:
+    def __init__(self, records: queue.SimpleQueue, handlers: list[logging.Handler]):
+        self.records = records
+        self.handlers = handlers
+        self.thread = Thread(target=self.run, name='log-writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join()
+        for handler in self.handlers:
+            handler.close()
+
+    @staticmethod
+    def emit(handler: logging.Handler, record: logging.LogRecord):
+        if not isinstance(handler, logging.StreamHandler) or handler.stream is None:
+            handler.emit(record)
+            return
+        try:
+            if isinstance(handler, logging.handlers.BaseRotatingHandler) and handler.shouldRollover(record):
+                handler.doRollover()
+            handler.stream.write(handler.format(record) + handler.terminator)
+        except Exception:
+            handler.handleError(record)
+
+    def write(self, batch: list[logging.LogRecord]):
+        for handler in self.handlers:
+            handler.acquire()
+            try:
+                for record in batch:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        self.emit(handler, record)
+                handler.flush()
+            finally:
+                handler.release()
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            while len(batch) < LOG_BATCH_SIZE:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self.write([record for record in batch if record is not None])
+            if stop:
+                return
+
+
+def start_log_writer(logger: logging.Logger = logging.getLogger()) -> LogWriter:
+    handlers = list(logger.handlers)
+    records = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    queue_handler.setLevel(min((handler.level for handler in handlers), default=logging.NOTSET))
+    queue_handler.addFilter(SamplingFilter())
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    writer = LogWriter(records, handlers)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
 
 def config_log(talelle_tool: str):
     log_conf_name = 'logging.conf'
@@ -22,4 +138,5 @@ def config_log(talelle_tool: str):
     if not os.path.exists(log_conf):
         shutil.copy(local_log_conf, log_conf)
 
-    logging.config.fileConfig(log_conf, defaults={"log_path": log_file})
\ No newline at end of file
+    logging.config.fileConfig(log_conf, defaults={"log_path": log_file})
+    start_log_writer()
@@ -0,0 +1,6 @@
+import os
+import sys
+import tempfile
+
+os.environ['HOME'] = tempfile.mkdtemp(prefix='talelle-tests-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
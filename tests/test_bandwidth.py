@@ -0,0 +1,88 @@
+import pytest
+
+from bandwidth import MIN_RATE, BandwidthScheduler, allocate, parse_rate, priority_class
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 0), ('', 0), (0, 0), (-5, 0), (2048, 2048), ('500', 500), ('1.5K', 1536),
+    ('2M', 2 * 1024 ** 2), ('1 MiB/s', 1024 ** 2), ('3kb', 3 * 1024), ('1G', 1024 ** 3),
+])
+def test_parse_rate(value, expected):
+    assert parse_rate(value) == expected
+
+
+@pytest.mark.parametrize('value', ['fast', '1T', '-1M', '1..2K'])
+def test_parse_rate_rejects(value):
+    with pytest.raises(ValueError, match='invalid_rate'):
+        parse_rate(value)
+
+
+def test_priority_class():
+    assert [priority_class(p) for p in (-3, 0, 2)] == ['background', 'normal', 'interactive']
+    assert priority_class('background') == 'background'
+    with pytest.raises(ValueError, match='unknown_priority'):
+        priority_class('urgent')
+
+
+class FakeShare:
+    def __init__(self, weight, demand=None):
+        self.weight = weight
+        self.wanted = demand
+
+    def demand(self):
+        return self.wanted
+
+
+def test_allocate_unlimited():
+    shares = [FakeShare(1), FakeShare(4)]
+    assert allocate(0, shares) == {share: 0.0 for share in shares}
+
+
+def test_allocate_by_weight():
+    background, normal, interactive = FakeShare(1), FakeShare(4), FakeShare(16)
+    rates = allocate(21 * 1024 ** 2, [background, normal, interactive])
+    assert rates == {background: 1024 ** 2, normal: 4 * 1024 ** 2, interactive: 16 * 1024 ** 2}
+
+
+def test_allocate_redistributes_unused_share():
+    slow, fast = FakeShare(4, demand=1024 ** 2), FakeShare(4)
+    rates = allocate(10 * 1024 ** 2, [slow, fast])
+    assert rates == {slow: 1024 ** 2, fast: 9 * 1024 ** 2}
+
+
+def test_allocate_max_min_cascade():
+    idle, slow, hungry = FakeShare(4, demand=0.0), FakeShare(4, demand=3000.0 * 1024), FakeShare(4)
+    rates = allocate(9000 * 1024, [idle, slow, hungry])
+    assert rates == {idle: MIN_RATE, slow: 3000 * 1024, hungry: 6000 * 1024}
+
+
+def test_allocate_keeps_demand_above_fair_share():
+    a, b = FakeShare(1, demand=8 * 1024 ** 2), FakeShare(1)
+    assert allocate(4 * 1024 ** 2, [a, b]) == {a: 2 * 1024 ** 2, b: 2 * 1024 ** 2}
+
+
+def test_scheduler_splits_between_streams():
+    scheduler = BandwidthScheduler(8 * 1024 ** 2)
+    rates = list()
+    share = scheduler.register('job-1', 'normal')
+    first = share.stream(rates.append)
+    second = share.stream()
+    assert share.stream_rate() == first.rate == 4 * 1024 ** 2
+    assert rates[-1] == 4 * 1024 ** 2
+    second.close()
+    assert first.rate == 8 * 1024 ** 2
+    other = scheduler.register('job-2', 'interactive')
+    assert other.rate == MIN_RATE
+    other.stream()
+    assert (share.rate, other.rate) == (1.6 * 1024 ** 2, 6.4 * 1024 ** 2)
+    scheduler.unregister(other)
+    assert [job['job_id'] for job in scheduler.snapshot()['jobs']] == ['job-1']
+
+
+def test_scheduler_set_limit():
+    scheduler = BandwidthScheduler()
+    share = scheduler.register('job-1')
+    share.stream()
+    assert share.rate == 0
+    scheduler.set_limit('1M')
+    assert (scheduler.limit, share.rate) == (1024 ** 2, 1024 ** 2)
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+
+import pytest
+
+from download_queue import CANCELLED, DONE, FAILED, MAX_ATTEMPTS, PENDING, RUNNING, DownloadQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return DownloadQueue(str(tmp_path / 'queue.sqlite'))
+
+
+def add(queue, url='https://example.com/watch?v=1', priority=0, **kwargs):
+    return queue.add(url, True, '/tmp/out', 10, False, True, priority, **kwargs)
+
+
+def test_claim_by_priority_then_order(queue):
+    first = add(queue)
+    urgent = add(queue, priority=5)
+    second = add(queue)
+    assert [queue.claim().id for _ in range(3)] == [urgent, first, second]
+    assert queue.claim() is None
+
+
+def test_claim_counts_attempts(queue):
+    job_id = add(queue)
+    job = queue.claim()
+    assert (job.id, job.status, job.attempts) == (job_id, RUNNING, 1)
+    assert queue.get(job_id).status == RUNNING
+
+
+def test_recover_returns_running_jobs(queue):
+    job_id = add(queue)
+    queue.claim()
+    assert queue.recover() == 1
+    job = queue.get(job_id)
+    assert (job.status, job.attempts) == (PENDING, 1)
+    assert queue.claim().attempts == 2
+
+
+def test_recover_fails_exhausted_jobs(queue):
+    job_id = add(queue)
+    for _ in range(MAX_ATTEMPTS):
+        queue.recover()
+        queue.claim()
+    assert queue.recover() == 0
+    job = queue.get(job_id)
+    assert (job.status, job.error) == (FAILED, 'too_many_attempts')
+
+
+def test_complete_only_running_jobs(queue):
+    job_id = add(queue)
+    assert not queue.finish(job_id)
+    queue.claim()
+    assert queue.cancel(job_id)
+    assert not queue.fail(job_id, 'late')
+    assert queue.get(job_id).status == CANCELLED
+    assert not queue.cancel(job_id)
+
+
+def test_archive_removed_when_done(queue):
+    job_id = add(queue)
+    queue.claim()
+    archive = queue.get_archive_path(job_id)
+    with open(archive, 'w') as file:
+        file.write('youtube abc\n')
+    assert queue.fail(job_id, 'boom')
+    assert os.path.exists(archive)
+    queue.retry(job_id)
+    queue.claim()
+    assert queue.finish(job_id)
+    assert queue.get(job_id).status == DONE
+    assert not os.path.exists(archive)
+
+
+def test_archive_removed_with_job(queue):
+    job_id = add(queue)
+    archive = queue.get_archive_path(job_id)
+    open(archive, 'w').close()
+    queue.remove(job_id)
+    assert queue.get(job_id) is None
+    assert not os.path.exists(archive)
+
+
+def test_flags_round_trip(queue):
+    job_id = add(queue, sections='*1:00-2:00', both=True)
+    job = queue.get(job_id)
+    assert (job.sections, job.both, job.audio_only) == ('*1:00-2:00', True, True)
+
+
+def test_migrates_old_schema(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    with sqlite3.connect(path) as db:
+        db.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, '
+                   'audio_only INTEGER NOT NULL, output_path TEXT NOT NULL, max_playlist INTEGER NOT NULL, '
+                   'abort_on_long_playlist INTEGER NOT NULL, do_postprocess INTEGER NOT NULL, '
+                   "priority INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT 'pending', "
+                   'attempts INTEGER NOT NULL DEFAULT 0, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)')
+        db.execute("INSERT INTO jobs (url, audio_only, output_path, max_playlist, abort_on_long_playlist, "
+                   "do_postprocess, created, updated) VALUES ('u', 0, '/tmp', 1, 0, 0, 0, 0)")
+    db.close()
+    job = DownloadQueue(path).get(1)
+    assert (job.url, job.sections, job.both) == ('u', '', False)
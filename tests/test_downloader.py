@@ -0,0 +1,55 @@
+import pytest
+
+from downloader import Section, clip_duration, get_section_args, is_playlist_url, parse_sections
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/playlist?list=PL123',
+    'https://www.youtube.com/watch?v=abc&list=PL123',
+    'https://www.youtube.com/@someone',
+    'https://www.youtube.com/@someone/videos',
+    'https://www.youtube.com/channel/UC123',
+    'https://www.youtube.com/c/someone',
+    'https://soundcloud.com/someone/sets/mix',
+])
+def test_playlist_urls(url):
+    assert is_playlist_url(url)
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/watch?v=abc',
+    'https://youtu.be/abc',
+    'https://www.youtube.com/shorts/abc',
+    'https://www.youtube.com/',
+])
+def test_single_video_urls(url):
+    assert not is_playlist_url(url)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('', []),
+    ('1:00-2:30', [Section(60, 150)]),
+    ('-30', [Section(0, 30)]),
+    ('1:00:00-', [Section(3600, None)]),
+    (' 10.5-20 , 1:00-1:30 ', [Section(10.5, 20), Section(60, 90)]),
+])
+def test_parse_sections(text, expected):
+    assert parse_sections(text) == expected
+
+
+@pytest.mark.parametrize('text', ['1:00', '2:00-1:00', '1:00-1:00', 'a-b', '1:00-2:00, x'])
+def test_parse_sections_rejects(text):
+    with pytest.raises(ValueError, match='invalid_sections'):
+        parse_sections(text)
+
+
+def test_clip_duration():
+    sections = [Section(10, 20), Section(50, None), Section(200, 300)]
+    assert clip_duration(sections, 100) == 60
+    assert clip_duration([], 100) == 0
+
+
+def test_section_args():
+    assert get_section_args(None) == []
+    assert get_section_args([Section(0, 30.5), Section(60, None)]) == \
+           ['--download-sections', '*0-30.5', '--download-sections', '*60-inf']
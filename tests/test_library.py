@@ -0,0 +1,111 @@
+import os
+import shutil
+
+import pytest
+
+from library import Library, get_format, is_under
+from media_store import snapshot
+
+
+@pytest.fixture
+def library(tmp_path):
+    return Library(str(tmp_path / 'library.sqlite'))
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'music'
+    (root / 'album').mkdir(parents=True)
+    write(root / 'a.mp3', b'a')
+    write(root / 'album' / 'b.mp4', b'bb')
+    write(root / 'album' / 'cover.jpg', b'jpg')
+    return root
+
+
+def write(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def test_helpers():
+    assert get_format('Song.MP3') == 'mp3'
+    assert is_under('/music/album', '/music')
+    assert not is_under('/musicals', '/music')
+
+
+def test_rescan_indexes_media(library, root):
+    stats = library.rescan(str(root))
+    assert (stats.directories, stats.listed, stats.added, stats.removed) == (2, 2, 2, 0)
+    assert sorted(entry.name for entry in library.page()) == ['a.mp3', 'b.mp4']
+
+
+def test_rescan_lists_only_changed_directories(library, root):
+    library.rescan(str(root))
+    stats = library.rescan(str(root))
+    assert (stats.directories, stats.listed, stats.added, stats.removed) == (2, 0, 0, 0)
+    write(root / 'album' / 'c.mp3', b'c')
+    stats = library.rescan(str(root))
+    assert (stats.listed, stats.added) == (1, 1)
+    assert library.count() == 3
+
+
+def test_rescan_drops_removed_files_and_directories(library, root):
+    (root / 'album' / 'deep').mkdir()
+    write(root / 'album' / 'deep' / 'd.mp3', b'd')
+    library.rescan(str(root))
+    os.remove(root / 'a.mp3')
+    shutil.rmtree(root / 'album')
+    stats = library.rescan(str(root))
+    assert (stats.directories, stats.removed) == (1, 3)
+    assert library.count() == 0
+
+
+def test_rescan_keeps_other_roots(library, root, tmp_path):
+    other = tmp_path / 'other'
+    other.mkdir()
+    write(other / 'x.mp3', b'x')
+    library.rescan(str(root))
+    library.rescan(str(other))
+    assert library.rescan(str(root)).listed == 0
+    assert library.count() == 3
+
+
+def test_record_outputs_maps_playlist_entries(library, tmp_path):
+    output = tmp_path / 'out'
+    output.mkdir()
+    write(output / 'old.mp3', b'old')
+    before = snapshot(str(output))
+    write(output / '01_first.mp3', b'1')
+    write(output / '02_second.mp3', b'2')
+    write(output / '09_unknown.mp3', b'9')
+    entries = [[1, 'Youtube', 'aaa', 'First', 120], [2, 'youtube', 'bbb', 'Second', 0]]
+    library.record_outputs(str(output), before, 'https://example.com/list', entries)
+    indexed = {entry.name: entry for entry in library.find(source_url='https://example.com/list')}
+    assert sorted(indexed) == ['01_first.mp3', '02_second.mp3', '09_unknown.mp3']
+    assert (indexed['01_first.mp3'].video_id, indexed['01_first.mp3'].extractor) == ('aaa', 'youtube')
+    assert indexed['01_first.mp3'].duration == 120
+    assert (indexed['02_second.mp3'].video_id, indexed['02_second.mp3'].duration) == ('bbb', None)
+    assert indexed['09_unknown.mp3'].video_id == ''
+
+
+def test_record_outputs_single_video(library, tmp_path):
+    output = tmp_path / 'out'
+    output.mkdir()
+    write(output / 'song.mp3', b'1')
+    library.record_outputs(str(output), dict(), 'https://example.com/v', [[1, 'youtube', 'vvv', 'Song', 180]])
+    entry, = library.find(video_id='vvv')
+    assert (entry.name, entry.duration, entry.source_url) == ('song.mp3', 180, 'https://example.com/v')
+
+
+def test_page_and_search(library, tmp_path):
+    for index in range(5):
+        path = write(tmp_path / f'{index}.mp3', b'x')
+        os.utime(path, (index, index))
+        library.record(path, video_id=f'id{index}')
+    first = library.page(limit=2)
+    assert [entry.name for entry in first] == ['4.mp3', '3.mp3']
+    after = (first[-1].mtime, first[-1].path)
+    assert [entry.name for entry in library.page(after=after, limit=10)] == ['2.mp3', '1.mp3', '0.mp3']
+    assert [entry.name for entry in library.page('id2')] == ['2.mp3']
+    assert library.count('3.mp') == 1
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+from media_cache import MediaCache, get_cache_key, get_media_format, get_media_profile, get_target_path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(str(tmp_path / 'cache'))
+
+
+def write(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_cache_key():
+    assert get_cache_key('YouTube', 'abc', 'mp3') == 'youtube:abc:mp3'
+    assert get_cache_key('youtube', 'abc', 'mp4-h265', 'f00') == 'youtube:abc:mp4-h265:f00'
+
+
+def test_media_format_and_profile():
+    assert [get_media_format(True, True), get_media_format(False, False), get_media_format(False, True)] == \
+           ['mp3', 'mp4', 'mp4-h265']
+    assert get_media_profile() == get_media_profile([]) == ''
+    profile = get_media_profile(['-c:v', 'libx265', '-crf', '28'])
+    assert len(profile) == 12
+    assert profile == get_media_profile(['-c:v', 'libx265', '-crf', '28'])
+    assert profile != get_media_profile(['-c:v', 'libx265', '-crf', '23'])
+
+
+def test_target_path(tmp_path):
+    assert get_target_path(str(tmp_path), 'pre_', 'song.mp3') == str(tmp_path / 'pre_song.mp3')
+    assert get_target_path(str(tmp_path / 'out.mp3'), 'pre_', 'song.mp3') == str(tmp_path / 'pre_out.mp3')
+
+
+def test_store_and_restore_are_independent_copies(cache, tmp_path):
+    source = write(tmp_path / 'pre_song.mp3', b'audio')
+    cache.store('youtube', 'abc', 'mp3', source, 'pre_')
+    write(source, b'changed')
+    target_dir = tmp_path / 'out'
+    target_dir.mkdir()
+    target = cache.restore('youtube', 'abc', 'mp3', str(target_dir), 'new_')
+    assert target == str(target_dir / 'new_song.mp3')
+    assert read(target) == b'audio'
+    write(target, b'edited')
+    assert read(cache.lookup('youtube', 'abc', 'mp3').path) == b'audio'
+    assert os.stat(target).st_nlink == 1
+
+
+def test_profiles_are_separate_entries(cache, tmp_path):
+    cache.store('youtube', 'abc', 'mp4-h265', write(tmp_path / 'a.mp4', b'crf28'), profile='p28')
+    assert cache.lookup('youtube', 'abc', 'mp4-h265') is None
+    assert cache.lookup('youtube', 'abc', 'mp4-h265', 'p23') is None
+    assert read(cache.lookup('youtube', 'abc', 'mp4-h265', 'p28').path) == b'crf28'
+
+
+def test_lookup_drops_damaged_entries(cache, tmp_path):
+    cache.store('youtube', 'abc', 'mp3', write(tmp_path / 'a.mp3', b'audio'))
+    write(cache.lookup('youtube', 'abc', 'mp3').path, b'truncated!')
+    assert cache.lookup('youtube', 'abc', 'mp3') is None
+    cache.store('youtube', 'def', 'mp3', write(tmp_path / 'b.mp3', b'audio'))
+    os.link(cache.lookup('youtube', 'def', 'mp3').path, tmp_path / 'linked.mp3')
+    assert cache.lookup('youtube', 'def', 'mp3') is None
+    assert cache.total_size() == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'), max_size=10)
+    cache.store('youtube', 'a', 'mp3', write(tmp_path / 'a.mp3', b'1234'))
+    cache.store('youtube', 'b', 'mp3', write(tmp_path / 'b.mp3', b'1234'))
+    with cache.transaction() as db:
+        db.execute("UPDATE entries SET last_used = 0 WHERE video_id = 'a'")
+    cache.store('youtube', 'c', 'mp3', write(tmp_path / 'c.mp3', b'1234'))
+    assert cache.lookup('youtube', 'a', 'mp3') is None
+    assert cache.lookup('youtube', 'b', 'mp3') is not None
+    assert cache.total_size() == 8
+
+
+def test_invalidate_by_field(cache, tmp_path):
+    for video_id, media_format in (('a', 'mp3'), ('a', 'mp4'), ('b', 'mp3')):
+        cache.store('youtube', video_id, media_format, write(tmp_path / f'{video_id}.{media_format}', b'x'))
+    assert cache.invalidate(video_id='a') == 2
+    assert cache.invalidate(extractor='YouTube', media_format='mp3') == 1
+    assert not os.listdir(cache.files_dir)
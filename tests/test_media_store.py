@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import media_store
+from media_store import MediaStore, snapshot
+
+
+@pytest.fixture(autouse=True)
+def no_reflinks(monkeypatch):
+    monkeypatch.setattr(media_store, 'clone_file', lambda source, target: False)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MediaStore(str(tmp_path / 'store'), hardlinks=True)
+
+
+def write(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+def test_link_mode(tmp_path, store):
+    assert store.link_mode == 'hardlink'
+    assert MediaStore(str(tmp_path / 'other')).link_mode == 'inactive'
+    assert not os.listdir(store.objects_dir)
+
+
+def test_without_links_nothing_is_adopted(tmp_path):
+    store = MediaStore(str(tmp_path / 'store'))
+    assert store.adopt(write(tmp_path / 'a.mp3', b'audio')) is None
+    assert store.report().objects == 0
+
+
+def test_adopt_deduplicates_identical_files(tmp_path, store):
+    first = write(tmp_path / 'a.mp3', b'audio')
+    second = write(tmp_path / 'b.mp3', b'audio')
+    digest = store.adopt(first)
+    assert store.adopt(second) == digest
+    assert store.adopt(first) == digest
+    assert os.path.samefile(first, second)
+    assert store.refcount(digest) == 2
+    report = store.report()
+    assert (report.objects, report.links, report.stored_bytes, report.saved_bytes) == (1, 2, 5, 5)
+
+
+def test_adopt_replaces_damaged_object(tmp_path, store):
+    digest = store.adopt(write(tmp_path / 'a.mp3', b'audio'))
+    with store.transaction() as db:
+        object_path = db.execute('SELECT path FROM objects WHERE digest = ?', (digest,)).fetchone()[0]
+    os.remove(tmp_path / 'a.mp3')
+    write(object_path, b'corrupted')
+    second = write(tmp_path / 'b.mp3', b'audio')
+    assert store.adopt(second) == digest
+    with open(second, 'rb') as file:
+        assert file.read() == b'audio'
+    assert os.path.samefile(second, object_path)
+
+
+def test_adopt_outputs_skips_unchanged_files(tmp_path, store):
+    output = tmp_path / 'out'
+    output.mkdir()
+    write(output / 'old.mp3', b'old')
+    write(output / 'notes.txt', b'text')
+    before = snapshot(str(output))
+    write(output / 'new.mp3', b'new')
+    assert len(store.adopt_outputs(str(output), before)) == 1
+    assert store.report().links == 1
+
+
+def test_gc_keeps_linked_objects(tmp_path, store):
+    kept = write(tmp_path / 'a.mp3', b'kept')
+    store.adopt(kept)
+    removed = write(tmp_path / 'b.mp3', b'removed')
+    store.adopt(removed)
+    os.remove(removed)
+    assert store.collect_garbage(dry_run=True) == (1, 7)
+    assert store.report().objects == 2
+    assert store.collect_garbage() == (1, 7)
+    report = store.report()
+    assert (report.objects, report.links) == (1, 1)
+    assert store.collect_garbage() == (0, 0)
+
+
+def test_gc_drops_replaced_outputs_and_stray_files(tmp_path, store):
+    output = write(tmp_path / 'a.mp3', b'audio')
+    digest = store.adopt(output)
+    os.remove(output)
+    write(output, b'audio')
+    stray = write(os.path.join(store.objects_dir, 'stray.tmp'), b'xx')
+    assert store.collect_garbage() == (2, 7)
+    assert store.refcount(digest) == 0
+    assert not os.path.exists(stray)
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+from metadata_cache import MetadataCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr('metadata_cache.time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return MetadataCache(str(tmp_path / 'metadata.sqlite'), ttl=60)
+
+
+ENTRIES = [[1, 'youtube', 'abc', 'First', 120], [2, 'youtube', 'def', 'Second', 90]]
+
+
+def test_lookup_round_trip(cache):
+    assert cache.lookup('https://example.com/list', 10) is None
+    cache.store('https://example.com/list', 10, ENTRIES, 25)
+    assert cache.lookup('https://example.com/list', 10) == (ENTRIES, 25)
+
+
+def test_keyed_by_url_and_max_playlist(cache):
+    cache.store('https://example.com/list', 10, ENTRIES, 25)
+    assert cache.lookup('https://example.com/list', 20) is None
+    assert cache.lookup('https://example.com/other', 10) is None
+    cache.store('https://example.com/list', 10, ENTRIES[:1], 26)
+    assert cache.lookup('https://example.com/list', 10) == (ENTRIES[:1], 26)
+    assert cache.count() == 1
+
+
+def test_expires_after_ttl(cache, clock):
+    cache.store('https://example.com/list', 10, ENTRIES, 25)
+    clock.now += 59
+    assert cache.lookup('https://example.com/list', 10) is not None
+    clock.now += 1
+    assert cache.lookup('https://example.com/list', 10) is None
+    assert cache.count() == 1
+    assert cache.purge() == 1
+    assert cache.count() == 0
+
+
+def test_purge_keeps_fresh_scans(cache, clock):
+    cache.store('https://example.com/old', 10, ENTRIES, 25)
+    clock.now += 30
+    cache.store('https://example.com/new', 10, ENTRIES, 25)
+    clock.now += 40
+    assert cache.purge() == 1
+    assert cache.lookup('https://example.com/new', 10) is not None
+
+
+def test_invalidate(cache):
+    cache.store('https://example.com/a', 10, ENTRIES, 25)
+    cache.store('https://example.com/a', 20, ENTRIES, 25)
+    cache.store('https://example.com/b', 10, ENTRIES, 25)
+    assert cache.invalidate('https://example.com/a') == 2
+    assert cache.invalidate() == 1
+    assert cache.count() == 0
@@ -0,0 +1,68 @@
+from progress_bus import ProgressBus, ProgressEvent, Subscriber
+
+
+def event(value, label='download', job_id='job', final=False):
+    return ProgressEvent(job_id, value, label, None, final)
+
+
+def test_subscriber_coalesces_within_interval():
+    subscriber = Subscriber(print, 10.0, True)
+    subscriber.offer(event(1))
+    due, wake_at = subscriber.collect(100.0)
+    assert due == [event(1)] and wake_at is None
+    for value in (2, 3, 4):
+        subscriber.offer(event(value))
+    due, wake_at = subscriber.collect(100.05)
+    assert due == [] and wake_at == 100.1
+    due, _ = subscriber.collect(100.1)
+    assert due == [event(4)]
+
+
+def test_subscriber_sends_phase_changes_and_completion_immediately():
+    subscriber = Subscriber(print, 1.0, True)
+    subscriber.offer(event(10))
+    subscriber.collect(0.0)
+    subscriber.offer(event(0, 'postprocess'))
+    assert subscriber.collect(0.1)[0] == [event(0, 'postprocess')]
+    subscriber.offer(event(100, 'postprocess'))
+    assert subscriber.collect(0.2)[0] == [event(100, 'postprocess')]
+
+
+def test_subscriber_final_releases_job_state():
+    subscriber = Subscriber(print, 1.0, True)
+    subscriber.offer(event(50))
+    subscriber.collect(0.0)
+    subscriber.offer(event(60, final=True))
+    assert subscriber.collect(0.1)[0] == [event(60, final=True)]
+    assert not (subscriber.last_sent or subscriber.seen_labels or subscriber.last_value or subscriber.pending)
+
+
+def test_subscriber_keeps_jobs_apart():
+    subscriber = Subscriber(print, 1.0, True)
+    subscriber.offer(event(5, job_id='a'))
+    subscriber.offer(event(7, job_id='b'))
+    assert subscriber.collect(0.0)[0] == [event(5, job_id='a'), event(7, job_id='b')]
+
+
+def test_bus_unlimited_subscriber_gets_everything():
+    bus = ProgressBus(log_rate=None)
+    received = list()
+    bus.subscribe(lambda *args: received.append(args))
+    publisher = bus.publisher('job')
+    for value in range(5):
+        publisher(value, 'download', '1/1')
+    assert received == [(value, 'download', '1/1') for value in range(5)]
+    assert bus.thread is None
+
+
+def test_bus_rate_limited_delivers_last_and_final():
+    bus = ProgressBus(log_rate=None)
+    received = list()
+    bus.subscribe(received.append, 2.0, pass_event=True)
+    publisher = bus.publisher('job')
+    for value in range(50):
+        publisher(value, 'download')
+    publisher.complete()
+    bus.close()
+    assert len(received) < 10
+    assert received[-1] == ProgressEvent('job', 49, 'download', None, True)
@@ -0,0 +1,145 @@
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow')
+DEFAULT_PROFILE = {
+    'preset': 'medium',
+    'crf': 28,
+    'threads': 0,
+    'auto': False,
+    'targetSpeed': 1.0,
+    'targetPsnr': 38.0,
+}
+PSNR_PATTERN = re.compile('average:(?P<psnr>\\d+(\\.\\d+)?|inf)')
+
+
+def get_profile(profile: Optional[dict]) -> dict:
+    return {**DEFAULT_PROFILE, **(profile or {})}
+
+
+def get_thread_budget(concurrent_jobs: int = 1) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, concurrent_jobs))
+
+
+def get_video_args(profile: Optional[dict] = None, concurrent_jobs: int = 1) -> list[str]:
+    profile = get_profile(profile)
+    threads = int(profile['threads']) or get_thread_budget(concurrent_jobs)
+    return [
+        '-c:a', 'aac',
+        '-c:v', 'libx265',
+        '-preset', profile['preset'],
+        '-crf', str(profile['crf']),
+        '-threads', str(threads),
+        '-x265-params', f'pools={threads}:log-level=error',
+        '-tag:v', 'hvc1',
+    ]
+
+
+def run_quiet(cmd: list[str]) -> subprocess.CompletedProcess:
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
+    return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, **kwargs)
+
+
+def make_sample(path: str, seconds: float):
+    run_quiet([
+        'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+        '-t', str(seconds), '-c:v', 'ffv1', '-c:a', 'pcm_s16le', path,
+    ])
+
+
+def measure_psnr(encoded_path: str, reference_path: str) -> float:
+    result = run_quiet([
+        'ffmpeg', '-nostdin', '-i', encoded_path, '-i', reference_path,
+        '-lavfi', 'psnr', '-f', 'null', '-',
+    ])
+    if match := PSNR_PATTERN.search(result.stderr.decode(errors='replace')):
+        return 100.0 if match.group('psnr') == 'inf' else float(match.group('psnr'))
+    return 0.0
+
+
+def benchmark_preset(sample_path: str, seconds: float, preset: str, crf: int, threads: int) -> dict:
+    encoded_path = f'{os.path.splitext(sample_path)[0]}_{preset}.mp4'
+    args = get_video_args({'preset': preset, 'crf': crf, 'threads': threads})
+    started = time.perf_counter()
+    run_quiet(['ffmpeg', '-y', '-nostdin', '-loglevel', 'error', '-i', sample_path, *args, encoded_path])
+    elapsed = time.perf_counter() - started
+    result = {
+        'preset': preset,
+        'crf': crf,
+        'threads': threads,
+        'speed': round(seconds / elapsed, 3),
+        'size': os.path.getsize(encoded_path),
+        'psnr': round(measure_psnr(encoded_path, sample_path), 2),
+    }
+    logger.info(f'Calibration {preset}: {result["speed"]}x realtime, psnr {result["psnr"]}, {result["size"]} bytes')
+    return result
+
+
+def choose_profile(results: list[dict], profile: Optional[dict] = None) -> dict:
+    profile = get_profile(profile)
+    good_enough = [result for result in results if result['psnr'] >= profile['targetPsnr']]
+    fast_enough = [result for result in good_enough if result['speed'] >= profile['targetSpeed']]
+    if fast_enough:
+        chosen = max(fast_enough, key=lambda result: result['speed'])
+    elif good_enough:
+        chosen = max(good_enough, key=lambda result: result['speed'])
+    else:
+        chosen = max(results, key=lambda result: result['psnr'])
+    return {**profile, 'preset': chosen['preset'], 'crf': chosen['crf']}
+
+
+def calibrate(profile: Optional[dict] = None, seconds: float = 3.0, concurrent_jobs: int = 1,
+              presets: tuple[str, ...] = PRESETS) -> tuple[dict, list[dict]]:
+    profile = get_profile(profile)
+    threads = int(profile['threads']) or get_thread_budget(concurrent_jobs)
+    with tempfile.TemporaryDirectory(prefix='talelle_calibration_') as work_dir:
+        sample_path = os.path.join(work_dir, 'sample.mkv')
+        make_sample(sample_path, seconds)
+        results = [benchmark_preset(sample_path, seconds, preset, int(profile['crf']), threads)
+                   for preset in presets]
+    chosen = choose_profile(results, profile)
+    logger.info(f'Calibration chose preset {chosen["preset"]} (crf {chosen["crf"]})')
+    return chosen, results
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from talelle_setup import TALELLE_DIR
+
+    parser = argparse.ArgumentParser(description='Calibrate the libx265 postprocess profile')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--crf', type=int, default=DEFAULT_PROFILE['crf'])
+    parser.add_argument('--target-speed', type=float, default=DEFAULT_PROFILE['targetSpeed'])
+    parser.add_argument('--target-psnr', type=float, default=DEFAULT_PROFILE['targetPsnr'])
+    parser.add_argument('--jobs', type=int, default=1, help='concurrent encodes to budget threads for')
+    parser.add_argument('--settings', default=os.path.join(TALELLE_DIR, 'SongDownloader.json'))
+    args = parser.parse_args()
+
+    try:
+        with open(args.settings, 'r') as f:
+            settings = json.load(f)
+    except FileNotFoundError:
+        settings = dict()
+    chosen, results = calibrate({**settings.get('transcodeProfile', {}), 'crf': args.crf, 'auto': True,
+                                 'targetSpeed': args.target_speed, 'targetPsnr': args.target_psnr},
+                                args.seconds, args.jobs)
+    settings['transcodeProfile'] = chosen
+    settings['transcodeBenchmark'] = results
+    with open(args.settings, 'w') as f:
+        json.dump(settings, f)
+    for result in results:
+        print(f'{result["preset"]:>10}: {result["speed"]:6.2f}x  psnr {result["psnr"]:6.2f}  {result["size"]} bytes')
+    print(f'chosen preset: {chosen["preset"]}')
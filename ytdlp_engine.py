@@ -0,0 +1,184 @@
+import logging
+import math
+from typing import Optional, Callable
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled, download_range_func
+
+import bandwidth
+from downloader import (H265_ARGS, Section, clip_duration, get_progress_listener, get_output_template,
+                        update_progress, update_progress_percent)
+from job_control import JobCancelled, JobControl
+from job_metrics import JobMetrics
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_POSTPROCESSORS = ('FFmpegExtractAudio', 'FFmpegCopyStream')
+
+
+class YoutubeDLHooks:
+    def __init__(self, listener, max_playlist: int, abort_on_long_playlist: bool, progress_callback: Callable,
+                 control: Optional[JobControl] = None, stream: Optional[bandwidth.ShareStream] = None,
+                 sections: Optional[list[Section]] = None):
+        self.listener = listener
+        self.control = control
+        self.stream = stream
+        self.max_playlist = max_playlist
+        self.abort_on_long_playlist = abort_on_long_playlist
+        self.progress_callback = progress_callback
+        self.sections = sections
+        self.error = None
+        self.saved_files = list()
+        self.tracked = set()
+
+    def match_filter(self, info_dict: dict, incomplete: bool = False) -> Optional[str]:
+        if incomplete:
+            return None
+        length = info_dict.get('playlist_count') or 1
+        logger.info(f'Download info: duration:{info_dict.get("duration")}, '
+                    f'current:{info_dict.get("playlist_autonumber") or 1}, '
+                    f'total:{info_dict.get("n_entries") or 1}, length:{length}')
+        if self.abort_on_long_playlist and length > self.max_playlist:
+            self.error = 'playlist_too_long', str(self.max_playlist), str(length)
+            raise DownloadCancelled('playlist too long')
+        if info_dict.get('duration'):
+            duration = float(info_dict['duration'])
+            self.listener.set_info(
+                clip_duration(self.sections, duration) if self.sections else duration,
+                int(info_dict.get('playlist_autonumber') or 1),
+                int(info_dict.get('n_entries') or 1),
+                int(length),
+            )
+        self.listener.enter_item(int(info_dict.get('playlist_autonumber') or 1), 'transfer')
+        return None
+
+    def checkpoint(self):
+        if self.control is None:
+            return
+        try:
+            self.control.checkpoint()
+        except JobCancelled:
+            raise DownloadCancelled('job cancelled')
+
+    def track(self, file_path: Optional[str]):
+        if self.control is None or not file_path or file_path in self.tracked:
+            return
+        self.tracked.add(file_path)
+        self.control.track(file_path)
+
+    def saved_file(self, file_path: str):
+        self.saved_files.append(file_path)
+        self.listener.finish_item()
+
+    def progress_hook(self, data: dict):
+        self.checkpoint()
+        self.track(data.get('filename'))
+        total = data.get('total_bytes') or data.get('total_bytes_estimate')
+        if data['status'] == 'downloading' and total:
+            logger.debug('speed: %s B/s, eta: %s s', data.get('speed'), data.get('eta'))
+            if self.listener.item_metrics is not None:
+                self.listener.item_metrics.add_transfer(data.get('downloaded_bytes') or 0, data.get('speed'))
+            if self.stream is not None:
+                self.stream.update_total(data.get('downloaded_bytes') or 0)
+            update_progress(data.get('downloaded_bytes') or 0, total, self.progress_callback, label='download',
+                            part_n=self.listener.part_n, part_i=0, count=self.listener.get_count_str())
+        elif data['status'] == 'finished':
+            update_progress_percent(100, self.progress_callback, label='download',
+                                    part_n=self.listener.part_n, part_i=0, count=self.listener.get_count_str())
+
+    def postprocessor_hook(self, data: dict):
+        self.checkpoint()
+        if data.get('postprocessor') not in FFMPEG_POSTPROCESSORS:
+            return
+        if data['status'] == 'started':
+            info_dict = data.get('info_dict') or dict()
+            if info_dict.get('section_end') is not None:
+                self.listener.final_duration = info_dict['section_end'] - (info_dict.get('section_start') or 0)
+            if self.listener.item_metrics is not None:
+                self.listener.item_metrics.enter('postprocess')
+            update_progress_percent(0, self.progress_callback, label='postprocess',
+                                    part_n=2, part_i=1, count=self.listener.get_count_str())
+        elif data['status'] == 'finished':
+            update_progress_percent(100, self.progress_callback, label='postprocess',
+                                    part_n=2, part_i=1, count=self.listener.get_count_str())
+
+
+def prepare_options(audio_only: bool, output_path: str, max_playlist: int, do_postprocess: bool,
+                    progress_path: str, hooks: YoutubeDLHooks, playlist_items: Optional[str] = None,
+                    name_prefix: Optional[str] = None, source_only: bool = False,
+                    video_args: Optional[list[str]] = None, sections: Optional[list[Section]] = None,
+                    archive: Optional[str] = None, resume: bool = False) -> dict:
+    options = {
+        'quiet': True,
+        'noprogress': True,
+        'overwrites': None if resume else True,
+        'download_archive': archive,
+        'playlist_items': playlist_items or f'1:{max_playlist}',
+        'outtmpl': get_output_template(output_path, name_prefix, sections),
+        'match_filter': hooks.match_filter,
+        'progress_hooks': [hooks.progress_hook],
+        'postprocessor_hooks': [hooks.postprocessor_hook],
+        'post_hooks': [hooks.saved_file],
+        'postprocessors': [],
+        'postprocessor_args': {},
+    }
+
+    if sections:
+        options['download_ranges'] = download_range_func(
+            None, [(section.start, math.inf if section.end is None else section.end) for section in sections])
+
+    if audio_only:
+        options['format'] = 'bestaudio/best'
+        if not source_only:
+            options['postprocessors'].append({
+                'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3',
+            })
+    else:
+        options['format'] = 'mp4'
+        options['format_sort'] = ['codec:h265']
+        if do_postprocess and not source_only:
+            options['postprocessors'].append({
+                'key': 'FFmpegCopyStream',
+            })
+            options['postprocessor_args']['copystream'] = list(video_args or H265_ARGS)
+
+    if (audio_only or do_postprocess) and not source_only:
+        options['postprocessor_args']['ffmpeg'] = ['-progress', progress_path]
+
+    return options
+
+
+def run_download(youtube_url: str, audio_only: bool, output_path: str,
+                 max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                 progress_callback: Callable, playlist_items: Optional[str] = None,
+                 name_prefix: Optional[str] = None, source_only: bool = False,
+                 video_args: Optional[list[str]] = None, metrics: Optional[JobMetrics] = None,
+                 item_key: Optional[int] = None, control: Optional[JobControl] = None,
+                 share: Optional[bandwidth.JobShare] = None, sections: Optional[list[Section]] = None) -> list[str]:
+    use_ffmpeg = (audio_only or do_postprocess) and not source_only
+
+    with get_progress_listener(use_ffmpeg, progress_callback, metrics, item_key) as listener, \
+            bandwidth.open_stream(share) as stream:
+        hooks = YoutubeDLHooks(listener, max_playlist, abort_on_long_playlist, progress_callback, control, stream,
+                               sections)
+        options = prepare_options(audio_only, output_path, max_playlist, do_postprocess,
+                                  progress_path='http://{}'.format(listener.listen_on), hooks=hooks,
+                                  playlist_items=playlist_items, name_prefix=name_prefix,
+                                  source_only=source_only, video_args=video_args, sections=sections,
+                                  archive=control and control.archive, resume=bool(control and control.resume))
+        if stream and stream.rate:
+            options['ratelimit'] = stream.rate
+        listener.enter_item(1, 'metadata')
+        try:
+            with YoutubeDL(options) as ydl:
+                if stream:
+                    stream.on_rate = lambda rate: ydl.params.update(ratelimit=rate or None)
+                ydl.download([youtube_url])
+        except DownloadCancelled:
+            if control and control.cancelled:
+                raise JobCancelled()
+            if not hooks.error:
+                raise
+            logger.error('error occurred when downloading: %s', hooks.error)
+            raise ValueError(*hooks.error)
+    return hooks.saved_files
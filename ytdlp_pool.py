@@ -0,0 +1,372 @@
+import atexit
+import functools
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+from threading import Condition, Thread
+from typing import Optional, Callable
+
+import bandwidth
+from job_control import JobControl, get_process_group_kwargs, kill_tree
+from job_metrics import JobMetrics
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = max(4, os.cpu_count() or 4)
+MAX_JOBS = 50
+MAX_RSS_GROWTH = 256 * 1024 ** 2
+STOP_TIMEOUT = 2.0
+WORKER_FLAG = '--ytdlp-pool-worker'
+ENGINES = ('cli', 'embedded', 'pool')
+
+
+def available() -> bool:
+    return importlib.util.find_spec('yt_dlp') is not None
+
+
+def get_worker_command() -> list[str]:
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, WORKER_FLAG]
+    return [sys.executable, os.path.abspath(__file__)]
+
+
+def get_rss() -> int:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class WorkerProcess:
+    def __init__(self):
+        kwargs = get_process_group_kwargs()
+        if os.name == 'nt':
+            kwargs['creationflags'] |= subprocess.CREATE_NO_WINDOW
+        self.process = subprocess.Popen(get_worker_command(),
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, **kwargs)
+        self.jobs = 0
+        self.base_rss = 0
+        self.rss = 0
+        logger.debug(f'yt-dlp worker {self.process.pid} started')
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def send(self, request: dict):
+        self.process.stdin.write((json.dumps(request) + '\n').encode())
+        self.process.stdin.flush()
+
+    def events(self):
+        for line in self.process.stdout:
+            event = json.loads(line)
+            self.rss = event.get('rss', self.rss)
+            if event['event'] == 'ready':
+                self.base_rss = self.rss
+                continue
+            yield event
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(STOP_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            kill_tree(self.process, STOP_TIMEOUT)
+
+
+class WorkerPool:
+    def __init__(self, size: int = POOL_SIZE, max_jobs: int = MAX_JOBS, max_rss_growth: int = MAX_RSS_GROWTH):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_growth = max_rss_growth
+        self.changed = Condition()
+        self.idle = list()
+        self.count = 0
+        self.closed = False
+
+    def prewarm(self, count: int = 1):
+        def start_workers():
+            for _ in range(count):
+                with self.changed:
+                    if self.closed or self.count >= self.size:
+                        return
+                    self.count += 1
+                try:
+                    worker = WorkerProcess()
+                except OSError:
+                    logger.exception('could not start a yt-dlp worker')
+                    with self.changed:
+                        self.count -= 1
+                    return
+                with self.changed:
+                    self.idle.append(worker)
+                    self.changed.notify()
+
+        Thread(target=start_workers, name='ytdlp-prewarm', daemon=True).start()
+
+    def acquire(self) -> WorkerProcess:
+        with self.changed:
+            while True:
+                while self.idle:
+                    worker = self.idle.pop()
+                    if worker.alive:
+                        return worker
+                    self.count -= 1
+                if self.count < self.size:
+                    self.count += 1
+                    break
+                self.changed.wait()
+        try:
+            return WorkerProcess()
+        except BaseException:
+            with self.changed:
+                self.count -= 1
+                self.changed.notify()
+            raise
+
+    def release(self, worker: WorkerProcess, healthy: bool):
+        worker.jobs += 1
+        grown = worker.base_rss and worker.rss - worker.base_rss > self.max_rss_growth
+        recycle = not healthy or not worker.alive or worker.jobs >= self.max_jobs or grown or self.closed
+        with self.changed:
+            if recycle:
+                self.count -= 1
+            else:
+                self.idle.append(worker)
+            self.changed.notify()
+        if recycle:
+            logger.info(f'Recycling yt-dlp worker {worker.process.pid} after {worker.jobs} jobs '
+                        f'(rss {worker.rss} bytes, healthy {healthy})')
+            worker.stop()
+
+    def shutdown(self):
+        with self.changed:
+            self.closed = True
+            workers, self.idle = self.idle, list()
+            self.count -= len(workers)
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+
+
+def get_pool() -> WorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+        atexit.register(_pool.shutdown)
+    return _pool
+
+
+def configure(size: int = POOL_SIZE, max_jobs: int = MAX_JOBS, max_rss_growth: int = MAX_RSS_GROWTH,
+              prewarm: int = 0):
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = WorkerPool(size, max_jobs, max_rss_growth)
+    atexit.register(_pool.shutdown)
+    if prewarm:
+        _pool.prewarm(prewarm)
+
+
+@functools.lru_cache(maxsize=None)
+def warn_unavailable():
+    logger.warning('yt_dlp module is not importable, using the yt-dlp executable instead of the worker pool')
+
+
+def run_job(request: dict, on_event: Callable, control: Optional[JobControl] = None) -> dict:
+    pool = get_pool()
+    worker = pool.acquire()
+    healthy = False
+    try:
+        if control:
+            control.register(worker.process)
+        worker.send(request)
+        for event in worker.events():
+            if event['event'] in ('done', 'error', 'failed'):
+                healthy = True
+                return event
+            on_event(event, worker)
+        if control:
+            control.check()
+        raise RuntimeError(f'yt-dlp worker {worker.process.pid} exited with {worker.process.wait()}')
+    finally:
+        if control:
+            control.unregister(worker.process)
+        pool.release(worker, healthy)
+
+
+def scan(youtube_url: str, max_playlist: int, control: Optional[JobControl] = None) -> tuple[list[list], int]:
+    result = run_job({'op': 'scan', 'url': youtube_url, 'max_playlist': max_playlist},
+                     lambda event, worker: None, control)
+    if result['event'] != 'done':
+        logger.warning('playlist scan failed: %s', result.get('message') or result.get('args'))
+        return list(), 0
+    return result['entries'], result['length']
+
+
+def run_download(youtube_url: str, audio_only: bool, output_path: str,
+                 max_playlist: int, abort_on_long_playlist: bool, do_postprocess: bool,
+                 progress_callback: Callable, playlist_items: Optional[str] = None,
+                 name_prefix: Optional[str] = None, source_only: bool = False,
+                 video_args: Optional[list[str]] = None, metrics: Optional[JobMetrics] = None,
+                 item_key: Optional[int] = None, control: Optional[JobControl] = None,
+                 share: Optional[bandwidth.JobShare] = None, sections: Optional[list] = None) -> list[str]:
+    item_metrics = metrics.item(item_key or 1) if metrics else None
+    if item_metrics:
+        item_metrics.enter('transfer')
+
+    with bandwidth.open_stream(share) as stream:
+        paced = stream is not None and control is not None and os.name != 'nt'
+
+        def on_event(event: dict, worker: WorkerProcess):
+            if event['event'] == 'progress':
+                if item_metrics and event['args'][1] == 'postprocess':
+                    item_metrics.enter('postprocess')
+                progress_callback(*event['args'])
+            elif event['event'] == 'transfer':
+                if item_metrics:
+                    item_metrics.add_transfer(event['done'])
+                if stream:
+                    if paced and stream.pace is None:
+                        stream.pace = functools.partial(control.hold, worker.process)
+                    stream.update_total(event['done'])
+            elif event['event'] == 'destination':
+                if control:
+                    control.track(event['path'])
+
+        result = run_job({
+            'op': 'download', 'url': youtube_url, 'audio_only': audio_only, 'output_path': output_path,
+            'max_playlist': max_playlist, 'abort_on_long_playlist': abort_on_long_playlist,
+            'do_postprocess': do_postprocess, 'playlist_items': playlist_items, 'name_prefix': name_prefix,
+            'source_only': source_only, 'video_args': video_args, 'sections': sections,
+            'rate_limit': stream.rate if stream and not paced else 0,
+            'archive': control and control.archive, 'resume': bool(control and control.resume),
+        }, on_event, control)
+
+    if item_metrics:
+        item_metrics.finish()
+    if result['event'] == 'error':
+        logger.error('error occurred when downloading: %s', result['args'])
+        raise ValueError(*result['args'])
+    if result['event'] == 'failed':
+        raise RuntimeError(result['message'])
+    return result['files']
+
+
+class RemoteStream:
+    def __init__(self, emit: Callable, rate: float):
+        self.emit = emit
+        self.rate = rate
+        self.on_rate = None
+        self.pace = None
+
+    def update_total(self, done: float):
+        self.emit('transfer', done=done)
+
+    def close(self):
+        pass
+
+
+class RemoteControl:
+    cancelled = False
+
+    def __init__(self, emit: Callable, archive: Optional[str] = None, resume: bool = False):
+        self.emit = emit
+        self.archive = archive
+        self.resume = resume
+
+    def checkpoint(self):
+        pass
+
+    def track(self, path: str):
+        self.emit('destination', path=path)
+
+
+class RemoteShare:
+    def __init__(self, emit: Callable, rate: float):
+        self.emit = emit
+        self.rate = rate
+
+    def stream(self, on_rate: Optional[Callable] = None, pace: Optional[Callable] = None) -> RemoteStream:
+        return RemoteStream(self.emit, self.rate)
+
+
+def scan_request(request: dict) -> dict:
+    from yt_dlp import YoutubeDL
+
+    options = {'quiet': True, 'extract_flat': 'in_playlist', 'playlist_items': f'1:{request["max_playlist"]}'}
+    with YoutubeDL(options) as ydl:
+        info = ydl.extract_info(request['url'], download=False)
+    if info.get('_type') != 'playlist':
+        return {'entries': [[0, info.get('extractor_key') or 'NA', info.get('id') or 'NA', info.get('title') or '',
+                             int(info.get('duration') or 0)]], 'length': 0}
+    entries = [[entry.get('playlist_index') or index, entry.get('ie_key') or entry.get('extractor_key') or 'NA',
+                entry.get('id') or 'NA', entry.get('title') or '', int(entry.get('duration') or 0)]
+               for index, entry in enumerate(info.get('entries') or (), start=1)]
+    return {'entries': entries, 'length': info.get('playlist_count') or len(entries)}
+
+
+def download_request(request: dict, emit: Callable) -> dict:
+    import ytdlp_engine
+    from downloader import Section
+
+    def progress_callback(value: int, label: Optional[str] = None, count: Optional[str] = None):
+        emit('progress', args=[value, label, count])
+
+    files = ytdlp_engine.run_download(
+        request['url'], request['audio_only'], request['output_path'], request['max_playlist'],
+        request['abort_on_long_playlist'], request['do_postprocess'], progress_callback,
+        playlist_items=request['playlist_items'], name_prefix=request['name_prefix'],
+        source_only=request['source_only'], video_args=request['video_args'],
+        control=RemoteControl(emit, request.get('archive'), request.get('resume', False)),
+        share=RemoteShare(emit, request['rate_limit']),
+        sections=[Section(*section) for section in request.get('sections') or ()] or None,
+    )
+    return {'files': files}
+
+
+def serve():
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    if sys.stderr is not None:
+        os.dup2(sys.stderr.fileno(), 1)
+    else:
+        with open(os.devnull, 'w') as devnull:
+            os.dup2(devnull.fileno(), 1)
+    requests = sys.stdin or os.fdopen(0, 'r')
+
+    def emit(event: str, **fields):
+        protocol.write(json.dumps({'event': event, **fields}) + '\n')
+
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+    emit('ready', rss=get_rss())
+
+    for line in requests:
+        request = json.loads(line)
+        try:
+            if request['op'] == 'scan':
+                result = scan_request(request)
+            else:
+                result = download_request(request, emit)
+            emit('done', rss=get_rss(), **result)
+        except ValueError as e:
+            emit('error', args=[str(arg) for arg in e.args], rss=get_rss())
+        except Exception as e:
+            logger.exception('yt-dlp worker job failed')
+            emit('failed', message=str(e), rss=get_rss())
+
+
+if __name__ == '__main__':
+    serve()